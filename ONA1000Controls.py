@@ -2,7 +2,7 @@
 A controller library for the ONA1000 based on TBControllerCommon
 """
 from TBControllerCommon import *
-import traceback
+from TBControllerAsync import *
 
 #Default Parameters
 defaultModuleName='TM400G-1' 
@@ -14,6 +14,14 @@ commonapps=[{"name":"100 Gig E Layer 2 Traffic Terminate", "appId":"TermEth100GL
              {"name": "100 Gig E KP4 FEC Layer 2 Traffic Terminate", "appId":"TermEth100GL2TrafficKP4FEC"}]
 
 ONA_PORTS=[1, 2]
+ONA_BASE_PORT=5025 #Port answering :PRTM:LIST? with the module RC ports
+
+def parseModuleList(resp):
+    """parseModuleList:
+    Parses the response of :PRTM:LIST? into a dict of module name to port
+    Inputs: resp (str) : The response, one or more lines of "name: port" pairs separated by commas
+    Returns dict of {moduleName: port}"""
+    return parseScpiMap(resp)
 
 class ONA1000Controls(Controller_base):
     """An object to control the ONA1000, 
@@ -29,7 +37,9 @@ class ONA1000Controls(Controller_base):
         timeout (int) : The socket timeout (default 30)
         moduleName (str) : the default module name, default is defaultModuleName value"""
         self.commonapps=commonapps
-        self.currentport = 5025
+        self.currentport = ONA_BASE_PORT
+        self.baseport = ONA_BASE_PORT
+        self.connectTimes={}
         self.isConnected=False
         self.ipValid=False
         self.isSession=False
@@ -40,7 +50,7 @@ class ONA1000Controls(Controller_base):
         self.validports=ONA_PORTS
         m = re.match('(\d+)\.(\d+)\.(\d+)\.(\d+)', targetip.strip())
         if not m:
-            writelog('Wrong IP format, please check and then continue')
+            transportLog.error('Wrong IP format, please check and then continue')
             raise ValueError(f"IP address of {targetip} is invalid")
         
         try:
@@ -49,7 +59,7 @@ class ONA1000Controls(Controller_base):
             #Line added: Set socket timeout (Was infinite before)
             self.soc.settimeout(timeout)
         except Exception as msg:
-            writelog(f'Failed to create socket. Error: {msg}')
+            transportLog.error('Failed to create socket. Error: %s', msg)
             return
 
         
@@ -57,73 +67,102 @@ class ONA1000Controls(Controller_base):
         self.isConnected=False
         self.laserStatus=False
         self.ipValid=True
-    def connect(self, verbose=False, numtries=2):
+    def poolKey(self):
+        """poolKey:
+        Returns the connectionPool key for this ONA-1000 module (ip, baseport, moduleName)"""
+        return (self.ip, self.baseport, self.moduleName)
+    @dispatched
+    def connect(self, verbose=False, numtries=2, usePool=True, deadline=30):
         """
         connect:
         Modified version of connect from tberd5800scriptSample with (verbose)
         and normal (quiet) modes.
         
-        Attempts (up to 2x) to connect to ONA-1000 to remote mode and sets connected status in object
+        Connects to ONA-1000 to remote mode and sets connected status in object
+        Polls :PRTM:LIST? with a short, growing wait until the module is listed or the deadline passes,
+        so connecting takes only as long as the instrument needs.
+        The seconds spent in each phase are stored in self.connectTimes
+        ("open", "modulelist", "rcopen", "total")
         Inputs:
         verbose (boolean) : Verbose mode when True (default False)
-        numtries (int) : Number of total attempts to connect (default 2)
+        numtries (int) : Unused, kept for compatibility; see deadline
+        usePool (boolean) : Reuse a connection from connectionPool if one is available (default True)
+        deadline (float) : The longest time in seconds to spend connecting (default 30)
         Returns True on successful connection, False othersise"""
         shh=not verbose
+        if usePool and self.connectFromPool():
+            return True
+        start=time.monotonic()
+        end=start+deadline
+        self.connectTimes={}
         try:
-            respflag=False
-            self.socketOpen(str(self.currentport))
-            time.sleep(1)
+            #Open base port and send *REM command
+            if self.socketOpen(str(self.baseport)) is False:
+                return False
             if self.debug:
                 self.socketSend("*REM VISIBLE ON", shh)
             else:
                 self.socketSend("*REM", shh)
-            for idx in range(numtries):
-                time.sleep(1)
-            #Open current port and send *REM command
-                # Verify the module is on and get module port number
-                self.socketSend(":PRTM:LIST?")
-                time.sleep(1)
-                resp = self.socketRead()
-                print(resp)
-                self.socketClose()
-                if resp.strip()!='':
-                    print("Got Successful Response")
-                    respflag=True
-                    break
-                else:
-                    time.sleep(2)
-            if not respflag:
+            phase=time.monotonic()
+            self.connectTimes["open"]=phase-start
+            # Verify the module is on and get module port number
+            modules=self.pollModuleList(end, shh)
+            self.socketClose()
+            self.connectTimes["modulelist"]=time.monotonic()-phase
+            if self.moduleName not in modules:
+                transportLog.error('Requested Module %s could not be found', self.moduleName)
                 return False
-            
-            resplines=resp.split('\n')
-            respjson=[]
-            #Manually parse responses from :PRTM:LIST? to get desired port
-            for line in resplines:
-                currjson={}
-                splitlines=line.split(',')
-                for splitline in splitlines:
-                    secondsplit=[x.strip() for x in splitline.split(':')]
-                    currjson[secondsplit[0]]=secondsplit[1]
-                respjson.append(currjson)
-            modFoundFlag=True
-            for line in respjson:
-                if self.moduleName in line.keys():
-                    modulePort=line[self.moduleName]
-                    modFoundFlag=True
-                    break
-            if not modFoundFlag:
-                raise RuntimeError('Requested Module could not be found')
-          
-           
+            modulePort=modules[self.moduleName]
             # Connect to the RC port
-            self.socketOpen(str(modulePort))
-            writelog("Connection opened to RC port " + str(self.currentport))
+            phase=time.monotonic()
+            if self.socketOpen(str(modulePort)) is False:
+                return False
+            self.connectTimes["rcopen"]=time.monotonic()-phase
+            self.connectTimes["total"]=time.monotonic()-start
+            transportLog.info("Connection opened to RC port %s", self.currentport)
+            if verbose:
+                transportLog.info("Connect times (s): %s", self.connectTimes)
             self.isConnected=True
             return True
         except Exception as msg:
-            info = traceback.format_exc()
-            writelog(info + 'Error code: ' + str(msg[0]) + ' , Error message : ' + msg[1])
+            transportLog.error('Error message : %s', msg, exc_info=True)
             return False
+    def pollModuleList(self, end, shh=True):
+        """pollModuleList:
+        Sends :PRTM:LIST? until the answer lists self.moduleName, waiting a little longer
+        after each unanswered or incomplete poll, up to the monotonic time end
+        Inputs:
+        end (float) : time.monotonic() value at which to give up
+        shh (boolean) : Quiet mode (default True)
+        Returns dict of {moduleName: port} from the last answer, empty if there was none"""
+        oldtimeout=self.gettimeout()
+        wait=POLLSTART
+        modules={}
+        try:
+            while True:
+                remaining=end-time.monotonic()
+                if remaining<=0:
+                    return modules
+                self.settimeout(min(wait, remaining))
+                self.socketSend(":PRTM:LIST?", shh)
+                try:
+                    resp=self.socketRead()
+                    #Module list may span several lines
+                    while self.hasBufferedLine():
+                        resp += '\n' + self.socketRead()
+                    if not shh:
+                        transportLog.info("%s", resp)
+                    modules=parseModuleList(resp)
+                    if self.moduleName in modules:
+                        return modules
+                    self.sleep(max(0, min(wait, end-time.monotonic())))
+                except TimeoutError:
+                    #Not answered yet; a late answer is just as good as the next one
+                    pass
+                wait=min(wait*2, POLLMAX)
+        finally:
+            self.settimeout(oldtimeout)
+    @dispatched
     def connectToApp(self, app, args=None, timeout=None, verbose=False, multiconnect=False):
         """Special Version of connectToApp with timeout required of at least 90 seconds
         INPUTS:
@@ -141,7 +180,82 @@ class ONA1000Controls(Controller_base):
             sto=90
         else:
             sto=timeout
-        super().connectToApp(app, args, sto, verbose, multiconnect)
+        return super().connectToApp(app, args, sto, verbose, multiconnect)
+    def openPortSession(self, port, app=None, timeout=None, verbose=False):
+        """openPortSession:
+        Opens another RC connection to this module with the application on port selected on it.
+        The selection belongs to the connection, so each port's session keeps its app selected
+        and the ports can be used at the same time (e.g. from two threads) without switching apps.
+        Example:
+            sessions=ona1.openPortSessions("TermEth100GL2Traffic")
+            with concurrent.futures.ThreadPoolExecutor() as pool:
+                temps=list(pool.map(lambda s: s.peek(0x16, poll=True), sessions.values()))
+            for session in sessions.values():
+                session.closePortSession()
+        Inputs:
+        port (int) : The port, one of ONA_PORTS
+        app (str) : The application name to use on port; launched on port if it is not running there
+                    (default None, use the application already running on port)
+        timeout (float) : Socket timeout of the session (default None, the same as this object)
+        verbose (boolean) : Verbose mode (default False)
+        Returns an ONA1000Controls for the port, None if it could not be opened"""
+        if int(port) not in ONA_PORTS:
+            raise ValueError(f"Port {port} is not one of {ONA_PORTS}")
+        port=str(port)
+        if timeout is None:
+            timeout=self.gettimeout()
+        session=ONA1000Controls(self.ip, debug=self.debug, timeout=timeout, moduleName=self.moduleName)
+        session.baseport=self.baseport
+        if not session.connect(verbose=verbose):
+            return None
+        try:
+            currapps=session.getCurrentApplications() or []
+            running=[x for x in currapps if x.getPort()==port]
+            if app is not None and (len(running)==0 or running[0].getappname()!=Application(appstr=app).getappname()):
+                if len(running)>0:
+                    appLog.error("Port %s already in use by %s", port, running[0])
+                    session.socketClose()
+                    return None
+                session.launchApplication(app, [port], verbose)
+                #The port's app list changed behind this object
+                self.invalidateApplications()
+            elif len(running)>0:
+                if not session.selectApp(running[0], verbose):
+                    session.socketClose()
+                    return None
+            else:
+                appLog.error("No application running on port %s", port)
+                session.socketClose()
+                return None
+        except Exception as e:
+            appLog.error("Port %s session failed : %s", port, e)
+            session.socketClose()
+            return None
+        session.sessionPort=port
+        return session
+    def openPortSessions(self, app=None, timeout=None, verbose=False):
+        """openPortSessions:
+        Opens a session (see openPortSession) on every port in ONA_PORTS
+        Returns dict of {port: ONA1000Controls} for the ports whose session opened"""
+        sessions={}
+        for port in ONA_PORTS:
+            session=self.openPortSession(port, app, timeout, verbose)
+            if session is not None:
+                sessions[port]=session
+        return sessions
+    def closePortSession(self):
+        """closePortSession:
+        Ends the session of a port session object and closes its connection, leaving the
+        application running (exit would exit the application and return the instrument to the GUI)"""
+        try:
+            if self.isSession:
+                self.sendscpi(":SESS:END")
+                self.isSession=False
+        except Exception as e:
+            appLog.warning("Session end failed : %s", e)
+        self.socketClose()
+        self.isConnected=False
+    @dispatched
     def exit(self, timeout=30):
         """exit:
         Gracefully exits remote mode and re-enables GUI 
@@ -151,6 +265,116 @@ class ONA1000Controls(Controller_base):
         self.sendscpi("*GUI")# Must return to gui, returns to default app 
         self.socketClose()
 
+class AsyncONA1000Controls(AsyncController_base):
+    """An asyncio object to control the ONA1000,
+    a subclass of TBControllerAsync.AsyncController_base
+    All instrument methods are coroutines; many objects can share one event loop
+    """
+    def __init__(self, targetip, debug=False, timeout=30, moduleName=defaultModuleName):
+        """__init__:
+        Initializes an object of type AsyncONA1000Controls
+        Inputs:
+        targetip (str) : The target ip address
+        debug (Boolean) : Debug mode (Default false)
+        timeout (int) : The socket timeout (default 30)
+        moduleName (str) : the default module name, default is defaultModuleName value"""
+        super().__init__(targetip, debug, timeout)
+        self.commonapps=commonapps
+        self.currentport = ONA_BASE_PORT
+        self.baseport = ONA_BASE_PORT
+        self.connectTimes={}
+        self.moduleName=moduleName
+        self.validports=ONA_PORTS
+    async def connect(self, verbose=False, numtries=2, deadline=30):
+        """
+        connect:
+        Connects to ONA-1000 to remote mode and sets connected status in object
+        Polls :PRTM:LIST? with a short, growing wait until the module is listed or the deadline passes.
+        The seconds spent in each phase are stored in self.connectTimes
+        Inputs:
+        verbose (boolean) : Verbose mode when True (default False)
+        numtries (int) : Unused, kept for compatibility; see deadline
+        deadline (float) : The longest time in seconds to spend connecting (default 30)
+        Returns True on successful connection, False othersise"""
+        shh=not verbose
+        start=time.monotonic()
+        end=start+deadline
+        self.connectTimes={}
+        try:
+            if not await self.socketOpen(self.baseport):
+                return False
+            if self.debug:
+                await self.socketSend("*REM VISIBLE ON", shh)
+            else:
+                await self.socketSend("*REM", shh)
+            phase=time.monotonic()
+            self.connectTimes["open"]=phase-start
+            modules=await self.pollModuleList(end, shh)
+            await self.socketClose(shh=True)
+            self.connectTimes["modulelist"]=time.monotonic()-phase
+            if self.moduleName not in modules:
+                transportLog.error('Requested Module %s could not be found', self.moduleName)
+                return False
+            # Connect to the RC port
+            phase=time.monotonic()
+            if not await self.socketOpen(modules[self.moduleName]):
+                return False
+            self.connectTimes["rcopen"]=time.monotonic()-phase
+            self.connectTimes["total"]=time.monotonic()-start
+            transportLog.info("Connection opened to RC port %s", self.currentport)
+            if verbose:
+                transportLog.info("Connect times (s): %s", self.connectTimes)
+            self.isConnected=True
+            return True
+        except Exception as msg:
+            transportLog.error('Connect failed: %s', msg)
+            return False
+    async def pollModuleList(self, end, shh=True):
+        """pollModuleList:
+        Sends :PRTM:LIST? until the answer lists self.moduleName, waiting a little longer
+        after each unanswered or incomplete poll, up to the monotonic time end
+        Returns dict of {moduleName: port} from the last answer, empty if there was none"""
+        wait=POLLSTART
+        modules={}
+        while True:
+            remaining=end-time.monotonic()
+            if remaining<=0:
+                return modules
+            await self.socketSend(":PRTM:LIST?", shh)
+            try:
+                resp=(await asyncio.wait_for(self.reader.readline(), min(wait, remaining))).decode("utf-8").strip()
+                modules=parseModuleList(resp)
+                #Module list may span several lines
+                while resp!='' and self.moduleName not in modules:
+                    try:
+                        resp=(await asyncio.wait_for(self.reader.readline(), POLLSTART)).decode("utf-8").strip()
+                    except asyncio.TimeoutError:
+                        break
+                    modules.update(parseModuleList(resp))
+                if self.moduleName in modules:
+                    return modules
+                await asyncio.sleep(max(0, min(wait, end-time.monotonic())))
+            except asyncio.TimeoutError:
+                #Not answered yet; a late answer is just as good as the next one
+                pass
+            wait=min(wait*2, POLLMAX)
+    async def connectToApp(self, app, args=None, timeout=None, verbose=False, multiconnect=False):
+        """Special Version of connectToApp with timeout required of at least 90 seconds
+        See AsyncController_base.connectToApp"""
+        if timeout is None or timeout<90:
+            sto=90
+        else:
+            sto=timeout
+        return await super().connectToApp(app, args, sto, verbose, multiconnect)
+    async def exit(self, timeout=30):
+        """exit:
+        Gracefully exits remote mode and re-enables GUI 
+        Version for ONA-1000"""
+        self.settimeout(timeout)
+        await self.sendscpi(":EXIT")
+        await self.sendscpi("*GUI")# Must return to gui, returns to default app 
+        await self.socketClose()
+
 """
 Any question about the script, please contact Brad Sicotte at 
 email: bsicotte@teracomm.com
@@ -2,6 +2,8 @@
 Provides a simple GUI interface for basic ONA1000 Commands
 v2.0 : Initialization of ONA1000 does not hang up TKinter window
 v3.1b : Uses python3.2 and above's concurrent.futures to allow wait for peek
+v4.0 : Commands are queued to one background worker and never block the window; results and
+       the progress indicator are updated on the Tk thread through window.after
 Required Libraries:
 ONA1000Controls (Depends on TBControllerCommon)
 tkinter
@@ -10,8 +12,8 @@ concurrent.futures
 Python Version must be at least 3.2
 """
 import tkinter
+import tkinter.ttk
 from ONA1000Controls import *
-import time
 import concurrent.futures
 #Set default settings
 defaultfont='TkDefaultFont'
@@ -19,70 +21,120 @@ stickall="news"
 DEFAULT_PAD_X=8
 DEFAULT_PAD_Y=3
 DEFAULT_FONT_SETTINGS=(defaultfont, 10)
+TEXT_BOX_MAX_LINES=200 #Oldest result lines are dropped beyond this
 #Set the IP Address Here
 defaultIpAddr='192.168.1.20'
 defaultApp="TermEth100GL2Traffic 1"
 #Initiate
 ona1=ONA1000Controls(defaultIpAddr)
 TEXT_BOX_START_IDX="1.0"
-threadManager=concurrent.futures.ThreadPoolExecutor()
-currthreads=[]
-def get_live_threads(curr=currthreads):
-    """get_live_threads:
-    Checks threads in list curr and appends all live ones to a new array
-    Returns new array
+#One worker, so queued commands reach the ONA one at a time and in order
+threadManager=concurrent.futures.ThreadPoolExecutor(max_workers=1)
+pendingFutures=[]
+runningOperation=None
+
+def callInTk(func, *args):
+    """callInTk:
+    Schedules func(*args) on the Tk thread; safe to call from any thread.
+    Does nothing once the window has been closed"""
+    try:
+        window.after(0, func, *args)
+    except (RuntimeError, tkinter.TclError):
+        pass
+
+def runInBackground(description, func, *args, ondone=None):
+    """runInBackground:
+    Queues func(*args) on the worker thread and returns at once.
+    When it finishes, ondone(result) is called on the Tk thread and its return value,
+    if any, is written to the text box; an exception is written to the text box instead.
     Inputs:
-    curr (Array) : The list of threads (currthreads array is default)
-    Returns
-    List of active threads
-    """
-    livethreads=[]
-    for thr in curr:
-        if isinstance(thr, concurrent.futures.Future) and thr.running():
-            livethreads.append(thr)
-        #Save for Thread if necessary
-    return livethreads
-    
-def printPeekVal():
-    """printPeekVal:
-    Function to print peek value using threading, receiving input from TKinter GUI"""
-    currthreads=get_live_threads()
-    #if len(currthreads)>0:
-    #    print(f'Error: {len(currthreads)} active threads, must be 0')
-    #    write_text_box(f'Error: {len(currthreads)} active threads, must be 0')
-    #    return False
-    peekval=getInt(peekentry.get())
-    
-    peekthread=threadManager.submit(ona1.peek, peekval)
-    time.sleep(0.5)
-    currthreads.append(peekthread)
-    idx=0
-    while peekthread.running():
-        #print(f"Executing Peek Command {idx}")
-        write_text_box(f"Executing Peek Command ({idx})")
-        time.sleep(1)
-        idx+=1
-    write_text_box(f'PEEK {hex(peekval)} returned {hex(peekthread.result())}')
-    #print("Test button pressed.")
+    description (str) : What the operation does, shown while it waits and runs
+    func (function) : The function to run
+    args : The arguments of func
+    ondone (function) : Called with the result on the Tk thread (default None)
+    Returns the Future of the operation"""
+    def work():
+        #Worker thread: only hand Tk work back to the Tk thread
+        callInTk(startedOperation, description)
+        return func(*args)
+    future=threadManager.submit(work)
+    pendingFutures.append(future)
+    future.add_done_callback(lambda done: callInTk(finishedOperation, description, done, ondone))
+    update_progress()
+    return future
+
+def startedOperation(description):
+    """startedOperation:
+    Tk thread callback when the worker starts an operation"""
+    global runningOperation
+    runningOperation=description
+    update_progress()
+
+def finishedOperation(description, future, ondone):
+    """finishedOperation:
+    Tk thread callback when an operation is done: shows its result and updates the progress indicator"""
+    global runningOperation
+    if future in pendingFutures:
+        pendingFutures.remove(future)
+    if runningOperation==description:
+        runningOperation=None
+    if future.cancelled():
+        write_text_box(f'{description} cancelled')
+    elif future.exception() is not None:
+        write_text_box(f'{description} failed : {future.exception()}')
+    elif ondone is not None:
+        message=ondone(future.result())
+        if message is not None:
+            write_text_box(message)
+    update_progress()
+
+def update_progress():
+    """update_progress:
+    Shows the running operation and the number queued behind it, and runs the progress bar while busy"""
+    queued=len(pendingFutures)
+    if queued==0:
+        progressbar.stop()
+        statuslabel.config(text="Idle")
+        return
+    #Between two operations the next one is about to start
+    status=runningOperation if runningOperation is not None else "Starting"
+    queued-=1
+    if queued>0:
+        status+=f' ({queued} queued)'
+    statuslabel.config(text=status)
+    progressbar.start(20)
 
-def pokebuttonpressed():
-    """pokebuttonpressed
-    Function to execute poke command using threading, receiving input
-    from TKinter GUI"""
-    currthreads=get_live_threads()
-    if len(currthreads)>0:
-        #print(f'Error: {len(currthreads)} active threads, must be 0')
-        write_text_box(f'Error: {len(currthreads)} active threads, must be 0')
-        return False
-    write_text_box("Executing Poke Command")
-    pokeaddr=pokeaddrentry.get()
-    pokeval=pokevalentry.get()
-    #DUMMY LOAD
-    pokethread=threadManager.submit(ona1.poke, getInt(pokeaddr), getInt(pokeval))
-    currthreads.append(pokethread)
-    write_text_box(f'POKE {pokeaddr}, {pokeval} retured {pokethread.result()}')
-    return True
- 
+def formatHex(value):
+    """formatHex:
+    Returns value in hex if it is an integer, otherwise as a string"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return hex(value)
+    return str(value)
+
+def startPeek():
+    """startPeek
+    Queues a PEEK of the address in the Peek entry"""
+    try:
+        peekval=getInt(peekentry.get().strip())
+    except Exception as e:
+        write_text_box(f'Invalid PEEK address {peekentry.get()}')
+        return None
+    return runInBackground(f'PEEK {hex(peekval)}', ona1.peek, peekval,
+                           ondone=lambda result: f'PEEK {hex(peekval)} returned {formatHex(result)}')
+
+def startPoke():
+    """startPoke
+    Queues a POKE of the Poke Value entry to the Poke Address entry"""
+    pokeaddr=pokeaddrentry.get().strip()
+    pokeval=pokevalentry.get().strip()
+    try:
+        addr=getInt(pokeaddr)
+        val=getInt(pokeval)
+    except Exception as e:
+        write_text_box(f'Invalid POKE address or value {pokeaddr}, {pokeval}')
+        return None
+    return runInBackground(f'POKE {pokeaddr}, {pokeval}', ona1.poke, addr, val,
+                           ondone=lambda result: f'POKE {pokeaddr}, {pokeval} returned {result}')
 
 def readtextbox():
     """readtextbox:
@@ -91,22 +143,25 @@ def readtextbox():
     textboxvals=[x.strip() for x in textboxrawstr.split('\n')]
     print(textboxvals)
 
-def scpipressed():
-    """scpipressed
-    A thread-based function to receive scpi info from TKinter GUI
-    and run scpi command"""
+def startScpi():
+    """startScpi
+    Queues the SCPI command in the SCPI entry"""
     scpival=scpientry.get().strip()
-    scpireturn=ona1.sendscpi(scpival)
-    write_text_box(f'SCPI {scpival} returned {scpireturn}')
+    if scpival=='':
+        return None
+    return runInBackground(f'SCPI {scpival}', ona1.sendscpi, scpival,
+                           ondone=lambda result: f'SCPI {scpival} returned {result}')
 
 def write_text_box(str):
-    """Writes to text box
+    """Adds a line to the end of the text box; call from the Tk thread only
     Inputs:
     str (string) : The string to write"""
     textbox1.config(state=tkinter.NORMAL)
-    textbox1.delete("1.0", "end")
-    textval=str.strip()
-    textbox1.insert('1.0', textval)
+    textbox1.insert("end", str.strip()+'\n')
+    lines=int(textbox1.index("end-1c").split('.')[0])
+    if lines>TEXT_BOX_MAX_LINES:
+        textbox1.delete(TEXT_BOX_START_IDX, f'{lines-TEXT_BOX_MAX_LINES+1}.0')
+    textbox1.see("end")
     textbox1.config(state=tkinter.DISABLED)
 
 def connect_to_ona():
@@ -116,89 +171,27 @@ def connect_to_ona():
     try:
         ona1.settimeout(60)
         ona1.connect()
-        time.sleep(0.5)
         ona1.setRemoteOn()
-        time.sleep(0.5)
+        ona1.waitReady()
         ona1.connectToApp(defaultApp)
     except Exception as e:
-        time.sleep(10)
+        #connect polls until its own deadline, so retry straight away
         ona1.connect()
-        time.sleep(0.5)
         ona1.setRemoteOn()
-        time.sleep(0.5)
+        ona1.waitReady()
         ona1.connectToApp(defaultApp)
 
-def init_ona1000():
-    """init_ona1000:
-    Thread-based function to connect to ONA and print timer 
-    on the text box"""
-    currthreads=get_live_threads()
-    write_text_box("Connecting To ONA1000")
-    time.sleep(0.5)
-    timerthread=threadManager.submit(connect_to_ona)
-    time.sleep(0.5)
-    currthreads.append(timerthread)
-    idx=0
-    while timerthread.running():
-        #print(idx)
-        write_text_box(f'Connnecting: {idx}/max 90')
-        time.sleep(1)
-        idx+=1
-    #thread2.join() #Auto joins timerthread
-    #time.sleep(1)
-    timerthread.cancel()
-    write_text_box("App Connected")
-
-def exitApp():
-    
-    currthreads=get_live_threads()
-    write_text_box("Exiting ONA1000 App")
-    time.sleep(0.5)
-    exitthread=threadManager.submit(ona1.exit)
-    time.sleep(0.5)
-    currthreads.append(exitthread)
-    idx=0
-    while exitthread.running():
-        #print(idx)
-        write_text_box(f'Exiting: {idx}/max 60')
-        time.sleep(1)
-        idx+=1
-    #thread2.join() #Auto joins timerthread
-    #time.sleep(1)
-    write_text_box("App Exited")
-
-
-def startThread(func):
-    """startThread:
-    Start a new thread given func
-    Inputs:
-    func (function) :  the function to execute"""
-    currthreads=get_live_threads()
-    thread1=threadManager.submit(func)
-    currthreads.append(thread1)
-    return thread1
-def startPeek():
-    """startPeek
-    Start the PEEK thread"""
-    write_text_box("Executing PEEK Function")
-    startThread(printPeekVal)
-def startPoke():
-    """startPoke
-    Start the POKE thread"""
-    write_text_box("Executing POKE Function")
-    startThread(pokebuttonpressed)
 def initfunc():
     """initfunc
-    Start the init thread"""
-    startThread(init_ona1000)
-def startScpi():
-    """startScpi
-    Start the SCPI thread"""
-    write_text_box("Executing SCPI Command")  
-    startThread(scpipressed)
+    Queues the connection to the ONA1000; commands queued meanwhile run once it is connected"""
+    write_text_box("Connecting To ONA1000")
+    runInBackground("Connecting to ONA1000", connect_to_ona, ondone=lambda result: "App Connected")
+
 def startExit():
+    """startExit
+    Queues exiting the ONA1000 app"""
     write_text_box("Exiting ONA App")
-    startThread(exitApp)
+    runInBackground("Exiting ONA1000 App", ona1.exit, ondone=lambda result: "App Exited")
 
 if __name__=='__main__':
     #Define main window
@@ -252,6 +245,11 @@ if __name__=='__main__':
     exitbutton.grid(row=7, column=1, sticky=stickall, padx=DEFAULT_PAD_X, pady=DEFAULT_PAD_Y)
     textbox1=tkinter.Text(frame, width=80, height=12, state=tkinter.DISABLED)
     textbox1.grid(row=8, column=0, columnspan=3, sticky=stickall, padx=DEFAULT_PAD_X, pady=DEFAULT_PAD_Y)
+
+    statuslabel=tkinter.Label(frame, text="Idle", font=DEFAULT_FONT_SETTINGS, anchor="w")
+    statuslabel.grid(row=9, column=0, columnspan=2, sticky=stickall, padx=DEFAULT_PAD_X, pady=DEFAULT_PAD_Y)
+    progressbar=tkinter.ttk.Progressbar(frame, mode='indeterminate')
+    progressbar.grid(row=9, column=2, sticky=stickall, padx=DEFAULT_PAD_X, pady=DEFAULT_PAD_Y)
     
     #Pack the frame centered in the window
     frame.pack()
@@ -259,7 +257,10 @@ if __name__=='__main__':
     window.after(100, initfunc)
     #Main loop : Blocks until window is closed
     window.mainloop()
-    #Exit ONA after window is closed
+    #Drop queued commands, let the running one finish, then exit ONA after window is closed
+    for future in pendingFutures:
+        future.cancel()
+    threadManager.shutdown(wait=True)
     ona1.exit()
 
 
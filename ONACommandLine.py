@@ -14,7 +14,6 @@ DEBUG=False
 ipaddr=input(f"Please enter the ip address of the ONA-1000 to connect:\n")
 try:
     ona1=ONA1000Controls(targetip=ipaddr, timeout=10, debug=DEBUG)
-    time.sleep(1)
     ona1.connect()
 except Exception as e:
     print(f"Did not connect to ONA-1000 Correctly: Exception {e}")
@@ -28,7 +27,7 @@ while not ona1.isConnected:
         print(f"Did not connect to ONA-1000 Correctly: Exception {e}")
 writelog("Entering Remote mode.")
 ona1.setRemoteOn()
-time.sleep(1)
+ona1.waitReady()
 #Bring up app selection screen automatically after connecting to remote   
 #Will automatically reconnect if necessary
 try:
@@ -0,0 +1,187 @@
+"""TBBenchmark.py
+Benchmarks the controller hot paths (connect, connectToApp, sendscpi, peek/poke,
+getCurrentApplications) against a local TBSimulator instrument with configurable latency.
+Reports p50/p95/p99 latency, throughput and round trips per operation, and can save
+results as a baseline and compare later runs against it.
+
+Usage:
+    python TBBenchmark.py --type ONA --latency 0.002 --iterations 50
+    python TBBenchmark.py --save-baseline baseline.json
+    python TBBenchmark.py --baseline baseline.json --tolerance 0.2
+Exits with status 1 if any operation regressed against the baseline.
+"""
+from ONA1000Controls import *
+from TBERD5800Controls import TBERD5800Controls
+from TBSimulator import *
+import json
+import sys
+
+def percentile(sortedvals, pct):
+    """percentile:
+    Nearest-rank percentile of an already sorted list
+    Inputs:
+    sortedvals (list(float)) : The sorted values
+    pct (float) : The percentile from 0 to 100
+    Returns the value at pct, None if sortedvals is empty"""
+    if len(sortedvals)==0:
+        return None
+    idx=max(0, min(len(sortedvals)-1, int(round(pct/100.0*len(sortedvals)+0.5))-1))
+    return sortedvals[idx]
+
+class RoundTripCounter:
+    """class RoundTripCounter:
+    Counts the responses a controller reads, one per round trip to the instrument"""
+    def __init__(self):
+        self.count=0
+    def attach(self, ctrl):
+        """attach:
+        Wraps ctrl.readLine so every response read is counted
+        Returns ctrl"""
+        readLine=ctrl.readLine
+        def countedReadLine():
+            self.count+=1
+            return readLine()
+        ctrl.readLine=countedReadLine
+        return ctrl
+
+def timeOperation(name, func, iterations, counter):
+    """timeOperation:
+    Runs func iterations times and summarizes the timings
+    Inputs:
+    name (str) : The operation name
+    func (function) : The operation; called with the iteration index
+    iterations (int) : Number of runs
+    counter (RoundTripCounter) : Counter attached to the controller(s) func uses
+    Returns dict of {"name", "iterations", "p50", "p95", "p99", "mean", "throughput", "roundtrips", "failures"}"""
+    times=[]
+    failures=0
+    startcount=counter.count
+    start=time.perf_counter()
+    for idx in range(iterations):
+        t0=time.perf_counter()
+        try:
+            result=func(idx)
+            if result is None or result is False:
+                failures+=1
+        except Exception as e:
+            writelog(f"{name} failed: {e}")
+            failures+=1
+        times.append(time.perf_counter()-t0)
+    total=time.perf_counter()-start
+    times.sort()
+    return {"name":name, "iterations":iterations,
+            "p50":percentile(times, 50), "p95":percentile(times, 95), "p99":percentile(times, 99),
+            "mean":sum(times)/len(times), "throughput":iterations/total if total>0 else None,
+            "roundtrips":(counter.count-startcount)/iterations, "failures":failures}
+
+def newController(kind, sim, counter):
+    """newController:
+    Creates a controller of kind ("ONA" or "TBERD") pointed at sim, with counted reads"""
+    if kind=="ONA":
+        ctrl=ONA1000Controls("127.0.0.1", timeout=10)
+    else:
+        ctrl=TBERD5800Controls("127.0.0.1", timeout=10)
+    ctrl.baseport=sim.baseport
+    return counter.attach(ctrl)
+
+def runBenchmarks(kind="ONA", latency=0.002, jitter=0.0, iterations=50, i2cTime=0.02,
+                  peekDelay=0.05, seed=1):
+    """runBenchmarks:
+    Starts a simulator and times each controller hot path against it
+    Inputs:
+    kind (str) : "ONA" or "TBERD" (default "ONA")
+    latency (float) : Simulated seconds per command (default 0.002)
+    jitter (float) : Simulated extra random seconds per command (default 0)
+    iterations (int) : Runs per operation (default 50)
+    i2cTime (float) : Simulated seconds per I2C transaction (default 0.02)
+    peekDelay (float) : delay passed to fixed-delay peek/poke (default 0.05)
+    seed (int) : Simulator random seed (default 1)
+    Returns dict of {operation name: result dict from timeOperation}, plus "config" holding the inputs"""
+    appname="TermEth100GL2Traffic 1"
+    results={"config":{"type":kind, "latency":latency, "jitter":jitter, "iterations":iterations,
+                       "i2cTime":i2cTime, "peekDelay":peekDelay}}
+    counter=RoundTripCounter()
+    with InstrumentSimulator(kind, latency=latency, jitter=jitter, i2cTime=i2cTime, seed=seed) as sim:
+        def connectOnce(idx):
+            ctrl=newController(kind, sim, counter)
+            status=ctrl.connect(usePool=False)
+            ctrl.socketClose()
+            return status
+        ctrl=newController(kind, sim, counter)
+        ctrl.connect(usePool=False)
+        ctrl.connectToApp(appname)
+        ops=[("connect", connectOnce),
+             ("connectToApp", lambda idx: ctrl.connectToApp(appname)),
+             ("getCurrentApplications", lambda idx: ctrl.getCurrentApplications()),
+             ("sendscpi query", lambda idx: ctrl.sendscpi(":OUTPUT:OPTIC?")),
+             ("sendscpi command", lambda idx: ctrl.sendscpi(":OUTPUT:OPTIC ON")),
+             ("sendscpi_batch x5", lambda idx: ctrl.sendscpi_batch([":OUTPUT:OPTIC?"]*5)),
+             ("peek", lambda idx: ctrl.peek(0x22, delay=peekDelay)),
+             ("peek poll", lambda idx: ctrl.peek(0x22, delay=peekDelay, poll=True)),
+             ("poke", lambda idx: ctrl.poke(0x90, idx & 0xff, page=3, delay=peekDelay)),
+             ("poke poll", lambda idx: ctrl.poke(0x90, idx & 0xff, page=3, delay=peekDelay, poll=True))]
+        for name, func in ops:
+            results[name]=timeOperation(name, func, iterations, counter)
+        ctrl.socketClose()
+    return results
+
+def compareToBaseline(results, baseline, tolerance=0.2):
+    """compareToBaseline:
+    Finds operations whose p50 latency or round trips grew by more than tolerance
+    Inputs:
+    results (dict) : Results from runBenchmarks
+    baseline (dict) : Earlier results from runBenchmarks
+    tolerance (float) : Allowed fractional increase (default 0.2)
+    Returns list of (operation, metric, baseline value, new value)"""
+    regressions=[]
+    if baseline.get("config", {}).get("type")!=results.get("config", {}).get("type"):
+        print("Baseline was recorded against a different instrument type; not comparing")
+        return regressions
+    for name, result in results.items():
+        base=baseline.get(name)
+        if name=="config" or base is None:
+            continue
+        for metric in ("p50", "roundtrips"):
+            if base.get(metric) is None or result.get(metric) is None:
+                continue
+            if result[metric]>base[metric]*(1+tolerance)+1e-9:
+                regressions.append((name, metric, base[metric], result[metric]))
+    return regressions
+
+def printResults(results, regressions=None):
+    """printResults:
+    Prints the results as a table, followed by any regressions"""
+    print(f"{'operation':<24}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'trips':>8}{'fail':>6}")
+    for name, res in results.items():
+        if name=="config":
+            continue
+        print(f"{name:<24}{res['p50']*1000:>10.2f}{res['p95']*1000:>10.2f}{res['p99']*1000:>10.2f}"
+              f"{res['throughput']:>10.1f}{res['roundtrips']:>8.1f}{res['failures']:>6}")
+    if regressions:
+        print("Regressions against baseline:")
+        for name, metric, old, new in regressions:
+            print(f"  {name} {metric}: {old:.4g} -> {new:.4g}")
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser()
+    parser.add_argument('--type', '-t', help='Instrument type, ONA or TBERD', default='ONA')
+    parser.add_argument('--latency', '-L', type=float, default=0.002, help='Simulated seconds per command')
+    parser.add_argument('--jitter', '-J', type=float, default=0.0, help='Simulated extra random seconds per command')
+    parser.add_argument('--iterations', '-n', type=int, default=50, help='Runs per operation')
+    parser.add_argument('--i2ctime', type=float, default=0.02, help='Simulated seconds per I2C transaction')
+    parser.add_argument('--peekdelay', type=float, default=0.05, help='delay for fixed-delay peek/poke')
+    parser.add_argument('--baseline', '-b', help='Baseline JSON file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed fractional regression')
+    parser.add_argument('--save-baseline', '-s', help='Write the results to this JSON file')
+    args=parser.parse_args()
+    results=runBenchmarks(args.type.upper(), args.latency, args.jitter, args.iterations,
+                          args.i2ctime, args.peekdelay)
+    regressions=[]
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as fp:
+            regressions=compareToBaseline(results, json.load(fp), args.tolerance)
+    printResults(results, regressions)
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    sys.exit(1 if regressions else 0)
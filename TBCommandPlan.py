@@ -0,0 +1,286 @@
+"""TBCommandPlan.py
+Compiles a command file (the runCommand format, one command per line) into a list of typed
+operations before anything is sent to the instrument, optimizes the list, and runs it.
+Optimizing merges adjacent operations that can share round trips:
+    adjacent PEEKs are read with one pipelined peek_list
+    adjacent SCPI queries are sent as one sendscpi_batch
+    consecutive DELAYs become one delay
+Example:
+    plan=CommandPlan.fromFile("testcmd.txt")
+    if len(plan.errors)==0:
+        plan.optimize()
+        results=plan.run(ona1)
+results holds one entry per line of the file, as runCommand would have returned for that line.
+"""
+from TBControllerCommon import *
+import time
+
+#Commands that need a user at the keyboard and cannot run from a file
+INTERACTIVECOMMANDS=("APP", "MULTIAPP", "ACTIVE")
+
+class CommandOp:
+    """class CommandOp:
+    One operation of a CommandPlan
+    kind (str) : The operation: NOP, HELP, EXIT, CURR, GETACTIVE, START, MULTISTART, CLOSEAPP,
+                 PEEK, POKE, DELAY, SCPI, or after optimizing PEEKS (several PEEKs) and QUERIES
+                 (several SCPI queries)
+    args (tuple or list) : The arguments of the operation; a list of the merged operations' arguments
+                           for PEEKS and QUERIES, and the total time for a merged DELAY
+    lines (list(int)) : The indexes of the file lines this operation produces results for"""
+    def __init__(self, kind, args, lines):
+        self.kind=kind
+        self.args=args
+        self.lines=lines
+    def __str__(self):
+        """__str__:
+        Returns a string representation of the operation with the lines it covers"""
+        lines=','.join(str(x+1) for x in self.lines)
+        return f"[{lines}] {self.kind} {self.args}"
+
+def parseRegisterArgs(kind, args, counts):
+    """parseRegisterArgs:
+    Converts PEEK/POKE arguments to integers in 0x00..0xff
+    Inputs:
+    kind (str) : PEEK or POKE, for error messages
+    args (list(str)) : The arguments
+    counts (tuple(int)) : The allowed numbers of arguments
+    Returns list of int
+    Throws ValueError if the arguments are invalid"""
+    if len(args) not in counts:
+        raise ValueError(f"{kind} command must have {' or '.join(str(x) for x in counts)} arguments")
+    values=[]
+    for arg in args:
+        try:
+            value=getInt(arg)
+        except Exception as e:
+            raise ValueError(f"{kind} argument {arg} is not an integer")
+        if value<0 or value>0xff:
+            raise ValueError(f"{kind} argument {arg} is out of range (0x00 to 0xff)")
+        values.append(value)
+    return values
+
+def compileLine(text, lineidx):
+    """compileLine:
+    Compiles one command line into a CommandOp
+    Inputs:
+    text (str) : The command line
+    lineidx (int) : The index of the line in the file
+    Returns CommandOp
+    Throws ValueError if the line is not a valid file command"""
+    splitcmd=text.strip().split(maxsplit=1)
+    if len(splitcmd)==0:
+        return CommandOp("NOP", (), [lineidx])
+    kind=splitcmd[0].upper()
+    rest=splitcmd[1] if len(splitcmd)>1 else ''
+    args=rest.split()
+    if kind=="QUIT":
+        kind="EXIT"
+    if kind in ("HELP", "EXIT", "CURR", "GETACTIVE"):
+        return CommandOp(kind, (), [lineidx])
+    if kind in INTERACTIVECOMMANDS:
+        raise ValueError(f"{kind} command does not work in auto/file mode")
+    if kind in ("START", "MULTISTART"):
+        if len(args)==0:
+            raise ValueError(f"{kind} command must have 1 or more arguments")
+        return CommandOp(kind, (' '.join(args),), [lineidx])
+    if kind=="CLOSEAPP":
+        if len(args)!=1:
+            raise ValueError("CLOSEAPP must have 1 argument in auto mode")
+        return CommandOp(kind, (args[0],), [lineidx])
+    if kind=="PEEK":
+        values=parseRegisterArgs(kind, args, (1, 2))
+        if len(values)==1:
+            values=[0x00]+values
+        #(page, register)
+        return CommandOp(kind, tuple(values), [lineidx])
+    if kind=="POKE":
+        values=parseRegisterArgs(kind, args, (2, 3))
+        if len(values)==2:
+            values=[0x00]+values
+        #(page, register, value)
+        return CommandOp(kind, tuple(values), [lineidx])
+    if kind=="DELAY":
+        if len(args)==0:
+            raise ValueError("DELAY command must have one argument")
+        try:
+            seconds=float(args[0])
+        except ValueError:
+            raise ValueError(f"DELAY value {args[0]} is not a number")
+        if seconds<0:
+            raise ValueError(f"DELAY value {args[0]} is negative")
+        return CommandOp(kind, seconds, [lineidx])
+    if kind=="SCPI":
+        if rest.strip()=='':
+            raise ValueError("SCPI command must have one argument")
+        return CommandOp(kind, rest.strip(), [lineidx])
+    raise ValueError(f"Command of type {splitcmd[0]} not recognized")
+
+def isBatchQuery(op):
+    """isBatchQuery:
+    Returns True if op is an SCPI query with a single response line, which can go in a QUERIES batch"""
+    return op.kind=="SCPI" and op.args.count('?')==1 and ';' not in op.args
+
+class CommandPlan:
+    """class CommandPlan:
+    A command file compiled into CommandOps
+    lines (list(str)) : The command lines
+    ops (list(CommandOp)) : The operations, in order
+    errors (list(tuple)) : (line index, line, message) for each line that did not compile"""
+    def __init__(self, lines):
+        """Initializes an object of type CommandPlan, compiling every line
+        Inputs:
+        lines (list(str)) : The command lines"""
+        self.lines=[x.rstrip('\n') for x in lines]
+        self.ops=[]
+        self.errors=[]
+        for idx, text in enumerate(self.lines):
+            try:
+                self.ops.append(compileLine(text, idx))
+            except ValueError as e:
+                self.errors.append((idx, text, str(e)))
+
+    @classmethod
+    def fromFile(cls, path):
+        """fromFile:
+        Compiles the command file at path
+        Returns CommandPlan"""
+        with open(path, 'r') as fp:
+            return cls(fp.readlines())
+
+    def __str__(self):
+        """__str__:
+        Returns the operations one per line, followed by any errors"""
+        out=[str(op) for op in self.ops]
+        out+=[f"Line {idx+1} ({text.strip()}): {msg}" for idx, text, msg in self.errors]
+        return '\n'.join(out)
+
+    def optimize(self):
+        """optimize:
+        Merges adjacent PEEKs into PEEKS, adjacent SCPI queries into QUERIES and consecutive DELAYs
+        into one DELAY. Order is kept, so no operation moves past another.
+        Returns self"""
+        ops=[]
+        for op in self.ops:
+            last=ops[-1] if len(ops)>0 else None
+            query=isBatchQuery(op)
+            if last is not None and op.kind=="PEEK" and last.kind in ("PEEK", "PEEKS"):
+                if last.kind=="PEEK":
+                    last=ops[-1]=CommandOp("PEEKS", [last.args], list(last.lines))
+                last.args.append(op.args)
+                last.lines+=op.lines
+            elif (last is not None and query and
+                  (last.kind=="QUERIES" or isBatchQuery(last))):
+                if last.kind=="SCPI":
+                    last=ops[-1]=CommandOp("QUERIES", [last.args], list(last.lines))
+                last.args.append(op.args)
+                last.lines+=op.lines
+            elif last is not None and op.kind=="DELAY" and last.kind=="DELAY":
+                ops[-1]=CommandOp("DELAY", last.args+op.args, last.lines+op.lines)
+            else:
+                ops.append(op)
+        self.ops=ops
+        return self
+
+    def run(self, ctrl, delay=DEFAULTDELAY, poll=False, verbose=False, sinks=None, keepResults=True,
+            deadline=None):
+        """run:
+        Runs the operations on ctrl, stopping after EXIT
+        Inputs:
+        ctrl (Controller_base) : The connected instrument
+        delay (float) : PEEK/POKE delay in seconds, or the longest wait with poll (default DEFAULTDELAY)
+        poll (boolean) : Poll PEEK/POKE for completion instead of always waiting delay (default False)
+        verbose (boolean) : Verbose mode (default False)
+        sinks (list(ResultSink)) : Sinks each result is written to, in line order, as soon as its
+                                   command finishes (default None)
+        keepResults (boolean) : Collect and return the results (default True); turn off with sinks
+                                to keep memory constant on long runs
+        deadline (float) : time.monotonic() time after which no further operation is started
+                           (default None, no limit)
+        Returns list with one result per line: the value, True for success, False for failure;
+        None if keepResults is False"""
+        results=[False]*len(self.lines) if keepResults else None
+        numlines=len(self.lines)
+        nextline=0
+        for op in self.ops:
+            if deadline is not None and time.monotonic()>deadline:
+                appLog.warning("Deadline passed; not running lines %d to %d", op.lines[0]+1, numlines)
+                break
+            appLog.info("command %s (%d/%d)", op.kind, op.lines[-1]+1, numlines)
+            start=time.monotonic()
+            try:
+                values=self.runOp(ctrl, op, delay, poll, verbose)
+            except Exception as e:
+                appLog.error("Run command %s failed : %s", op, e)
+                values=[False]*len(op.lines)
+            #Merged lines share one round trip, so each gets the time of the whole operation
+            latency=time.monotonic()-start
+            for idx, value in zip(op.lines, values):
+                self.emit(sinks, results, idx, value, latency)
+            nextline=op.lines[-1]+1
+            if op.kind=="EXIT":
+                break
+        #Lines after EXIT or the deadline were not run
+        for idx in range(nextline, numlines):
+            self.emit(sinks, results, idx, False)
+        return results
+
+    def emit(self, sinks, results, idx, value, latency=None):
+        """emit:
+        Records the result of line idx in results, if kept, and writes it to each sink
+        with the seconds its operation took, if known"""
+        if results is not None:
+            results[idx]=value
+        if sinks is not None:
+            for sink in sinks:
+                sink.write(idx+1, self.lines[idx], value, latency=latency)
+
+    def runOp(self, ctrl, op, delay, poll, verbose):
+        """runOp:
+        Runs one operation on ctrl
+        Returns list of results, one per line of op"""
+        kind=op.kind
+        if kind=="NOP":
+            return [False]
+        if kind=="HELP":
+            printHelp(auto=True)
+            return [True]
+        if kind=="EXIT":
+            appLog.info("Exiting Application")
+            ctrl.exit()
+            return ["EXIT"]
+        if kind=="CURR":
+            currapps=ctrl.getCurrentApplications()
+            runningapp=ctrl.getActiveApp()
+            for idx in range(len(currapps)):
+                appLog.info("%s[%d] %s", '>' if currapps[idx]==runningapp else '', idx+1, currapps[idx])
+            return [True]
+        if kind=="GETACTIVE":
+            return [ctrl.getActiveApp()]
+        if kind in ("START", "MULTISTART"):
+            return [ctrl.connectToApp(app=op.args[0], multiconnect=kind=="MULTISTART")]
+        if kind=="CLOSEAPP":
+            return [bool(ctrl.closeApplication(op.args[0]))]
+        if kind=="PEEK":
+            return [ctrl.peek(op.args[1], page=op.args[0], delay=delay, verbose=verbose, poll=poll)]
+        if kind=="PEEKS":
+            values=ctrl.peek_list(op.args, delay=delay, verbose=verbose, poll=poll)
+            if values is None:
+                return [False]*len(op.lines)
+            return [False if value is None else value for value in values]
+        if kind=="POKE":
+            page, register, value=op.args
+            return [ctrl.poke(register, value, page=page, delay=delay, verbose=verbose, poll=poll)]
+        if kind=="DELAY":
+            ctrl.sleep(op.args, prefix="DELAY")
+            return [True]*len(op.lines)
+        if kind=="SCPI":
+            if '?' not in op.args:
+                #A raw command may launch or exit apps behind the cached app list
+                ctrl.invalidateApplications()
+            return [ctrl.sendscpi(op.args, verbose=verbose)]
+        if kind=="QUERIES":
+            values=ctrl.sendscpi_batch(op.args, verbose=verbose, parse=False)
+            if values is None:
+                return [False]*len(op.lines)
+            return values
+        raise ValueError(f"Unknown operation {kind}")
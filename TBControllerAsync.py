@@ -0,0 +1,548 @@
+"""TBControllerAsync.py
+Defines an asyncio counterpart of TBControllerCommon.Controller_base, so that many
+TB5800/ONA series instruments can be driven from one event loop instead of one thread each.
+Note that class AsyncController_base is abstract and should not be used on its own;
+use AsyncONA1000Controls (ONA1000Controls.py) or AsyncTBERD5800Controls (TBERD5800Controls.py).
+
+Example:
+    async def main(iplist):
+        onas=[AsyncONA1000Controls(ip) for ip in iplist]
+        await asyncio.gather(*[ona.connect() for ona in onas])
+        await asyncio.gather(*[ona.connectToApp("TermEth100GL2Traffic 1") for ona in onas])
+        return await asyncio.gather(*[ona.peek(0x22) for ona in onas])
+    asyncio.run(main(["192.168.1.35", "192.168.1.36"]))
+"""
+from TBControllerCommon import *
+import asyncio
+
+class AsyncController_base():
+    """class AsyncController_base
+    An Abstract class for common/shared coroutines for TB5800/ONA1000 remote operations
+    Each controller owns one asyncio stream; every command/response exchange holds self.lock,
+    so several coroutines may share one controller without reading each other's responses.
+    A whole PEEK or POKE, from PAGESEL to readback, holds self.i2cLock so they do not interleave.
+    Note that connect is abstract and must be implemented."""
+    def __init__(self, targetip, debug=False, timeout=30):
+        """__init__:
+        Initializes the common state of an async controller
+        Inputs:
+        targetip (str) : The target ip address
+        debug (Boolean) : Debug mode (Default false)
+        timeout (float) : The timeout of each socket operation in seconds (default 30)"""
+        m = re.match(r'(\d+)\.(\d+)\.(\d+)\.(\d+)', targetip.strip())
+        if not m:
+            transportLog.error('Wrong IP format, please check and then continue')
+            raise ValueError(f"IP address of {targetip} is invalid")
+        self.ip=targetip.strip()
+        self.debug=debug
+        self.timeout=timeout
+        self.reader=None
+        self.writer=None
+        self.lock=asyncio.Lock()
+        self.i2cLock=asyncio.Lock()
+        self.isConnected=False
+        self.isSession=False
+        self.curr=None
+        self.laserStatus=False
+        self.ipValid=True
+    async def connect(self, verbose=False):
+        #Blank function, must be implemented for each type of instrument
+        pass
+    async def exit(self, timeout=30):
+        """exit:
+        Gracefully exits remote mode and re-enables GUI"""
+        self.settimeout(timeout)
+        await self.sendscpi(":EXIT")
+        if not self.debug:
+            await self.sendscpi("*GUI")# Must return to gui, returns to default app
+        await self.socketClose()
+
+    def settimeout(self, timeout):
+        """settimeout:
+        Sets the timeout used for every socket operation
+        inputs:
+        timeout (float): The new timeout in seconds, None for no timeout"""
+        self.timeout=timeout
+
+    def gettimeout(self):
+        """gettimeout:
+        gets the current socket timeout and returns it"""
+        return self.timeout
+
+    def getConnected(self):
+        """Return whether device is connected"""
+        return self.isConnected
+
+    def getActiveApp(self):
+        """Returns current app"""
+        return self.curr
+
+    async def socketOpen(self, sport=''):
+        """socketOpen:
+        Opens a stream to self.ip on the given port, closing any open stream; sets self.currentport
+        Returns True if executed successfully, False on exception"""
+        if str(sport).strip() == "":
+            transportLog.error("socketOpen: 'port' parameter is required")
+            return False
+        try:
+            self.currentport = int(sport)
+        except Exception as e:
+            transportLog.error("sport must be an integer or string convertible to integer")
+            return False
+        await self.socketClose(shh=True)
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.ip, self.currentport), self.timeout)
+            return True
+        except Exception as msg:
+            transportLog.error('Failed to open connection to port %s. Error: %s', self.currentport, msg)
+            return False
+
+    async def socketClose(self, shh=False):
+        """socketClose:
+        Close the object's stream
+        returns True if close is successful"""
+        if self.writer is None:
+            return True
+        try:
+            self.writer.close()
+            await self.writer.wait_closed()
+            if not shh:
+                transportLog.info("Socket connection closed")
+            return True
+        except Exception as e:
+            transportLog.error('Exception: %s', e)
+            return False
+        finally:
+            self.reader=None
+            self.writer=None
+
+    async def socketSend(self, message, shh=0):
+        """socketSend:
+        send a message to the stream, append a \\n if there isn't one
+        Returns the message sent, None on failure"""
+        message = message.strip()
+        if shh == 0:
+            transportLog.info("%s", message)
+        try:
+            self.writer.write((message+"\n").encode("utf-8"))
+            await asyncio.wait_for(self.writer.drain(), self.timeout)
+            return message
+        except asyncio.TimeoutError:
+            raise TimeoutError("Socket send timed out")
+        except Exception:
+            transportLog.error('message Send failed ==> :%s', message)
+            return None
+
+    async def socketRead(self):
+        """socketRead:
+        Reads one newline-terminated response from the stream, stripped
+        Returns '' if the connection was closed
+        Throws TimeoutError if no full response arrives within the timeout"""
+        try:
+            msg = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("Socket read timed out")
+        return msg.decode("utf-8").strip()
+
+    async def waitReady(self, timeout=10, verbose=False):
+        """waitReady:
+        Waits until the instrument answers on the current connection, instead of a fixed delay
+        Inputs:
+        timeout (float) : The longest time to wait in seconds (default 10)
+        verbose (boolean) : Verbose mode (default False)
+        Returns the time waited in seconds, or None if the instrument did not answer"""
+        start=time.monotonic()
+        oldtimeout=self.gettimeout()
+        self.settimeout(timeout)
+        try:
+            async with self.lock:
+                if await self.socketSend(":SYST:ERR?", shh=not verbose) is None:
+                    return None
+                if await self.socketRead()=='':
+                    transportLog.warning("Connection closed while waiting for the instrument")
+                    return None
+            return time.monotonic()-start
+        except TimeoutError as te:
+            transportLog.warning("Instrument not ready after %s s", timeout)
+            return None
+        finally:
+            self.settimeout(oldtimeout)
+
+    async def setRemoteOn(self):
+        """setRemoteOn:
+        Sets the instrument into remote mode
+        Returns True if executed successfully, False on exception"""
+        try:
+            if self.debug:
+                await self.socketSend("*REM VISIBLE ON")
+            else:
+                await self.socketSend("*REM")
+            return True
+        except Exception as e:
+            return False
+
+    async def sendscpi(self, cmd, verbose=False):
+        """sendscpi:
+        Sends a SCPI command and waits for its answer
+        Query commands: returns the value returned by the command
+        Non-query commands: follows up with :SYSTem:ERRor? in the same write and returns
+        the command followed by the error query response, as Controller_base.sendscpi does
+        Returns None if the send fails or times out"""
+        shh=not verbose
+        cmd=cmd.strip()
+        query='?' in cmd
+        async with self.lock:
+            try:
+                if query:
+                    sendval=await self.socketSend(cmd, shh=shh)
+                else:
+                    sendval=await self.socketSend(cmd+"\n:SYST:ERR?", shh=shh)
+                if sendval is None:
+                    transportLog.error("Socket send error.")
+                    return None
+                resp=await self.socketRead()
+            except TimeoutError as te:
+                transportLog.warning("SCPI command timed out")
+                return None
+        if not shh:
+            transportLog.info("%s %s", cmd, resp)
+        if query:
+            return resp
+        return cmd + ":SYST:ERR?" + resp
+
+    async def sendscpi_batch(self, cmds, verbose=False, checkErrors=True):
+        """sendscpi_batch:
+        Sends a list of SCPI commands in a single write and reads back every response in order
+        Inputs:
+        cmds (list(str)) : The SCPI commands (including arguments)
+        verbose (boolean) : if set, echo the commands sent and responses received
+        checkErrors (boolean) : Follow each non-query with :SYST:ERR? (Default True)
+        Returns a list with one entry per command, as Controller_base.sendscpi_batch does,
+        or None if the send fails or times out"""
+        shh=not verbose
+        cmdlist=[x.strip() for x in cmds if x is not None and x.strip()!='']
+        if len(cmdlist)==0:
+            return []
+        sendlist=[]
+        isquery=[]
+        for cmd in cmdlist:
+            query='?' in cmd
+            isquery.append(query)
+            sendlist.append(cmd)
+            if not query and checkErrors:
+                sendlist.append(":SYST:ERR?")
+        numresp=sum(1 for x in sendlist if '?' in x)
+        async with self.lock:
+            try:
+                sendval=await self.socketSend('\n'.join(sendlist), shh=shh)
+                if sendval is None:
+                    transportLog.error("Socket send error.")
+                    return None
+                resps=[]
+                for idx in range(numresp):
+                    resps.append(await self.socketRead())
+            except TimeoutError as te:
+                transportLog.warning("SCPI batch timed out")
+                return None
+        if not shh:
+            transportLog.info("%s", resps)
+        results=[]
+        respidx=0
+        for query in isquery:
+            if query:
+                results.append(parseScpiValue(resps[respidx]))
+                respidx+=1
+            elif checkErrors:
+                results.append(resps[respidx])
+                respidx+=1
+            else:
+                results.append(None)
+        return results
+
+    async def getCurrentApplications(self, timeout=10, verbose=False):
+        """getCurrentApplications:
+        Returns a list of current applications, None on timeout
+        Inputs: timeout (int) - the timeout time, default 10
+                verbose (Boolean) - Verbose mode if True"""
+        olddelay=self.gettimeout()
+        self.settimeout(timeout)
+        try:
+            retval=await self.sendscpi(":SYST:APPL:CAPP?")
+        finally:
+            self.settimeout(olddelay)
+        if retval is None:
+            return None
+        if verbose:
+            print(retval)
+        return parseAppList(retval)
+
+    async def getPortsInUse(self, currapps=None):
+        """getPortsInUse:
+        Gets the current ports in use
+        Inputs: currapps (list(Application)) - Current applications if already known
+        Returns:
+        A list of the current ports in use"""
+        if currapps is None:
+            currapps=await self.getCurrentApplications()
+        return [app.getPort() for app in (currapps or []) if isinstance(app, Application)]
+
+    async def selectApp(self, app, verbose=False, launch=False):
+        """selectApp:
+        Selects current application from already running application
+        Inputs:
+        app (Application or str) : Application object or appId of the app
+        verbose (bool) : Verbose mode
+        launch (Boolean) : Sends ":INIT" after the session commands to launch session
+        Returns True if successful"""
+        if isinstance(app, Application):
+            apidstr=app.getAppId()
+            if apidstr is None:
+                appLog.error("Invalid application object called")
+                return False
+        else:
+            apidstr=app
+        apidstr=apidstr.strip()
+        cmds=[]
+        if self.isSession:
+            cmds.append(":SESS:END")
+        cmds+=[":SYST:APPL:SEL " + apidstr, ":SESS:CREATE", ":SESS:START"]
+        if launch:
+            cmds.append(":INIT")
+        if await self.sendscpi_batch(cmds, verbose=verbose) is None:
+            return False
+        self.isSession=True
+        self.curr=Application(appId=apidstr)
+        if verbose:
+            appLog.info("Application launched successfully")
+        return True
+
+    async def launchApplication(self, application, args=None, verbose=False):
+        """launchApplication - Low Level coroutine to launch an application with given args
+        INPUTS:
+        application (str) - The name of the application
+        args (list(str)) - The arguments; default None
+        verbose (Boolean) - Verbose mode on or off
+        Throws runtime error if application is not found
+        Returns True if successful"""
+        apporig=application
+        if args is not None:
+            for x in args:
+                apporig+=' '+x
+        appstr=":SYST:APPL:LAUN "+apporig
+        appLog.info("Launching appication %s", apporig)
+        apstval=await self.sendscpi(appstr, verbose=verbose)
+        if not scpiSucceeded(apstval):
+            raise RuntimeError(f"Application was not found: {appstr} returned {apstval}")
+        appId=await self.sendscpi(":SYST:APPL:LAUN?", verbose)
+        # Applications begin in the "Stopped" state in RC mode, so :INIT starts the test
+        await self.selectApp(appId, verbose=verbose, launch=True)
+        appLog.info("Application launched successfully")
+        return True
+
+    async def closeApplication(self, appid, currapps=None):
+        """Closes an application
+        Inputs:
+        appid (str): The appid to close
+        currapps (list(Application)) - Current applications if already known
+        Returns True if successful, False otherwise"""
+        if currapps is None:
+            currapps=await self.getCurrentApplications()
+        if Application(appId=appid.strip()) not in (currapps or []):
+            appLog.warning("App to close not in current applications; not closing app")
+            return False
+        if await self.sendscpi_batch([":SYST:APPL:SEL "+appid, ":EXIT"]) is None:
+            appLog.error("Exit command failed")
+            return False
+        self.curr=None
+        self.isSession=False
+        return True
+
+    async def connectToApp(self, app, args=None, timeout=None, verbose=False, multiconnect=False):
+        """High level coroutine to connect to / launch application
+        Switches to the app if it is already running, otherwise launches it.
+
+        INPUTS:
+        app (string) : The name of the application to launch, or alternatively the application to launch with arguments
+        args (string) : The arguments to append to app
+        timeout (float) : The timeout for launching application only; timeout will be reset after this command ends
+        verbose (boolean) : Verbose Mode (default False)
+        multiconnect (boolean) : Allow connection to multiple apps; will close other apps if False
+        (Default False)
+        Returns:
+        True if completed successfully
+        False otherwise"""
+        if app is None:
+            appLog.error("App must be defined.  Not starting app")
+            return False
+        appLog.info("Connecting to Application")
+        connflag=self.isConnected
+        if not connflag and not await self.connect():
+            return False
+        #Remember timeout and make sure timeout>=60s.
+        oldtimeout=self.gettimeout()
+        if timeout is not None and timeout>60:
+            self.settimeout(timeout)
+        elif oldtimeout is None or oldtimeout<60:
+            self.settimeout(60)
+        try:
+            if isinstance(app, Application):
+                apb=app
+            elif args is not None:
+                apb=Application(appname=app, port=args)
+            else:
+                apb=parseToApplication(app)
+            currapps=[]
+            runningapp=None
+            if connflag:
+                currapps=await self.getCurrentApplications() or []
+                for x in currapps:
+                    if x==apb:
+                        runningapp=x
+                        break
+            if runningapp is not None:
+                if not multiconnect:
+                    #Close others
+                    for appx in currapps:
+                        if appx!=runningapp and not await self.closeApplication(appx.getAppId(), currapps):
+                            return False
+                appLog.info("Application already open; switching to %s", runningapp)
+                return await self.selectApp(runningapp, verbose, launch=True)
+            if multiconnect:
+                appport=apb.getPort()
+                if appport in await self.getPortsInUse(currapps if connflag else None):
+                    appLog.error("Port %s already in use.\nCannot start new app on existing active port", appport)
+                    return False
+            else:
+                await self.sendscpi("*RST")
+            if isinstance(app, Application):
+                app=app.getAppId()
+            return await self.launchApplication(app, args, verbose)
+        except Exception as e:
+            appLog.error("Application Launch Failed: Exception: %s", e)
+            return False
+        finally:
+            #Resume old timeout
+            self.settimeout(oldtimeout)
+
+    async def waitI2C(self, kind, timeout=DEFAULTDELAY, verbose=False):
+        """waitI2C:
+        Polls :SENSE:DATA? :SENSE:EXPERT:I2C:<kind>:SUCCESS until the transaction has completed,
+        with the same stale flag guard as Controller_base.waitI2C
+        Inputs:
+        kind (str) : "PEEK" or "POKE"
+        timeout (float) : The longest time to wait in seconds (Default DEFAULTDELAY)
+        verbose (boolean) : verbose mode on or off (Default False)
+        Returns the last SUCCESS value read (1 on success), or None if it could not be read"""
+        start=time.monotonic()
+        wait=POLLSTART
+        seenBusy=False
+        status=None
+        while True:
+            resp=await self.sendscpi(f":SENSE:DATA? :SENSE:EXPERT:I2C:{kind}:SUCCESS", verbose=verbose)
+            elapsed=time.monotonic()-start
+            status=parseScpiInt(resp)
+            if status==1 and seenBusy:
+                return status
+            if status==0:
+                seenBusy=True
+            if elapsed>=timeout:
+                if status!=1:
+                    i2cLog.warning("%s did not complete within %s s", kind, timeout)
+                return status
+            await asyncio.sleep(max(0, min(wait, timeout-elapsed)))
+            wait=min(wait*2, I2CPOLLMAX)
+
+    async def peek(self, register, page=0x00, delay=DEFAULTDELAY, verbose=False, returnStatus=False, poll=False):
+        """
+        peek
+        Peeks at one of the Module's I2C registers
+
+        Inputs:
+        register (int) : The register number to look into from 0x00 to 0xff
+        page (int) : The page number from 0x00 to 0xff
+        delay (float) : The delay value in seconds; Too short of a delay can result in wrong info.
+                        With poll, the longest time to wait for the PEEK to complete
+        verbose (boolean) : verbose mode on or off (Default False)
+        returnStatus (boolean) : Returns dict of {"VALUE":value, "SUCCESS":success} if True
+        Otherwise returns value
+        poll (boolean) : Poll for completion (see waitI2C) instead of always waiting delay (Default False)
+        Returns None on exception"""
+        if page>0xff or page<0:
+            raise ValueError(f"Page value of {hex(page)} is out of range")
+        if register>0xff or register<0:
+            raise ValueError(f"Register value of {hex(register)} is out of range")
+        if verbose:
+            i2cLog.info("Sending PEEK command to page %#x register %#x", page, register)
+        try:
+            async with self.i2cLock:
+                setup=await self.sendscpi_batch([f":SENSE:EXPERT:I2C:PEEK:PAGESEL {page}",
+                                                 f":SENSE:EXPERT:I2C:PEEK:REGADDR {register}",
+                                                 ":SENSE:EXPERT:I2C:PEEK:TRIGGER"], verbose=verbose)
+                if setup is None:
+                    return None
+                success=None
+                if poll:
+                    success=await self.waitI2C("PEEK", delay, verbose)
+                else:
+                    await asyncio.sleep(delay)
+                readback=[":SENSE:DATA? :SENSE:EXPERT:I2C:PEEK:REGDATA"]
+                if returnStatus and not poll:
+                    readback.append(":SENSE:DATA? :SENSE:EXPERT:I2C:PEEK:SUCCESS")
+                vals=await self.sendscpi_batch(readback, verbose=verbose)
+                peekval=parseScpiInt(vals[0])
+                if peekval is None:
+                    raise ValueError(f"PEEK returned {vals[0]}")
+                i2cLog.info("PEEK value : %#x", peekval)
+                if not returnStatus:
+                    return peekval
+                if poll:
+                    return {"VALUE": peekval, "SUCCESS": success}
+                return {"VALUE": peekval, "SUCCESS": parseScpiInt(vals[1])}
+        except Exception as e:
+            i2cLog.error('Exception %s', e)
+            return None
+
+    async def poke(self, register, value, page=0x00, delay=DEFAULTDELAY, verbose=False, poll=False):
+        """
+        poke
+        Pokes one of the Module's I2C registers with a value
+
+        Inputs:
+        register (int) : The register number to look into from 0x00 to 0xff
+        value (int): The value to poke the register with.
+        page (int) : The page number from 0x00 to 0xff
+        delay (float) : The delay value in seconds (Default 1.3)
+                      Delay of 0 means send poke and don't wait for response.
+                      With poll, the longest time to wait for the POKE to complete
+        verbose (boolean) : verbose mode on or off (Default False)
+        poll (boolean) : Poll for completion (see waitI2C) instead of always waiting delay (Default False)
+        Return poke success if successful, None if not"""
+        if page>0xff or page<0:
+            raise ValueError(f"Page value of {hex(page)} is out of range (0x00 to 0xff)")
+        if register>0xff or register<0:
+            raise ValueError(f"Register value of {hex(register)} is out of range (0x00 to 0xff)")
+        if value>0xff or value<0:
+            raise ValueError(f"Poke value of {hex(value)} is out of range (0x00 to 0xff)")
+        if verbose:
+            i2cLog.info("sending POKE to page %#x register %#x with value %#x", page, register, value)
+        try:
+            async with self.i2cLock:
+                setup=await self.sendscpi_batch([f":SENSE:EXPERT:I2C:POKE:PAGESEL {page}",
+                                                 f":SENSE:EXPERT:I2C:POKE:REGADDR {register}",
+                                                 f":SENSE:EXPERT:I2C:POKE:REGDATA {value}",
+                                                 ":SENSE:EXPERT:I2C:POKE:TRIGGER"], verbose=verbose)
+                if setup is None or delay<=0:
+                    return None
+                if poll:
+                    return await self.waitI2C("POKE", delay, verbose)
+                await asyncio.sleep(delay)
+                return parseScpiInt(await self.sendscpi(":SENSE:DATA? :SENSE:EXPERT:I2C:POKE:SUCCESS", verbose=verbose))
+        except Exception as e:
+            i2cLog.error('Exception %s', e)
+            return None
+
+"""
+Any question about the script, please contact Brad Sicotte at
+email: bsicotte@teracomm.com
+"""
@@ -64,10 +64,26 @@ autohelpstr="""Auto Mode:
 """
 #Set global variables
 DEFAULTDELAY=1.3
+RECVSIZE=8192 #Size of each socket recv into the read buffer
+POLLSTART=0.05 #First wait in seconds when polling the instrument for readiness
+POLLMAX=1.0 #Longest wait in seconds between readiness polls
+I2CPOLLMAX=0.2 #Longest wait in seconds between I2C completion polls
+APPLISTMAXAGE=5.0 #Seconds a cached :SYST:APPL:CAPP? snapshot is used before it is queried again
 import time
 import re
 import socket
-import datetime
+import collections
+import threading
+import select
+import functools
+import bisect
+import json
+import logging
+import logging.handlers
+import queue
+import atexit
+import sys
+import concurrent.futures
 def getInt(str):
     """Gets an integer in either hex (with 0x),  binary (0b), or decimal (no prefix) from a string
     Inputs: str (str) : The string to be converted
@@ -81,6 +97,177 @@ def getInt(str):
         return int(str, 2)
     #Assume decimal
     return int(str)
+#SCPI response parsing: every instrument reply is decoded by the functions below, with patterns
+#compiled once here.  Typed parsers return None for a reply that is not of their type
+#(including None, the reply of a failed or timed out command) rather than raising.
+#Matches SCPI numeric responses (NR1/NR2/NR3 formats)
+_intpattern=re.compile(r'[+-]?\d+$')
+_floatpattern=re.compile(r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?$')
+#Non-decimal integers: #H1F, #Q17, #B101 (IEEE 488.2) or 0x1F
+_radixpattern=re.compile(r'(?:#([HQB])|0([xX]))([0-9A-Fa-f]+)$')
+_radixbases={'H':16, 'Q':8, 'B':2, 'x':16, 'X':16}
+#A quoted string; a quote inside it is doubled
+_quotedpattern=re.compile(r'"((?:[^"]|"")*)"$', re.DOTALL)
+#An error queue entry: code[, "message"]
+_errorpattern=re.compile(r'\s*([+-]?\d+)\s*(?:,\s*(.*?))?\s*$', re.DOTALL)
+SCPIBOOLEANS={"1":True, "0":False, "ON":True, "OFF":False, "TRUE":True, "FALSE":False}
+
+def parseScpiInt(resp):
+    """parseScpiInt:
+    Converts a SCPI response to an int: decimal, #H/#Q/#B or 0x radix, or an integral float
+    Inputs: resp (str) : The response string
+    Returns int, or None if resp is not an integer"""
+    try:
+        #Plain decimal is by far the most common reply, as in I2C polling loops
+        return int(resp)
+    except (TypeError, ValueError):
+        pass
+    if resp is None:
+        return None
+    val=resp.strip()
+    match=_radixpattern.match(val)
+    if match:
+        try:
+            return int(match.group(3), _radixbases[match.group(1) or match.group(2)])
+        except ValueError:
+            #A digit out of range for the radix, such as #B102
+            return None
+    if _floatpattern.match(val):
+        value=float(val)
+        if value.is_integer():
+            return int(value)
+    return None
+
+def parseScpiFloat(resp):
+    """parseScpiFloat:
+    Converts a SCPI response to a float
+    Inputs: resp (str) : The response string
+    Returns float, or None if resp is not numeric"""
+    if resp is None:
+        return None
+    val=resp.strip()
+    if _floatpattern.match(val):
+        return float(val)
+    value=parseScpiInt(val)
+    return float(value) if value is not None else None
+
+def parseScpiBool(resp):
+    """parseScpiBool:
+    Converts a SCPI boolean response (1/0, ON/OFF, TRUE/FALSE) to a bool
+    Inputs: resp (str) : The response string
+    Returns bool, or None if resp is not a boolean"""
+    if resp is None:
+        return None
+    return SCPIBOOLEANS.get(resp.strip().upper())
+
+def parseScpiString(resp):
+    """parseScpiString:
+    Removes the quotes from a quoted SCPI string response, undoubling quotes inside it
+    Inputs: resp (str) : The response string
+    Returns str, the stripped response if it is not quoted, or None if resp is None"""
+    if resp is None:
+        return None
+    val=resp.strip()
+    match=_quotedpattern.match(val)
+    if match:
+        return match.group(1).replace('""', '"')
+    return val
+
+def parseScpiValue(resp):
+    """parseScpiValue:
+    Converts a SCPI response into an int or float if it is numeric
+    Inputs: resp (str) : The response string
+    Returns int, float, or the stripped string if resp is not numeric"""
+    val=resp.strip()
+    if _intpattern.match(val):
+        return int(val)
+    if _floatpattern.match(val):
+        return float(val)
+    return val
+
+def parseScpiError(resp):
+    """parseScpiError:
+    Splits a :SYST:ERR? response such as 0, "No error" into its code and message.
+    resp may also be what sendscpi returns for a non-query command, the command echo
+    followed by :SYST:ERR? and its response
+    Inputs: resp (str) : The response string
+    Returns tuple (code, message); code is None if resp is not a valid error response"""
+    if resp is None:
+        return (None, '')
+    idx=resp.rfind(":SYST:ERR?")
+    if idx>=0:
+        resp=resp[idx+len(":SYST:ERR?"):]
+    match=_errorpattern.match(resp)
+    if not match:
+        return (None, resp.strip())
+    return (int(match.group(1)), parseScpiString(match.group(2) or ''))
+
+def scpiSucceeded(resp):
+    """scpiSucceeded:
+    Returns True if resp, a :SYST:ERR? response or the return of sendscpi for a non-query command,
+    reports no error"""
+    return parseScpiError(resp)[0]==0
+
+def splitScpiResponse(resp, sep=';'):
+    """splitScpiResponse:
+    Splits a SCPI response on sep, ignoring any sep inside quoted strings
+    Inputs: resp (str) : The response string
+            sep (str) : The single character separator (default ';')
+    Returns a list of the response fields"""
+    if '"' not in resp:
+        return resp.split(sep)
+    fields=[]
+    start=0
+    inquote=False
+    for idx, ch in enumerate(resp):
+        if ch=='"':
+            inquote=not inquote
+        elif ch==sep and not inquote:
+            fields.append(resp[start:idx])
+            start=idx+1
+    fields.append(resp[start:])
+    return fields
+
+def parseScpiList(resp, parse=parseScpiValue, sep=','):
+    """parseScpiList:
+    Splits a list response on sep (outside quoted strings) and parses each item
+    Inputs: resp (str) : The response string
+            parse (function) : Parser for each stripped item, or None to keep strings (default parseScpiValue)
+            sep (str) : The single character separator (default ',')
+    Returns list, without empty items; empty if resp is None"""
+    if resp is None:
+        return []
+    items=[]
+    for item in splitScpiResponse(resp, sep):
+        item=item.strip()
+        if item!='':
+            items.append(parse(item) if parse is not None else item)
+    return items
+
+def parseScpiMap(resp, parse=None, sep=',', kvsep=':'):
+    """parseScpiMap:
+    Parses a response of key/value pairs such as "name1: value1, name2: value2",
+    which may span several lines
+    Inputs: resp (str) : The response string
+            parse (function) : Parser for each stripped value, or None to keep strings (default None)
+            sep (str) : The separator between pairs (default ',')
+            kvsep (str) : The separator between a key and its value (default ':')
+    Returns dict of {key: value}; items without kvsep are skipped"""
+    pairs={}
+    if resp is None:
+        return pairs
+    for line in resp.split('\n'):
+        for item in splitScpiResponse(line, sep):
+            key, found, value=item.partition(kvsep)
+            if found:
+                value=value.strip()
+                pairs[key.strip()]=parse(value) if parse is not None else value
+    return pairs
+
+#Parsers by name, for callers that choose the type of a reply at run time
+SCPIPARSERS={"int":parseScpiInt, "float":parseScpiFloat, "bool":parseScpiBool, "str":parseScpiString,
+             "value":parseScpiValue, "list":parseScpiList, "error":parseScpiError, "map":parseScpiMap}
+
 def printHelp(auto=False):
     """printHelp:
     Prints help string to console"""
@@ -99,6 +286,13 @@ def parseToApplication(apstr):
     else:
         return Application(appstr=apstr)
 
+def parseAppList(retval):
+    """parseAppList:
+    Parses the response of :SYST:APPL:CAPP? into Application objects
+    inputs: retval (str): The comma separated list of appIds
+    returns: a list of Application objects, empty if retval is empty"""
+    return [Application(appId=x) for x in parseScpiList(retval, parse=None)]
+
 class Application:
     """class Application:
     A simple class to hold the name and port of an application, and/or
@@ -171,14 +365,465 @@ class Application:
 
 
     
-def writelog(information):
-    """writelog: prints the date and time formatted, and the given message to the console
+#Loggers: TBController and one child per subsystem.  Pass arguments separately
+#(log.info("PEEK value : %#x", value)) so messages are only formatted if they are written
+logger=logging.getLogger("TBController")
+transportLog=logging.getLogger("TBController.transport") #Sockets, connections and SCPI traffic
+appLog=logging.getLogger("TBController.app") #Applications and sessions
+i2cLog=logging.getLogger("TBController.i2c") #PEEK/POKE
+LOGFORMAT="%(asctime)s >%(message)s"
+LOGDATEFORMAT="%Y-%m-%d %H:%M:%S"
+logListener=None
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """class DeferredQueueHandler:
+    QueueHandler that puts records on the queue unformatted,
+    so formatting as well as writing happens on the listener thread"""
+    def prepare(self, record):
+        return record
+
+def setupLogging(level=logging.INFO, logfile=None, console=True, queued=True, fmt=LOGFORMAT):
+    """setupLogging:
+    (Re)configures the TBController loggers, replacing their current handlers
     Inputs:
-    Information (string or other type that can be converted to string) : The information to write"""
-    now_time = datetime.datetime.now()
-    strNowTime = datetime.datetime.strftime(now_time, '%Y-%m-%d %H:%M:%S')
-    print(strNowTime + " >" + str(information))
-        
+    level (int or str) : Lowest level written, e.g. logging.DEBUG or "DEBUG" (default logging.INFO)
+    logfile (str) : File to append the log to (default None, no file)
+    console (boolean) : Write the log to stdout (default True)
+    queued (boolean) : Hand records to a background thread that formats and writes them,
+                       so logging never blocks the caller on console or file I/O (default True)
+    fmt (str) : logging format string (default LOGFORMAT, the writelog format)
+    Returns the logging.handlers.QueueListener if queued, None otherwise"""
+    global logListener
+    stopLogging()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    handlers=[]
+    if console:
+        handlers.append(logging.StreamHandler(sys.stdout))
+    if logfile is not None:
+        handlers.append(logging.FileHandler(logfile))
+    formatter=logging.Formatter(fmt, LOGDATEFORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    logger.setLevel(level)
+    logger.propagate=False
+    if queued:
+        logqueue=queue.SimpleQueue()
+        logger.addHandler(DeferredQueueHandler(logqueue))
+        logListener=logging.handlers.QueueListener(logqueue, *handlers)
+        logListener.start()
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
+    return logListener
+
+def stopLogging():
+    """stopLogging:
+    Writes out any queued records and stops the background writer started by setupLogging"""
+    global logListener
+    if logListener is not None:
+        logListener.stop()
+        logListener=None
+
+atexit.register(stopLogging)
+#Default: synchronous console output, as writelog always did
+setupLogging(queued=False)
+
+def writelog(information, level=logging.INFO, log=logger):
+    """writelog: logs the given message, by default to the console with the date and time
+    Inputs:
+    Information (string or other type that can be converted to string) : The information to write
+    level (int) : The logging level (default logging.INFO)
+    log (logging.Logger) : The logger to write to (default logger)"""
+    log.log(level, "%s", information)
+
+
+class DeferredErrors:
+    """class DeferredErrors:
+    Context manager returned by Controller_base.deferErrors
+    While active, non-query commands sent through sendscpi are followed by :SYST:ERR?
+    without waiting for the answer.  The answers are read when the next query is read,
+    or when the block ends, and each error is matched to the command that caused it.
+    While the controller's dispatcher is running, the whole block is one unit: the dispatcher is held
+    for the calling thread (see holdDispatcher), so no other thread's command runs in deferred mode
+    or reads an answer meant for the block."""
+    def __init__(self, controller, raiseOnError=False):
+        """Initializes an object of type DeferredErrors
+        Inputs:
+        controller (Controller_base) : The instrument the commands are sent to
+        raiseOnError (boolean) : Throw RuntimeError at the end of the block if any command failed"""
+        self.controller=controller
+        self.raiseOnError=raiseOnError
+        self.errors=[]
+        self.outer=False
+        self.release=None
+    def __enter__(self):
+        ctrl=self.controller
+        self.release=ctrl.holdDispatcher()
+        if ctrl.deferredErrors is None:
+            self.outer=True
+            ctrl.pendingErrorChecks=collections.deque()
+            ctrl.deferredErrors=self.errors
+        else:
+            #Nested block: the outermost block drains and owns the errors
+            self.errors=ctrl.deferredErrors
+        return self
+    def __exit__(self, exc_type, exc_value, tb):
+        if not self.outer:
+            if self.release is not None:
+                self.release.set()
+            return False
+        ctrl=self.controller
+        try:
+            ctrl.drainErrorChecks()
+        except Exception as e:
+            if exc_type is None:
+                raise
+            transportLog.warning("Could not read deferred errors: %s", e)
+        finally:
+            ctrl.deferredErrors=None
+            ctrl.pendingErrorChecks=None
+            if self.release is not None:
+                self.release.set()
+        if self.raiseOnError and exc_type is None and len(self.errors)>0:
+            raise RuntimeError(f"SCPI errors: {self.errors}")
+        return False
+    def __str__(self):
+        """__str__:
+        Returns a string representation of the errors found"""
+        return '\n'.join(f"{cmd} : {code}, {msg}" for cmd, code, msg in self.errors)
+
+def socketAlive(soc):
+    """socketAlive:
+    Checks without blocking whether an idle connected socket can be reused
+    A socket that is readable while idle has either been closed by the instrument
+    or has unread data, so it is treated as not reusable.
+    Inputs: soc (socket) : The socket to check
+    Returns True if the socket looks alive and clean"""
+    try:
+        if soc is None or soc.fileno()<0:
+            return False
+        readable, writable, errored=select.select([soc], [], [soc], 0)
+        return len(readable)==0 and len(errored)==0
+    except Exception as e:
+        return False
+
+class ConnectionPool:
+    """class ConnectionPool:
+    A process-wide pool of connected RC sockets shared between controller objects
+    Connections are keyed by instrument (see Controller_base.poolKey), are added with
+    Controller_base.release and are handed out by connect when available.
+    Each entry is a dict of {"soc", "port", "curr", "isSession", "time"}"""
+    def __init__(self, maxIdle=300):
+        """Initializes an object of type ConnectionPool
+        Inputs:
+        maxIdle (float) : Seconds a connection may sit unused before it is closed (default 300)"""
+        self.maxIdle=maxIdle
+        self.lock=threading.Lock()
+        self.conns={}
+    def acquire(self, key):
+        """acquire:
+        Removes and returns a live pooled connection entry for key
+        Dead or expired connections found on the way are closed
+        Returns the entry dict, or None if no live connection is pooled"""
+        with self.lock:
+            entries=self.conns.get(key)
+            while entries:
+                entry=entries.pop()
+                if time.monotonic()-entry["time"]<=self.maxIdle and socketAlive(entry["soc"]):
+                    return entry
+                self.closeEntry(entry)
+        return None
+    def release(self, key, soc, port, curr=None, isSession=False):
+        """release:
+        Adds a connected socket to the pool under key"""
+        entry={"soc":soc, "port":port, "curr":curr, "isSession":isSession, "time":time.monotonic()}
+        with self.lock:
+            self.conns.setdefault(key, []).append(entry)
+    def closeEntry(self, entry):
+        """closeEntry:
+        Closes the socket of a pool entry, ignoring errors"""
+        try:
+            entry["soc"].close()
+        except Exception as e:
+            pass
+    def clear(self, key=None):
+        """clear:
+        Closes and removes pooled connections for key, or all connections if key is None
+        Returns the number of connections closed"""
+        with self.lock:
+            if key is None:
+                keys=list(self.conns.keys())
+            else:
+                keys=[key]
+            count=0
+            for k in keys:
+                for entry in self.conns.pop(k, []):
+                    self.closeEntry(entry)
+                    count+=1
+        return count
+    def size(self, key=None):
+        """size:
+        Returns the number of pooled connections for key, or in total if key is None"""
+        with self.lock:
+            if key is not None:
+                return len(self.conns.get(key, []))
+            return sum(len(x) for x in self.conns.values())
+
+#The pool shared by every controller in this process
+connectionPool=ConnectionPool()
+
+#Default register classes for QSFP (SFF-8636/CMIS) memory, as (page, first, last, ttl)
+#ttl None marks static registers (identifiers, serial ID EEPROM) that are cached until invalidated;
+#registers not listed use the cache's defaultTTL (0: volatile, never cached).  Byte 2 is the
+#SFF-8636 status byte (Data_Not_Ready, IntL), so it is left volatile.
+DEFAULTREGISTERTTLS=[(0x00, 0x00, 0x01, None), (0x00, 0x80, 0xff, None)]
+PAGESELECTREGISTER=0x7f #Module register that selects the upper memory page
+
+class RegisterCache:
+    """class RegisterCache:
+    Caches I2C register values read with peek, keyed by (port, page, register)
+    Each register has a time to live in seconds: None for static registers, which are kept
+    until invalidated, or 0 for volatile registers, which are never cached."""
+    def __init__(self, rules=None, defaultTTL=0):
+        """Initializes an object of type RegisterCache
+        Inputs:
+        rules (list(tuple)) : (page, first, last, ttl) register classes; later rules win
+                              (default DEFAULTREGISTERTTLS)
+        defaultTTL (float) : ttl of registers not covered by rules (default 0, not cached)"""
+        if rules is None:
+            rules=DEFAULTREGISTERTTLS
+        self.rules=list(rules)
+        self.defaultTTL=defaultTTL
+        self.ttls={}
+        self.values={}
+        self.hits=0
+        self.misses=0
+    def setTTL(self, page, first, last, ttl):
+        """setTTL:
+        Sets the ttl of registers first..last (inclusive) on page
+        ttl (float) : seconds to keep values, None for static, 0 for volatile"""
+        self.rules.append((page, first, last, ttl))
+        self.ttls={}
+        self.values={key: val for key, val in self.values.items() if self.getTTL(key[1], key[2])!=0}
+    def getTTL(self, page, register):
+        """getTTL:
+        Returns the ttl of register on page"""
+        key=(page, register)
+        if key not in self.ttls:
+            ttl=self.defaultTTL
+            for rpage, first, last, rttl in self.rules:
+                if rpage==page and first<=register<=last:
+                    ttl=rttl
+            self.ttls[key]=ttl
+        return self.ttls[key]
+    def get(self, port, page, register):
+        """get:
+        Returns the cached value of register, or None if it is not cached or has expired"""
+        entry=self.values.get((port, page, register))
+        if entry is not None and (entry[1] is None or entry[1]>time.monotonic()):
+            self.hits+=1
+            return entry[0]
+        self.misses+=1
+        return None
+    def put(self, port, page, register, value):
+        """put:
+        Stores a register value read from the module, unless the register is volatile"""
+        ttl=self.getTTL(page, register)
+        if ttl==0 or value is None:
+            return
+        if ttl is None:
+            self.values[(port, page, register)]=(value, None)
+        else:
+            self.values[(port, page, register)]=(value, time.monotonic()+ttl)
+    def invalidate(self, port=None, page=None, register=None):
+        """invalidate:
+        Removes cached values matching every given port, page and register
+        (no arguments clears the whole cache)
+        Returns the number of values removed"""
+        if port is None and page is None and register is None:
+            count=len(self.values)
+            self.values={}
+            return count
+        keys=[key for key in self.values
+              if (port is None or key[0]==port) and (page is None or key[1]==page)
+              and (register is None or key[2]==register)]
+        for key in keys:
+            del self.values[key]
+        return len(keys)
+
+def commandPrefix(cmd):
+    """commandPrefix:
+    Returns the header of a SCPI command without its arguments, upper case
+    (e.g. :SENSE:EXPERT:I2C:PEEK:PAGESEL for ":SENSE:EXPERT:I2C:PEEK:PAGESEL 0", and :SENSE:DATA? for
+    every :SENSE:DATA? query), used to group commands in commandStats. Only the first line of cmd is considered"""
+    fields=cmd.split(None, 1)
+    if len(fields)==0:
+        return ''
+    return fields[0].upper()
+
+class CommandStats:
+    """class CommandStats:
+    In-process registry of per-command timing and traffic, keyed by command prefix
+    (see commandPrefix, or an operation name such as PEEK).
+    For each prefix it records the call count, bytes sent and received, a latency histogram,
+    time spent sleeping and the number of socket timeouts.
+    Disabled by default; while disabled the controller hooks only check self.enabled.
+    Example:
+        commandStats.enable()
+        ona1.peek(0x22)
+        print(commandStats.dumpJson())
+    Note that latency of an operation (PEEK) includes the latency of the commands it sends."""
+    #Upper bounds in seconds of the latency histogram buckets; the last bucket is unbounded
+    BUCKETS=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+             0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    def __init__(self):
+        self.enabled=False
+        self.lock=threading.Lock()
+        self.records={}
+
+    def enable(self):
+        """enable:
+        Starts recording"""
+        self.enabled=True
+
+    def disable(self):
+        """disable:
+        Stops recording; recorded values are kept"""
+        self.enabled=False
+
+    def reset(self):
+        """reset:
+        Discards all recorded values"""
+        with self.lock:
+            self.records={}
+
+    def record(self, prefix):
+        """record:
+        Returns the record for prefix, creating it if needed; caller must hold self.lock"""
+        rec=self.records.get(prefix)
+        if rec is None:
+            rec={"count":0, "bytesOut":0, "bytesIn":0, "latency":0.0, "maxLatency":0.0,
+                 "minLatency":None, "sleep":0.0, "timeouts":0, "histogram":[0]*(len(self.BUCKETS)+1)}
+            self.records[prefix]=rec
+        return rec
+
+    def addLatency(self, prefix, seconds):
+        """addLatency:
+        Counts one call of prefix that took seconds"""
+        with self.lock:
+            rec=self.record(prefix)
+            rec["count"]+=1
+            rec["latency"]+=seconds
+            rec["maxLatency"]=max(rec["maxLatency"], seconds)
+            if rec["minLatency"] is None or seconds<rec["minLatency"]:
+                rec["minLatency"]=seconds
+            rec["histogram"][bisect.bisect_left(self.BUCKETS, seconds)]+=1
+
+    def addTraffic(self, prefix, bytesOut=0, bytesIn=0):
+        """addTraffic:
+        Adds bytes sent and received to prefix"""
+        with self.lock:
+            rec=self.record(prefix)
+            rec["bytesOut"]+=bytesOut
+            rec["bytesIn"]+=bytesIn
+
+    def addSleep(self, prefix, seconds):
+        """addSleep:
+        Adds seconds spent sleeping to prefix"""
+        with self.lock:
+            self.record(prefix)["sleep"]+=seconds
+
+    def addTimeout(self, prefix):
+        """addTimeout:
+        Counts one socket timeout against prefix"""
+        with self.lock:
+            self.record(prefix)["timeouts"]+=1
+
+    def histogramPercentile(self, histogram, count, pct):
+        """histogramPercentile:
+        Returns the upper bound of the histogram bucket holding the pct percentile,
+        None for the unbounded bucket or if count is 0"""
+        if count==0:
+            return None
+        target=pct/100.0*count
+        total=0
+        for idx, num in enumerate(histogram):
+            total+=num
+            if total>=target and num>0:
+                return self.BUCKETS[idx] if idx<len(self.BUCKETS) else None
+        return None
+
+    def summary(self):
+        """summary:
+        Returns dict of {prefix: summary dict} with the recorded values, mean latency and
+        approximate p50/p95/p99 latency (histogram bucket upper bounds), sorted by total latency"""
+        with self.lock:
+            records={key:dict(rec, histogram=list(rec["histogram"])) for key, rec in self.records.items()}
+        result={}
+        for key, rec in sorted(records.items(), key=lambda x: -x[1]["latency"]):
+            count=rec["count"]
+            rec["meanLatency"]=rec["latency"]/count if count>0 else None
+            for pct in (50, 95, 99):
+                rec[f"p{pct}"]=self.histogramPercentile(rec["histogram"], count, pct)
+            rec["buckets"]=list(self.BUCKETS)
+            result[key]=rec
+        return result
+
+    def dumpJson(self, path=None):
+        """dumpJson:
+        Returns summary() as a JSON string, also writing it to path if given"""
+        text=json.dumps(self.summary(), indent=2)
+        if path is not None:
+            with open(path, 'w') as fp:
+                fp.write(text)
+        return text
+
+#The registry shared by every controller in this process
+commandStats=CommandStats()
+
+def measured(name=None):
+    """measured:
+    Decorator for Controller_base methods that records each call in commandStats
+    under name, or under the prefix of the command passed as first argument if name is None.
+    Calls go straight through while commandStats is disabled"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not commandStats.enabled:
+                return func(self, *args, **kwargs)
+            prefix=name
+            if prefix is None:
+                prefix=commandPrefix(str(args[0] if len(args)>0 else kwargs.get("cmd", "")))
+            return self.measureCommand(prefix, func, self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+#Guards creating each controller's own dispatcherLock (see startDispatcher)
+dispatcherLockGuard=threading.Lock()
+
+def dispatched(func):
+    """dispatched:
+    Decorator for Controller_base methods that must run as one unit on the instrument.
+    While the controller's dispatcher is running (see startDispatcher), a call from any other thread
+    is queued to the dispatcher and waited for, so its commands and responses are never
+    interleaved with another thread's. Calls run directly when there is no dispatcher, and
+    on the dispatcher thread itself, so dispatched methods can call each other, and on a thread
+    holding the dispatcher (see holdDispatcher)"""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        #No lock is taken unless this controller's dispatcher was started
+        if self.dispatcher is None:
+            return func(self, *args, **kwargs)
+        current=threading.current_thread()
+        if current is self.dispatcher or current is self.dispatchHolder:
+            return func(self, *args, **kwargs)
+        future=self.queueCall(func, (self,)+args, kwargs, start=False)
+        if future is None:
+            return func(self, *args, **kwargs)
+        return future.result()
+    return wrapper
 
 def getPort(validports):
     """Retrieve port number from input"""
@@ -189,6 +834,28 @@ class Controller_base():
     """class Controller_base
     An Abstract class for common/shared functions for TB5800/ONA1000 remote operations
     Note that first two methods __init__ and connect are abstract and must be implemented."""
+    #Receive buffer (see readLine)
+    rxbuf=None
+    #I2C register value cache, None when disabled (see enableRegisterCache)
+    regcache=None
+    #Deferred error checking state (see deferErrors)
+    deferredErrors=None
+    pendingErrorChecks=None
+    #Instrumentation state (see commandStats): prefixes of the measured calls in progress,
+    #and the prefix of the last message sent, which unmeasured reads are attributed to
+    statsStack=None
+    lastPrefix=''
+    #Snapshot of the running applications and when it was taken, None when unknown
+    #(see getCurrentApplications); appListMaxAge is the longest it is used without a new query
+    appList=None
+    appListTime=None
+    appListMaxAge=APPLISTMAXAGE
+    #Dispatcher thread, its submission queue and the lock guarding them, None until startDispatcher
+    dispatcher=None
+    commandQueue=None
+    dispatcherLock=None
+    #Thread the dispatcher is held for, which runs its dispatched calls directly (see holdDispatcher)
+    dispatchHolder=None
     def __init__(self, targetip, debug=False, timeout=30):
         #Blank function, must be implemented for each type of instrument
         pass
@@ -204,10 +871,220 @@ class Controller_base():
         #self.sendscpi(":SESS:END")
         self.exit()
    
+    def poolKey(self):
+        """poolKey:
+        Returns the key identifying this instrument's RC connection in connectionPool
+        Should be overridden for each type of instrument"""
+        return (self.ip, self.baseport)
+
+    def connectFromPool(self):
+        """connectFromPool:
+        Reuses a live RC connection released by another controller for the same instrument,
+        skipping the connect handshake
+        Returns True if a pooled connection was taken, False otherwise"""
+        entry=connectionPool.acquire(self.poolKey())
+        if entry is None:
+            return False
+        try:
+            timeout=self.soc.gettimeout()
+            self.soc.close()
+        except Exception as e:
+            timeout=None
+        self.soc=entry["soc"]
+        self.settimeout(timeout)
+        self.currentport=entry["port"]
+        self.curr=entry["curr"]
+        self.isSession=entry["isSession"]
+        self.resetReadBuffer()
+        self.isConnected=True
+        transportLog.info("Reusing pooled connection to RC port %s", self.currentport)
+        return True
+
+    def release(self):
+        """release:
+        Hands the RC connection to connectionPool instead of closing it, leaving the
+        instrument in remote mode so the next controller for it can skip connect.
+        The object is left disconnected; call connect to use it again.
+        Returns True if the connection was pooled, False otherwise"""
+        if not self.isConnected:
+            return False
+        timeout=self.gettimeout()
+        if self.rxbuf or self.pendingErrorChecks:
+            #Unread responses would be handed to the next user; close instead
+            self.socketClose()
+            pooled=False
+        else:
+            connectionPool.release(self.poolKey(), self.soc, self.currentport, self.curr, self.isSession)
+            pooled=True
+        self.soc=socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.soc.settimeout(timeout)
+        self.isConnected=False
+        return pooled
+
+    def startDispatcher(self):
+        """startDispatcher:
+        Starts the thread that runs every command for this controller, so one controller can be
+        shared by many threads. From then on dispatched methods called from other threads are
+        queued and run one at a time, in the order they were called; use submit to run
+        them, or a sequence of them as one unit, without waiting.
+        Does nothing if the dispatcher is already running
+        Returns the dispatcher thread"""
+        if self.dispatcherLock is None:
+            with dispatcherLockGuard:
+                if self.dispatcherLock is None:
+                    self.dispatcherLock=threading.RLock()
+        with self.dispatcherLock:
+            if self.dispatcher is None:
+                self.commandQueue=queue.SimpleQueue()
+                self.dispatcher=threading.Thread(target=self.dispatchLoop, args=(self.commandQueue,),
+                                                 name=f"dispatch-{getattr(self, 'ip', '')}", daemon=True)
+                self.dispatcher.start()
+            return self.dispatcher
+
+    def stopDispatcher(self, timeout=None):
+        """stopDispatcher:
+        Stops the dispatcher thread once the commands already queued have run;
+        calls then run directly on the calling thread again.  Any call still queued behind the
+        stop fails with RuntimeError rather than waiting forever
+        Inputs:
+        timeout (float) : Longest time in seconds to wait for the queue to drain (default None, no limit)"""
+        if self.dispatcher is None:
+            return
+        with self.dispatcherLock:
+            dispatcher=self.dispatcher
+            if dispatcher is None:
+                return
+            self.commandQueue.put(None)
+            self.dispatcher=None
+            self.commandQueue=None
+        if dispatcher is not threading.current_thread():
+            dispatcher.join(timeout)
+
+    def dispatchLoop(self, commandQueue):
+        """dispatchLoop:
+        The dispatcher thread: runs each queued call and completes its Future, until stopped"""
+        while True:
+            item=commandQueue.get()
+            if item is None:
+                break
+            future, func, args, kwargs=item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result=func(*args, **kwargs)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+        while True:
+            try:
+                item=commandQueue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None and item[0].set_running_or_notify_cancel():
+                item[0].set_exception(RuntimeError("Dispatcher was stopped"))
+
+    def queueCall(self, func, args, kwargs, start):
+        """queueCall:
+        Queues func(*args, **kwargs) to the dispatcher, holding the controller's dispatcherLock so that
+        the dispatcher cannot be stopped between finding its queue and queueing the call
+        Inputs:
+        func (function) : The function to run
+        args (tuple), kwargs (dict) : Its arguments
+        start (boolean) : Start the dispatcher if it is not running
+        Returns concurrent.futures.Future of the result, or None if the dispatcher is not running
+        and start is False"""
+        if self.dispatcher is None:
+            if not start:
+                return None
+            self.startDispatcher()
+        with self.dispatcherLock:
+            if self.dispatcher is None:
+                if not start:
+                    return None
+                self.startDispatcher()
+            future=concurrent.futures.Future()
+            self.commandQueue.put((future, func, args, kwargs))
+            return future
+
+    def holdDispatcher(self):
+        """holdDispatcher:
+        Makes the dispatcher wait while the calling thread runs a sequence of commands directly,
+        as one unit, with no other thread's commands in between (used by deferErrors).
+        Other threads' calls queue behind the hold and run once it is released.
+        Returns threading.Event to set to release the dispatcher, or None if there was nothing to
+        hold (no dispatcher, or the calling thread is the dispatcher or already holds it)"""
+        current=threading.current_thread()
+        if self.dispatcher is None or current is self.dispatcher or current is self.dispatchHolder:
+            return None
+        held=threading.Event()
+        release=threading.Event()
+        def hold():
+            self.dispatchHolder=current
+            held.set()
+            try:
+                release.wait()
+            finally:
+                self.dispatchHolder=None
+        future=self.queueCall(hold, (), {}, start=False)
+        if future is None:
+            return None
+        held.wait()
+        return release
+
+    def submit(self, func, *args, **kwargs):
+        """submit:
+        Queues func(*args, **kwargs) to run on the dispatcher thread, starting it if needed.
+        func may be a method of this controller or any function; a function making several calls
+        runs them as one unit, with no other thread's commands in between.
+        Called on the dispatcher thread itself, func runs at once.
+        Example:
+            future=tb1.submit(tb1.peek, 0x22, poll=True)
+            value=future.result()
+        Returns concurrent.futures.Future of the result"""
+        if self.dispatcher is threading.current_thread():
+            future=concurrent.futures.Future()
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self.queueCall(func, args, kwargs, start=True)
+
+    @dispatched
+    def waitReady(self, timeout=10, verbose=False):
+        """waitReady:
+        Waits until the instrument answers on the current connection, instead of a fixed delay.
+        Sends one :SYST:ERR? query and returns as soon as it is answered
+        Inputs:
+        timeout (float) : The longest time to wait in seconds (default 10)
+        verbose (boolean) : Verbose mode (default False)
+        Returns the time waited in seconds, or None if the instrument did not answer"""
+        oldtimeout=self.gettimeout()
+        start=time.monotonic()
+        try:
+            self.settimeout(timeout)
+            if self.socketSend(":SYST:ERR?", shh=not verbose) is None:
+                return None
+            if self.socketRead()=='':
+                transportLog.warning("Connection closed while waiting for the instrument")
+                return None
+            waited=time.monotonic()-start
+            if verbose:
+                transportLog.info("Instrument ready after %.3f s", waited)
+            return waited
+        except TimeoutError as te:
+            transportLog.warning("Instrument not ready after %s s", timeout)
+            return None
+        finally:
+            self.settimeout(oldtimeout)
+
+    @dispatched
     def setRemoteOn(self):
         """setRemoteOn:
         Sets the TB5800 into remote mode
-        Please delay at least 1 second after this command before talking to TB5800
+        Call waitReady after this command before talking to TB5800
         Returns True if executed successfully, False on exception"""
         try:
             if self.debug:
@@ -222,12 +1099,13 @@ class Controller_base():
         Opens the a socket to the self.ip, given port; sets self.currentport
         Returns True if executed successfully, False on exception"""
         if str(sport).strip() == "":
-            writelog("socketSend: 'port' parameter is required")
+            transportLog.error("socketSend: 'port' parameter is required")
             return False
         try:
             self.currentport = int(sport)
         except Exception as e:
-            writelog("sport must be an integer or string convertible to integer")
+            transportLog.error("sport must be an integer or string convertible to integer")
+        self.invalidateApplications()
         try:
             if self.soc is not None:
                 timeout=self.soc.gettimeout()
@@ -235,13 +1113,18 @@ class Controller_base():
             timeout=None
         else:
             try:
+                #New connection: discard any bytes left over from the old one
+                self.resetReadBuffer()
                 self.soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 self.soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                #Send each command immediately; otherwise a command and its :SYST:ERR?
+                #follow-up wait on a delayed ACK (~40 ms per non-query command)
+                self.soc.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 self.settimeout(timeout)
                 self.soc.connect((self.ip, self.currentport))
                 return True
             except Exception as msg:
-                writelog('Failed to create socket. Error code: ' + str(msg[0]) + ' , Error message : ' + msg[1])
+                transportLog.error('Failed to create socket. Error: %s', msg)
                 return False
                 
     def socketSend(self, message, shh=0):
@@ -249,14 +1132,18 @@ class Controller_base():
         send a message to the given socket, append a \n if there isn't one"""
         message = message.strip()
         if shh == 0:
-            writelog(message)
+            transportLog.info("%s", message)
         try:
             # Set the whole string
-            self.soc.sendall((message+"\n").encode("utf-8"))
+            data=(message+"\n").encode("utf-8")
+            self.soc.sendall(data)
+            if commandStats.enabled:
+                self.lastPrefix=commandPrefix(message.rsplit("\n", 1)[-1])
+                commandStats.addTraffic(self.statsPrefix(), bytesOut=len(data))
             return message
         except Exception:
             # send failed
-            writelog('message Send failed ==> :' + message)
+            transportLog.error('message Send failed ==> :%s', message)
             return None
     def inputAppStr(self, inclCurr=True):
         """Prompt user with common applications and input application from number selected
@@ -343,12 +1230,94 @@ class Controller_base():
             print(f'[0] Do Not Open App')
             return len(self.commonapps)
     
+    def statsPrefix(self):
+        """statsPrefix:
+        Returns the prefix that traffic, sleeps and timeouts are currently attributed to in commandStats:
+        the innermost measured call in progress, otherwise the last command sent"""
+        if self.statsStack:
+            return self.statsStack[-1]
+        return self.lastPrefix
+
+    def measureCommand(self, prefix, func, *args, **kwargs):
+        """measureCommand:
+        Calls func(*args, **kwargs), attributing the traffic, sleeps and timeouts it causes to prefix
+        and recording its latency in commandStats
+        Returns the result of func"""
+        if self.statsStack is None:
+            self.statsStack=[]
+        self.statsStack.append(prefix)
+        start=time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed=time.perf_counter()-start
+            self.statsStack.pop()
+            commandStats.addLatency(prefix, elapsed)
+
+    def sleep(self, seconds, prefix=None):
+        """sleep:
+        time.sleep that records the time slept in commandStats,
+        against prefix or the current statsPrefix() if prefix is None"""
+        time.sleep(seconds)
+        if commandStats.enabled:
+            commandStats.addSleep(self.statsPrefix() if prefix is None else prefix, seconds)
+
+    def resetReadBuffer(self):
+        """resetReadBuffer:
+        Creates (or clears) the receive buffer used by readLine
+        The buffer is reused for the life of the object, so only its contents are discarded"""
+        if self.rxbuf is None:
+            self.rxbuf=bytearray()
+            self.rxchunk=bytearray(RECVSIZE)
+            self.rxview=memoryview(self.rxchunk)
+        else:
+            del self.rxbuf[:]
+
+    def hasBufferedLine(self):
+        """hasBufferedLine:
+        Returns True if a complete message is already waiting in the receive buffer"""
+        return self.rxbuf is not None and b'\n' in self.rxbuf
+
+    def readLine(self):
+        """readLine:
+        Reads one newline-terminated message from the socket.
+        Bytes received past the newline are kept in the receive buffer for the next call,
+        and a message split over several packets is joined before being returned.
+        Returns the message without its newline, or whatever was left if the connection closed
+        Throws TimeoutError if the socket times out before a full message arrives"""
+        if self.rxbuf is None:
+            self.resetReadBuffer()
+        rxbuf=self.rxbuf
+        scanpos=0
+        while True:
+            idx=rxbuf.find(b'\n', scanpos)
+            if idx>=0:
+                msg=rxbuf[:idx].decode('utf-8')
+                del rxbuf[:idx+1]
+                if commandStats.enabled:
+                    commandStats.addTraffic(self.statsPrefix(), bytesIn=idx+1)
+                return msg
+            #Only scan newly received bytes next time around
+            scanpos=len(rxbuf)
+            try:
+                nbytes=self.soc.recv_into(self.rxchunk)
+            except TimeoutError:
+                if commandStats.enabled:
+                    commandStats.addTimeout(self.statsPrefix())
+                raise
+            if nbytes==0:
+                #Connection closed; return the partial message
+                msg=rxbuf.decode('utf-8')
+                del rxbuf[:]
+                if commandStats.enabled:
+                    commandStats.addTraffic(self.statsPrefix(), bytesIn=len(msg))
+                return msg
+            rxbuf+=self.rxview[:nbytes]
+
     def canRead(self):
         """"canRead:
         Attempts to read and return a socket message, returns '' otherwise"""
-        result = ''
-        result += self.soc.recv(8192).decode('utf-8')
-        return result
+        return self.readLine()
     
     def socketRead(self):
         """
@@ -358,9 +1327,7 @@ class Controller_base():
         shh : if set, don't echo the command we're sending
         Returns message read from the socket
         """
-        msg = self.soc.recv(8192).decode("utf-8")
-        msg = msg.strip()
-        return msg
+        return self.readLine().strip()
 
     def socketClose(self):
         """socketClose:
@@ -368,10 +1335,10 @@ class Controller_base():
         returns True if close is successful"""
         try:
             self.soc.close()
-            writelog("Socket connection closed")
+            transportLog.info("Socket connection closed")
             return True
         except Exception as e:
-            print(f'Exception: {e}')
+            transportLog.error("Exception: %s", e)
             return False
 
     def settimeout(self, timeout):
@@ -387,6 +1354,7 @@ class Controller_base():
         gets the current socket timeout and returns it"""
         return self.soc.gettimeout()
     
+    @dispatched
     def switchToApp(self, app, verbose=False, launch=False):
         """Subroutine to switch to app
         Returns true if no exception occurs"""
@@ -402,10 +1370,11 @@ class Controller_base():
                     self.sendscpi(":INIT")
                 return True
             except Exception as e:
-                print(f'Exception: {e}')
+                appLog.error("Exception: %s", e)
                 return False
         return False
 
+    @dispatched
     def connectToApp(self, app, args=None, timeout=None, verbose=False, multiconnect=False):
         """High level method to connect to / launch application
         Checks for existing app if app has a single port as a parameter or no parameter.
@@ -421,11 +1390,11 @@ class Controller_base():
         True if completed successfully
         False otherwise"""
         if app is None:
-            print("App must be defined.  Not starting app")
+            appLog.error("App must be defined.  Not starting app")
             return False
         #Connect to remote mode, startin new session if necessary
         connflag=True
-        writelog("Connecting to Application")
+        appLog.info("Connecting to Application")
         if not self.isConnected:
             connstatus=self.connect()
             if not connstatus:
@@ -476,25 +1445,26 @@ class Controller_base():
             if not appfound:
                 appport=apb.getPort()
                 if appport in self.getPortsInUse():
-                    print(f"Port {appport} already in use.\nCannot start new app on existing active port")
+                    appLog.error("Port %s already in use.\nCannot start new app on existing active port", appport)
                     return False
-            print(f"Application already open; switching to {runningapp}")
+            appLog.info("Application already open; switching to %s", runningapp)
             switchstatus=self.switchToApp(runningapp, verbose, launch=True)
             if not switchstatus:
                 return False
             self.isSession=True
             self.settimeout(oldtimeout)
+            return True
         elif multiconnect:
             appport=apb.getPort()
             portsInUse=self.getPortsInUse()
             if appport in portsInUse:
-                print(f"Port {appport} already in use.\nCannot start new app on existing active port")
+                appLog.error("Port %s already in use.\nCannot start new app on existing active port", appport)
                 return False
             try:
                 #Try to launch application
                 retval = self.launchApplication(app, args)
             except Exception as e:
-                writelog(f"Application Launch Failed: Exception: {e}")
+                appLog.error("Application Launch Failed: Exception: %s", e)
                 retval = False
             finally:
                 #Resume old timeout and return
@@ -503,15 +1473,17 @@ class Controller_base():
         else:
             try:
                 self.sendscpi("*RST")
+                #*RST exits every application, so the cached list no longer holds
+                self.invalidateApplications()
                 retval = self.launchApplication(app, args)
             except Exception as e:
-                writelog(e)
-                print(f"Application Launch Failed: Exception: {e}")
+                appLog.error("Application Launch Failed: Exception: %s", e)
                 return False
             finally:
                 #Resume old timeout and return
                 self.settimeout(oldtimeout)
                 return retval
+    @dispatched
     def exitApplication(self, appIdToExit, nextAppId=None):
         """exitApplication
         High Level Function to exit application on the TB5800 with appID appIdToExit
@@ -526,6 +1498,8 @@ class Controller_base():
             if exitapp in currapps:
                 self.sendscpi(":SYST:APPL:SEL "+appIdToExit)
                 self.sendscpi(":EXIT")
+                self.invalidateRegisters()
+                self.updateApplications(removed=appIdToExit)
                 self.curr = None
                 exitflag=True
             else:
@@ -535,8 +1509,10 @@ class Controller_base():
                 self.curr=Application(appId=nextAppId)
             return True
         except Exception as e:
-            print(f'Exception: {e}')
+            appLog.error("Exception: %s", e)
             return False
+    @dispatched
+    @measured()
     def sendscpi(self, cmd,  verbose=False, cmdend=""):
         """
         Higher-level routine for communicating with the remote control port
@@ -553,27 +1529,31 @@ class Controller_base():
         """
         shh=not verbose
         Info = ""
+        if cmdend == "" and self.deferredErrors is not None and not re.search(r'\?', cmd):
+            return self.sendDeferred(cmd, shh=shh)
         if cmdend == "":
             try:
                 sendval=self.socketSend(cmd, shh=shh)
             except TimeoutError as te:
-                writelog("Socket timed out.")
+                transportLog.warning("Socket timed out.")
                 return None
             if sendval is None:
-                writelog("Socket send error.")
+                transportLog.error("Socket send error.")
                 return None
             Info = Info + sendval
 
             if re.search(r'\?', cmd):
                 try:
+                    if self.pendingErrorChecks:
+                        self.drainErrorChecks()
                     resp = self.canRead()
                     if resp != 0:
                         Info = Info + " " + resp
                         if not shh:
-                            writelog(Info)
+                            transportLog.info("%s", Info)
                         return resp.strip()
                 except TimeoutError as te:
-                    writelog("Socket timed out")
+                    transportLog.warning("Socket timed out")
                     return None
                 else:
                     try:
@@ -581,7 +1561,7 @@ class Controller_base():
                         resp = self.canRead()
                         if resp != 0:
                             if not shh:
-                                writelog(resp)
+                                transportLog.info("%s", resp)
                             Info = Info + resp
                             return Info
                         else:
@@ -589,7 +1569,7 @@ class Controller_base():
                             Info = Info + resp
                             return Info
                     except TimeoutError as te:
-                        writelog("SCPI command timed out")
+                        transportLog.warning("SCPI command timed out")
                         return None
             else:
                 try:
@@ -601,12 +1581,138 @@ class Controller_base():
                     else:
                         return Info
                 except TimeoutError as te:
-                    writelog("SCPI command timed out")
+                    transportLog.warning("SCPI command timed out")
                     return None
                 
+    def deferErrors(self, raiseOnError=False):
+        """deferErrors:
+        Returns a context manager that defers :SYST:ERR? checks of non-query commands
+        until the next query or the end of the block, saving a round trip per command.
+        Example:
+            with tb1.deferErrors() as errs:
+                tb1.sendscpi(":SESS:CREATE")
+                tb1.sendscpi(":SESS:START")
+            print(errs.errors)
+        Inputs:
+        raiseOnError (boolean) : Throw RuntimeError at the end of the block if any command failed
+        Returns a DeferredErrors object; its errors list holds (command, code, message) tuples"""
+        return DeferredErrors(self, raiseOnError)
+
+    def sendDeferred(self, cmd, shh=True):
+        """sendDeferred:
+        Sends a non-query command and its :SYST:ERR? check in one write without reading the answer
+        Used by sendscpi inside a deferErrors block
+        Returns the command sent, or None if the send failed"""
+        sendval=self.socketSend(cmd.strip()+"\n:SYST:ERR?", shh=shh)
+        if sendval is None:
+            transportLog.error("Socket send error.")
+            return None
+        self.pendingErrorChecks.append(cmd.strip())
+        return cmd.strip()
+
+    def drainErrorChecks(self):
+        """drainErrorChecks:
+        Reads the :SYST:ERR? answers queued by deferErrors, in order,
+        and records any error against the command that caused it.
+        If an answer cannot be read, the rest would be taken as the responses to later commands,
+        so the connection is closed: it is neither used again nor returned to connectionPool.
+        Returns the number of answers read
+        May throw TimeoutError"""
+        pending=self.pendingErrorChecks
+        count=0
+        try:
+            while pending:
+                resp=self.socketRead()
+                cmd=pending.popleft()
+                count+=1
+                code, msg=parseScpiError(resp)
+                if code!=0:
+                    self.deferredErrors.append((cmd, code, msg))
+        except Exception as e:
+            transportLog.error("Lost %d deferred error checks (%s); closing the connection", len(pending), e)
+            pending.clear()
+            self.resetReadBuffer()
+            self.socketClose()
+            self.isConnected=False
+            raise
+        return count
+
+    @dispatched
+    @measured("BATCH")
+    def sendscpi_batch(self, cmds, verbose=False, join=False, checkErrors=True, parse=True):
+        """sendscpi_batch:
+        Sends a list of SCPI commands in a single write and then reads back every response in order,
+        so the whole batch costs about one round trip instead of one or two per command.
+        Inputs:
+        cmds (list(str)) : The SCPI commands (including arguments); queries and non-queries may be mixed
+        verbose (boolean) : if set, echo the commands sent and responses received
+        join (boolean) : Send the batch as one line joined with ';' instead of one line per command
+                         (Default False)
+        checkErrors (boolean) : Follow each non-query with :SYST:ERR? as sendscpi does (Default True)
+        parse (boolean or function) : Convert numeric query responses to int or float (Default True),
+                                      or a parser such as parseScpiInt to apply to every query response
+        Returns a list with one entry per command:
+            Query commands : the response, converted to int or float if numeric and parse is set
+            Non-query commands : the :SYST:ERR? response, or None if checkErrors is False
+        Returns None if the send fails or the socket times out"""
+        shh=not verbose
+        cmdlist=[x.strip() for x in cmds if x is not None and x.strip()!='']
+        if len(cmdlist)==0:
+            return []
+        sendlist=[]
+        isquery=[]
+        for cmd in cmdlist:
+            query='?' in cmd
+            isquery.append(query)
+            sendlist.append(cmd)
+            if not query and checkErrors:
+                sendlist.append(":SYST:ERR?")
+        numresp=sum(1 for x in sendlist if '?' in x)
+        try:
+            if join:
+                sendval=self.socketSend(';'.join(sendlist), shh=shh)
+            else:
+                sendval=self.socketSend('\n'.join(sendlist), shh=shh)
+            if sendval is None:
+                transportLog.error("Socket send error.")
+                return None
+            if self.pendingErrorChecks:
+                self.drainErrorChecks()
+            if numresp==0:
+                resps=[]
+            elif join:
+                #All responses to a joined line come back on one line separated by ';'
+                resps=splitScpiResponse(self.socketRead())
+            else:
+                resps=[self.socketRead() for idx in range(numresp)]
+        except TimeoutError as te:
+            transportLog.warning("SCPI batch timed out")
+            return None
+        if not shh:
+            transportLog.info("%s", resps)
+        if len(resps)!=numresp:
+            transportLog.error("SCPI batch expected %d responses, got %d", numresp, len(resps))
+            return None
+        results=[]
+        respidx=0
+        for query in isquery:
+            if query:
+                if parse is True:
+                    results.append(parseScpiValue(resps[respidx]))
+                else:
+                    results.append(parse(resps[respidx]) if parse else resps[respidx].strip())
+                respidx+=1
+            elif checkErrors:
+                results.append(resps[respidx].strip())
+                respidx+=1
+            else:
+                results.append(None)
+        return results
+
     def getConnected(self):
         """Return whether device is connected"""
         return self.isConnected
+    @dispatched
     def selectApp(self, app, verbose=False, launch=False):
         """selectApp:
         Selects current application from already running application
@@ -617,7 +1723,7 @@ class Controller_base():
         if isinstance(app, Application):
             apidstr=app.getAppId()
             if apidstr is None:
-                print("Invalid application object called")
+                appLog.error("Invalid application object called")
                 return False
         else:
             apidstr=app
@@ -631,13 +1737,14 @@ class Controller_base():
             if launch:
                 self.sendscpi(":INIT")
             if verbose:
-                writelog("Application launched successfully")
+                appLog.info("Application launched successfully")
             self.curr=Application(appId=apidstr.strip())
             return True
         except Exception as e:
-            print(f'Exception: {e}')
+            appLog.error("Exception: %s", e)
             return False
     
+    @dispatched
     def launchApplication(self, application, args=None, verbose=False):
         """launchApplication - Low Level method to launch an application with given args
         INPUTS:
@@ -651,14 +1758,16 @@ class Controller_base():
             for x in args:
                 apporig+=' '+x
         appstr=":SYST:APPL:LAUN "+apporig
-        writelog(f"Launching appication {apporig}")
+        appLog.info("Launching appication %s", apporig)
+        self.invalidateRegisters()
         apstval=self.sendscpi(appstr, verbose=verbose)
         #if apstval == 0:
             #return
-        if ":SYST:ERR?0," in apstval:
+        if scpiSucceeded(apstval):
             #No error
 
             appId = self.sendscpi(":SYST:APPL:LAUN?", verbose)
+            self.updateApplications(added=appId.strip())
             self.selectApp(Application(appId=appId.strip()), launch=True)
             if self.isSession:
                 self.sendscpi(":SESS:END", verbose)
@@ -669,11 +1778,12 @@ class Controller_base():
         # Need to send :INIT here to start the test. Applications begin in the
         # "Stopped" state in (GUI-disabled) RC mode.
             self.sendscpi(":INIT")
-            writelog("Application launched successfully")
+            appLog.info("Application launched successfully")
             self.curr=Application(appId=appId.strip())
             return True
         else:
-            #Raise Exception
+            #The launch failed, so the cached application list may no longer be right
+            self.invalidateApplications()
             raise RuntimeError(f"Application was not found: {appstr} returned {apstval}")
         
     def getPortsInUse(self):
@@ -690,6 +1800,7 @@ class Controller_base():
                 except Exception as e:
                     pass
         return currports
+    @dispatched
     def closeApplication(self, appid):
         """Closes an application
         
@@ -703,20 +1814,90 @@ class Controller_base():
                 self.sendscpi(":SYST:APPL:SEL "+appid)
                 self.curr=Application(appId=appid)
                 self.sendscpi(":EXIT")
+                self.invalidateRegisters()
+                self.updateApplications(removed=appid)
                 self.curr=None
-                currapps=self.getCurrentApplications()
                 return True
             except Exception as e:
-                print(f"Exit command failed : {e}")
+                appLog.error("Exit command failed : %s", e)
                 return False
             
 
         else:
-            print("App to close not in current applications; not closing app")
+            appLog.warning("App to close not in current applications; not closing app")
             return False
 
         
-    def peek(self, register, page=0x00, delay=DEFAULTDELAY, verbose=False, returnStatus=False):
+    def enableRegisterCache(self, rules=None, defaultTTL=0):
+        """enableRegisterCache:
+        Turns on caching of peek results so repeated reads of static registers cost nothing
+        A poke to a register, a poke to the page select register, and launching or closing an app
+        invalidate the affected values.
+        Inputs:
+        rules (list(tuple)) : (page, first, last, ttl) register classes (default DEFAULTREGISTERTTLS)
+        defaultTTL (float) : ttl of registers not covered by rules (default 0, not cached)
+        Returns the RegisterCache object"""
+        self.regcache=RegisterCache(rules, defaultTTL)
+        return self.regcache
+
+    def disableRegisterCache(self):
+        """disableRegisterCache:
+        Turns off and discards the register cache"""
+        self.regcache=None
+
+    def cachePort(self):
+        """cachePort:
+        Returns the port of the active app, which identifies the module in the register cache"""
+        if self.curr is None:
+            return None
+        try:
+            return self.curr.getPort()
+        except AttributeError:
+            return None
+
+    def invalidateRegisters(self, port=None, page=None, register=None):
+        """invalidateRegisters:
+        Removes matching values from the register cache, if it is enabled
+        (no arguments clears the whole cache)"""
+        if self.regcache is not None:
+            self.regcache.invalidate(port, page, register)
+
+    @measured("WAITI2C")
+    def waitI2C(self, kind, timeout=DEFAULTDELAY, verbose=False):
+        """waitI2C:
+        Polls :SENSE:DATA? :SENSE:EXPERT:I2C:<kind>:SUCCESS after a trigger, with a short growing wait,
+        and returns as soon as the transaction has completed.
+        A set flag may still belong to the previous transaction, so it is only accepted early once
+        it has been seen cleared after the trigger; otherwise polling goes on for the full timeout.
+        Inputs:
+        kind (str) : "PEEK" or "POKE"
+        timeout (float) : The longest time to wait in seconds (Default DEFAULTDELAY)
+        verbose (boolean) : verbose mode on or off (Default False)
+        Returns the last SUCCESS value read (1 on success), or None if it could not be read"""
+        start=time.monotonic()
+        wait=POLLSTART
+        seenBusy=False
+        status=None
+        while True:
+            resp=self.sendscpi(f":SENSE:DATA? :SENSE:EXPERT:I2C:{kind}:SUCCESS", verbose=verbose)
+            elapsed=time.monotonic()-start
+            status=parseScpiInt(resp)
+            if status==1 and seenBusy:
+                if verbose:
+                    i2cLog.info("%s completed after %.3f s", kind, elapsed)
+                return status
+            if status==0:
+                seenBusy=True
+            if elapsed>=timeout:
+                if status!=1:
+                    i2cLog.warning("%s did not complete within %s s", kind, timeout)
+                return status
+            self.sleep(max(0, min(wait, timeout-elapsed)))
+            wait=min(wait*2, I2CPOLLMAX)
+
+    @dispatched
+    @measured("PEEK")
+    def peek(self, register, page=0x00, delay=DEFAULTDELAY, verbose=False, returnStatus=False, poll=False):
         """
         peek
         Peeks at one of the Module's I2C registers
@@ -726,33 +1907,178 @@ class Controller_base():
         page (int) : The page number from 0x00 to 0xff
         delay (int) : The delay value in seconds; Too short of a delay can result in wrong info.  
                       Should be tested using a known value (Default 1)
+                      With poll, the longest time to wait for the PEEK to complete
         verbose (boolean) : verbose mode on or off (Default False)
         returnStatus (boolean) : Returns dict of {"VALUE":value, "SUCCESS":success} if True
         Otherwise returns value
+        poll (boolean) : Poll for completion (see waitI2C) instead of always waiting delay (Default False)
         Returns None on exception"""
         if page>0xff or page<0:
              raise ValueError(f"Page value of {hex(page)} is out of range")
         if register>0xff or register<0:
              raise ValueError(f"Register value of {hex(register)} is out of range")
+        if self.regcache is not None and not returnStatus:
+            peekval=self.regcache.get(self.cachePort(), page, register)
+            if peekval is not None:
+                if verbose:
+                    i2cLog.info("PEEK value (cached) : %#x", peekval)
+                return peekval
         if verbose:
-            writelog(f"Sending PEEK command to page {hex(page)} register {hex(register)}")
+            i2cLog.info("Sending PEEK command to page %#x register %#x", page, register)
         try:
-            self.sendscpi(f":SENSE:EXPERT:I2C:PEEK:PAGESEL {page}", verbose=verbose)
-            self.sendscpi(f":SENSE:EXPERT:I2C:PEEK:REGADDR {register}", verbose=verbose)
-            self.sendscpi(":SENSE:EXPERT:I2C:PEEK:TRIGGER", verbose=verbose)
-            time.sleep(delay)
-            pkv=self.sendscpi(":SENSE:DATA? :SENSE:EXPERT:I2C:PEEK:REGDATA", verbose=verbose)
-            peekval= int(pkv)
-            writelog(f"PEEK value : {hex(peekval)}")
+            success=None
+            #Setup errors are read back with the register data instead of one round trip each
+            with self.deferErrors() as errs:
+                self.sendscpi(f":SENSE:EXPERT:I2C:PEEK:PAGESEL {page}", verbose=verbose)
+                self.sendscpi(f":SENSE:EXPERT:I2C:PEEK:REGADDR {register}", verbose=verbose)
+                self.sendscpi(":SENSE:EXPERT:I2C:PEEK:TRIGGER", verbose=verbose)
+                if poll:
+                    success=self.waitI2C("PEEK", delay, verbose)
+                else:
+                    self.sleep(delay)
+                pkv=self.sendscpi(":SENSE:DATA? :SENSE:EXPERT:I2C:PEEK:REGDATA", verbose=verbose)
+            if len(errs.errors)>0:
+                i2cLog.warning("PEEK errors:\n%s", errs)
+            peekval=parseScpiInt(pkv)
+            if peekval is None:
+                raise ValueError(f"PEEK returned {pkv}")
+            i2cLog.info("PEEK value : %#x", peekval)
+            if not poll and (returnStatus or self.regcache is not None):
+                success=parseScpiInt(self.sendscpi(":SENSE:DATA? :SENSE:EXPERT:I2C:PEEK:SUCCESS", verbose=verbose))
+            #A failed or unfinished PEEK may have left the previous value in REGDATA
+            if self.regcache is not None and success==1:
+                self.regcache.put(self.cachePort(), page, register, peekval)
             if not returnStatus:
                 return peekval
-            else:
-                return {"VALUE": peekval, "SUCCESS":int(self.sendscpi(":SENSE:DATA? :SENSE:EXPERT:I2C:PEEK:SUCCESS", verbose=verbose))}
+            return {"VALUE": peekval, "SUCCESS":success}
+        except Exception as e:
+            i2cLog.error('Exception %s', e)
+            return None
+
+    @dispatched
+    @measured("PEEK_RANGE")
+    def peek_range(self, page, start, end, delay=DEFAULTDELAY, verbose=False, poll=True):
+        """
+        peek_range
+        Peeks at a run of the Module's I2C registers on one page (see peek_list).
+
+        Inputs:
+        page (int) : The page number from 0x00 to 0xff
+        start (int) : The first register from 0x00 to 0xff
+        end (int) : The last register (inclusive) from start to 0xff
+        delay (float) : The delay value in seconds for each register, or the longest wait with poll
+        verbose (boolean) : verbose mode on or off (Default False)
+        poll (boolean) : Poll for completion (see waitI2C) instead of always waiting delay (Default True)
+        Returns list of the register values start..end, with None for each failed read, None on exception"""
+        if page>0xff or page<0:
+            raise ValueError(f"Page value of {hex(page)} is out of range")
+        if start>0xff or start<0 or end>0xff or end<start:
+            raise ValueError(f"Register range of {hex(start)} to {hex(end)} is out of range")
+        if verbose:
+            i2cLog.info("Sending PEEK commands to page %#x registers %#x to %#x", page, start, end)
+        return self.peek_list([(page, register) for register in range(start, end+1)],
+                              delay=delay, verbose=verbose, poll=poll)
+
+    @dispatched
+    @measured("PEEK_LIST")
+    def peek_list(self, addresses, delay=DEFAULTDELAY, verbose=False, poll=True):
+        """
+        peek_list
+        Peeks at a list of the Module's I2C registers, in order.
+        The page is only selected when it changes, and each register's readback goes out in the
+        same write as the next register's REGADDR/TRIGGER, so each register costs one round trip
+        plus the I2C wait.  Registers held in the register cache are not read.
+        A read whose SUCCESS status is not 1 (failed, or not complete within delay) gives None rather
+        than the REGDATA contents, which may still be the previous value; only successful reads are
+        cached.  Without poll the status is read back with the register data.
+
+        Inputs:
+        addresses (list(tuple)) : The (page, register) pairs to read, each from 0x00 to 0xff
+        delay (float) : The delay value in seconds for each register, or the longest wait with poll
+        verbose (boolean) : verbose mode on or off (Default False)
+        poll (boolean) : Poll for completion (see waitI2C) instead of always waiting delay (Default True)
+        Returns list of the register values in the order of addresses, with None for each failed read,
+        None on exception"""
+        for page, register in addresses:
+            if page>0xff or page<0:
+                raise ValueError(f"Page value of {hex(page)} is out of range")
+            if register>0xff or register<0:
+                raise ValueError(f"Register value of {hex(register)} is out of range")
+        values=[None]*len(addresses)
+        if self.regcache is not None:
+            port=self.cachePort()
+            values=[self.regcache.get(port, page, register) for page, register in addresses]
+        toread=[idx for idx, value in enumerate(values) if value is None]
+        if len(toread)==0:
+            return values
+        errors=[]
+        statuses=[None]*len(addresses)
+        readback=":SENSE:DATA? :SENSE:EXPERT:I2C:PEEK:REGDATA"
+        succeeded=":SENSE:DATA? :SENSE:EXPERT:I2C:PEEK:SUCCESS"
+        try:
+            cmds=[]
+            currpage=None
+            for num in range(len(toread)+1):
+                if num<len(toread):
+                    page, register=addresses[toread[num]]
+                    if page!=currpage:
+                        cmds.append(f":SENSE:EXPERT:I2C:PEEK:PAGESEL {page}")
+                        currpage=page
+                    cmds+=[f":SENSE:EXPERT:I2C:PEEK:REGADDR {register}", ":SENSE:EXPERT:I2C:PEEK:TRIGGER"]
+                resps=self.sendscpi_batch(cmds, verbose=verbose)
+                if resps is None:
+                    raise RuntimeError(f"PEEK of {addresses[toread[min(num, len(toread)-1)]]} failed")
+                for cmd, resp in zip(cmds, resps):
+                    if cmd==readback:
+                        #As in peek; a reply that is not a byte counts as a failed read
+                        value=parseScpiInt(resp)
+                        values[toread[num-1]]=value if value is not None and 0<=value<=0xff else None
+                    elif cmd==succeeded:
+                        statuses[toread[num-1]]=parseScpiInt(resp)
+                    elif parseScpiError(resp)[0]!=0:
+                        errors.append((cmd, resp))
+                if num<len(toread):
+                    if poll:
+                        statuses[toread[num]]=self.waitI2C("PEEK", delay, verbose)
+                    else:
+                        self.sleep(delay)
+                cmds=[readback] if poll else [readback, succeeded]
+            if len(errors)>0:
+                i2cLog.warning("PEEK errors: %s", errors)
+            failed=[idx for idx in toread if statuses[idx]!=1 or values[idx] is None]
+            for idx in failed:
+                values[idx]=None
+            if len(failed)>0:
+                i2cLog.warning("PEEK of %s failed", [addresses[idx] for idx in failed])
+            if self.regcache is not None:
+                for idx in toread:
+                    if values[idx] is not None:
+                        page, register=addresses[idx]
+                        self.regcache.put(port, page, register, values[idx])
+            return values
         except Exception as e:
-            print(f'Exception {e}')
+            i2cLog.error('Exception %s', e)
+            return None
+
+    @dispatched
+    def dump_page(self, page, delay=DEFAULTDELAY, verbose=False, poll=True):
+        """
+        dump_page
+        Reads all 256 registers of one page of the Module's I2C memory (see peek_range)
+        Inputs:
+        page (int) : The page number from 0x00 to 0xff
+        delay (float) : The delay value in seconds for each register, or the longest wait with poll
+        verbose (boolean) : verbose mode on or off (Default False)
+        poll (boolean) : Poll for completion instead of always waiting delay (Default True)
+        Returns bytes image of the page, None if any register could not be read"""
+        data=self.peek_range(page, 0x00, 0xff, delay=delay, verbose=verbose, poll=poll)
+        if data is None or None in data:
             return None
+        return bytes(data)
 
-    def poke(self, register, value, page=0x00, delay=DEFAULTDELAY, verbose=False):
+    @dispatched
+    @measured("POKE")
+    def poke(self, register, value, page=0x00, delay=DEFAULTDELAY, verbose=False, poll=False):
         """
         poke
         Pokes one of the Module's I2C registers with a value
@@ -764,8 +2090,10 @@ class Controller_base():
         delay (int) : The delay value in seconds; Too short of a delay can result in wrong info.  
                       Should be tested using a known value (Default 1.3)
                       Delay of 0 means send poke and don't wait for response.
+                      With poll, the longest time to wait for the POKE to complete
 
         verbose (boolean) : verbose mode on or off (Default False)
+        poll (boolean) : Poll for completion (see waitI2C) instead of always waiting delay (Default False)
         Return poke success if successful, None if not"""
 
         if page>0xff or page<0:
@@ -775,18 +2103,30 @@ class Controller_base():
         if value>0xff or value<0:
             raise ValueError(f"Poke value of {hex(value)} is out of range (0x00 to 0xff)")
         if verbose:
-            writelog(f"sending POKE to page {hex(page)} register {hex(register)} with value {hex(value)}")
+            i2cLog.info("sending POKE to page %#x register %#x with value %#x", page, register, value)
+        if self.regcache is not None:
+            if register==PAGESELECTREGISTER:
+                #Upper memory now maps a different page
+                self.regcache.invalidate(port=self.cachePort())
+            else:
+                self.regcache.invalidate(self.cachePort(), page, register)
         try:
-            self.sendscpi(f":SENSE:EXPERT:I2C:POKE:PAGESEL {page}", verbose=verbose)
-            self.sendscpi(f":SENSE:EXPERT:I2C:POKE:REGADDR {register}", verbose=verbose)
-            self.sendscpi(f":SENSE:EXPERT:I2C:POKE:REGDATA {value}")
-            self.sendscpi(":SENSE:EXPERT:I2C:POKE:TRIGGER", verbose=verbose)
-            if delay>0:
-                time.sleep(delay)
-                return int(self.sendscpi(":SENSE:DATA? :SENSE:EXPERT:I2C:POKE:SUCCESS", verbose=verbose))
-            return None
+            pokestatus=None
+            with self.deferErrors() as errs:
+                self.sendscpi(f":SENSE:EXPERT:I2C:POKE:PAGESEL {page}", verbose=verbose)
+                self.sendscpi(f":SENSE:EXPERT:I2C:POKE:REGADDR {register}", verbose=verbose)
+                self.sendscpi(f":SENSE:EXPERT:I2C:POKE:REGDATA {value}")
+                self.sendscpi(":SENSE:EXPERT:I2C:POKE:TRIGGER", verbose=verbose)
+                if delay>0 and poll:
+                    pokestatus=self.waitI2C("POKE", delay, verbose)
+                elif delay>0:
+                    self.sleep(delay)
+                    pokestatus=parseScpiInt(self.sendscpi(":SENSE:DATA? :SENSE:EXPERT:I2C:POKE:SUCCESS", verbose=verbose))
+            if len(errs.errors)>0:
+                i2cLog.warning("POKE errors:\n%s", errs)
+            return pokestatus
         except Exception as e:
-            print(f'Exception {e}')
+            i2cLog.error('Exception %s', e)
             return None
     
     def runCommand(self, cmdval, auto=False):
@@ -947,7 +2287,7 @@ class Controller_base():
             else:
                 #Run delay command
                 print(f'Delaying {float(splitcmd[1].split()[0])} seconds')
-                time.sleep(float(splitcmd[1].split()[0]))
+                self.sleep(float(splitcmd[1].split()[0]), prefix="DELAY")
                 return True
         elif splitcmd[0].upper()=="SCPI":
             #SCPI command
@@ -958,6 +2298,9 @@ class Controller_base():
             else:
                 #Run verbose send scpi command
                 try:
+                    if '?' not in splitcmd[1]:
+                        #A raw command may launch or exit apps behind the cached app list
+                        self.invalidateApplications()
                     scpival=self.sendscpi(splitcmd[1], verbose=True)
                     print(scpival)
                     return scpival
@@ -1086,37 +2429,69 @@ class Controller_base():
         return False
         #END of function runCommand1
 
-    def getCurrentApplications(self, timeout=10, verbose=False):
+    @dispatched
+    def getCurrentApplications(self, timeout=10, verbose=False, maxAge=None, refresh=False):
         """getCurrentApplications:
         Returns a list of current applications:
+        The list is cached; launching, exiting or closing an app through this object updates the cache,
+        so :SYST:APPL:CAPP? is only sent when the snapshot is older than maxAge or refresh is set.
         Inputs: timeout (int) - the timeout time, default 10
-                verbose (Boolean) - Verbose mode if True"""
+                verbose (Boolean) - Verbose mode if True
+                maxAge (float) - Oldest snapshot in seconds to return without a query
+                                 (default None, use self.appListMaxAge; 0 always queries)
+                refresh (Boolean) - Always query the instrument (default False)"""
+        if maxAge is None:
+            maxAge=self.appListMaxAge
+        if not refresh and self.appList is not None and time.monotonic()-self.appListTime<=maxAge:
+            return list(self.appList)
         try:
             olddelay=self.gettimeout()
             self.settimeout(timeout)
             retval= self.sendscpi(":SYST:APPL:CAPP?")
-            if retval is None or retval=='' or retval.strip()=='':
-                self.settimeout(olddelay)  
+            if retval is None:
+                self.settimeout(olddelay)
                 return []
             if verbose:
                 print(retval)
-            currapplist=[x.strip() for x in retval.split(',')]
-            for idx in range(len(currapplist)):
-                if(currapplist[idx][-1]==','):
-                    currapplist[idx]=currapplist[idx][0:-1]
-            #Cast all the app names into Application objects
-            currapps=[]
-            for x in currapplist:
-                if x != '':
-                    currapps.append(Application(appId=x))
-            self.settimeout(olddelay)                    
-            return currapps
+            currapps=parseAppList(retval)
+            self.settimeout(olddelay)
+            self.appList=currapps
+            self.appListTime=time.monotonic()
+            return list(currapps)
 
         except TimeoutError as te:
-            print("SCPI command timed out")
+            transportLog.warning("SCPI command timed out")
             self.settimeout(olddelay)
             return None
-        
+
+    def refreshApplications(self, timeout=10, verbose=False):
+        """refreshApplications:
+        Queries the running applications, replacing the cached snapshot
+        Returns the list of current applications as getCurrentApplications"""
+        return self.getCurrentApplications(timeout, verbose, refresh=True)
+
+    def invalidateApplications(self):
+        """invalidateApplications:
+        Discards the cached application list so the next getCurrentApplications queries the instrument"""
+        self.appList=None
+        self.appListTime=None
+
+    def updateApplications(self, added=None, removed=None):
+        """updateApplications:
+        Applies a launch (added) or exit (removed) made through this object to the cached application list
+        Inputs:
+        added (str) : The appId of an application that was launched
+        removed (str) : The appId of an application that was exited"""
+        if self.appList is None:
+            return
+        if removed is not None:
+            appx=Application(appId=removed.strip())
+            self.appList=[x for x in self.appList if x!=appx]
+        if added is not None:
+            appx=Application(appId=added.strip())
+            if appx not in self.appList:
+                self.appList.append(appx)
+
     def getLaserStatus(self):
         """Get high level laser status based on the :OUTPUT:OPTIC? SCPI command"""
         return self.sendscpi(":OUTPUT:OPTIC?")
@@ -1125,21 +2500,23 @@ class Controller_base():
         """Returns whether laser is on according to high level status"""
         return self.getLaserStatus == 'ON'
     
+    @dispatched
     def setLaserOn(self):
         """Sets the laser to on using high level protocol (SCPI)"""
         if not self.laserStatus:
             scpival=self.sendscpi(":OUTPUT:OPTIC ON")
             print(scpival)
-            self.laserStatus='0,' in scpival and 'No error' in scpival
+            self.laserStatus=scpiSucceeded(scpival)
             return self.laserStatus
         return self.laserStatus
 
+    @dispatched
     def setLaserOff(self):
         """Sets the laser to off using high level protocol (SCPI)"""
         if self.laserStatus:
             scpival = self.sendscpi(':OUTPUT:OPTIC OFF')
             print(scpival)
-            self.laserStatus= (not ('0,' in scpival)) or (not ('No error' in scpival))
+            self.laserStatus=not scpiSucceeded(scpival)
             if self.laserStatus:
                 writelog(scpival)
             return not self.laserStatus
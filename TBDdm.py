@@ -0,0 +1,295 @@
+"""TBDdm.py
+Decodes the digital diagnostic monitors (DDM) of QSFP (SFF-8636) and QSFP-DD/OSFP (CMIS) modules
+from raw register samples in bulk: temperature, Vcc, and per lane Tx/Rx power and Tx bias, with
+their alarm/warning flags and the LOS/fault flags.
+Samples come from a SampleStore written by TBMonitor (columns "PEEK page register") or from page
+dumps (rows of register bytes, one per timestamp).  Every field is decoded for all samples at once,
+with NumPy when it is installed and with plain arrays otherwise.
+
+Decoded values are in degrees C, V, mW and mA; a value is NaN where one of its bytes was not
+sampled.  Flags are 1.0 when set, 0.0 when clear and NaN when not sampled.  The bytes of one field
+must be sampled together (PEEKs at the same rate in one monitor file).
+Usage:
+    python TBDdm.py soak1 --layout SFF8636
+    python TBDdm.py soak1 soak2 --layout CMIS -o decoded.csv
+"""
+from TBControllerCommon import *
+from TBCommandPlan import compileLine
+from TBSampleStore import SampleStore
+import math
+import array
+import datetime
+try:
+    import numpy
+except ImportError:
+    #NumPy is optional; the pure Python path gives the same results, more slowly
+    numpy=None
+
+DDMLAYOUTS=("SFF8636", "CMIS")
+FLAGKINDS=("HighAlarm", "LowAlarm", "HighWarning", "LowWarning")
+
+def monitorFields(layout, biasMultiplier=1):
+    """monitorFields:
+    Returns list of the monitor fields of layout as tuples
+    (name, page, msb register, signed, scale to the field's unit)"""
+    if layout=="SFF8636":
+        #Lower page 00h, SFF-8636 section 6.2.4
+        fields=[("temperature", 0x00, 0x16, True, 1/256), ("vcc", 0x00, 0x1a, False, 0.0001)]
+        lanes, rxpower, txbias, txpower, page=4, 0x22, 0x2a, 0x32, 0x00
+    elif layout=="CMIS":
+        #Lower page 00h and page 11h (bank 0), CMIS 5.0 sections 8.2.5 and 8.9.4
+        fields=[("temperature", 0x00, 0x0e, True, 1/256), ("vcc", 0x00, 0x10, False, 0.0001)]
+        lanes, rxpower, txbias, txpower, page=8, 0xba, 0xaa, 0x9a, 0x11
+    else:
+        raise ValueError(f"DDM layout {layout} is not one of {DDMLAYOUTS}")
+    for lane in range(lanes):
+        fields.append((f"rxPower{lane+1}", page, rxpower+2*lane, False, 0.0001))
+        fields.append((f"txBias{lane+1}", page, txbias+2*lane, False, 0.002*biasMultiplier))
+        fields.append((f"txPower{lane+1}", page, txpower+2*lane, False, 0.0001))
+    return fields
+
+def flagFields(layout):
+    """flagFields:
+    Returns list of the flag fields of layout as tuples (name, page, register, bit)"""
+    flags=[]
+    if layout=="SFF8636":
+        #Lower page 00h bytes 3 to 14; FLAGKINDS are bits 7 to 4 of a byte
+        for bit, kind in enumerate(FLAGKINDS):
+            flags.append((f"temperature{kind}", 0x00, 0x06, 7-bit))
+            flags.append((f"vcc{kind}", 0x00, 0x07, 7-bit))
+        for lane in range(4):
+            flags.append((f"rxLos{lane+1}", 0x00, 0x03, lane))
+            flags.append((f"txLos{lane+1}", 0x00, 0x03, 4+lane))
+            flags.append((f"txFault{lane+1}", 0x00, 0x04, lane))
+            #Two lanes per byte, the lower lane in the upper nibble
+            register, shift=lane//2, 4 if lane%2==0 else 0
+            for bit, kind in enumerate(FLAGKINDS):
+                flags.append((f"rxPower{lane+1}{kind}", 0x00, 0x09+register, shift+3-bit))
+                flags.append((f"txBias{lane+1}{kind}", 0x00, 0x0b+register, shift+3-bit))
+                flags.append((f"txPower{lane+1}{kind}", 0x00, 0x0d+register, shift+3-bit))
+    elif layout=="CMIS":
+        #Lower page 00h byte 9 (bits 0 to 3 temperature, 4 to 7 Vcc) and page 11h bytes 135 to 152,
+        #one byte per flag with one bit per lane (byte 134 is Data Path State Changed, 148 Rx LOL)
+        for bit, kind in enumerate(FLAGKINDS):
+            flags.append((f"temperature{kind}", 0x00, 0x09, bit))
+            flags.append((f"vcc{kind}", 0x00, 0x09, 4+bit))
+        for lane in range(8):
+            flags.append((f"txFault{lane+1}", 0x11, 0x87, lane))
+            flags.append((f"txLos{lane+1}", 0x11, 0x88, lane))
+            flags.append((f"rxLos{lane+1}", 0x11, 0x93, lane))
+            for bit, kind in enumerate(FLAGKINDS):
+                flags.append((f"txPower{lane+1}{kind}", 0x11, 0x8b+bit, lane))
+                flags.append((f"txBias{lane+1}{kind}", 0x11, 0x8f+bit, lane))
+                flags.append((f"rxPower{lane+1}{kind}", 0x11, 0x95+bit, lane))
+    else:
+        raise ValueError(f"DDM layout {layout} is not one of {DDMLAYOUTS}")
+    return flags
+
+def toArray(values):
+    """toArray:
+    Returns values as a float64 numpy array, or array('d') without NumPy, copying only if needed"""
+    if numpy is not None:
+        return numpy.asarray(values, dtype=numpy.float64)
+    if isinstance(values, array.array) and values.typecode=='d':
+        return values
+    return array.array('d', values)
+
+def decodeWord(msb, lsb, signed, scale):
+    """decodeWord:
+    Decodes big-endian 16 bit values from arrays of their two bytes
+    Inputs:
+    msb, lsb (array) : The high and low bytes, NaN where not sampled
+    signed (boolean) : Two's complement values
+    scale (float) : The value of one count
+    Returns array of the scaled values, NaN where either byte is NaN"""
+    if numpy is not None:
+        word=msb*256+lsb
+        if signed:
+            word=numpy.where(word>=32768, word-65536, word)
+        return word*scale
+    values=array.array('d', bytes(8*len(msb)))
+    for idx in range(len(msb)):
+        word=msb[idx]*256+lsb[idx]
+        if signed and word>=32768:
+            word-=65536
+        values[idx]=word*scale
+    return values
+
+def decodeBit(byte, bit):
+    """decodeBit:
+    Extracts one bit from an array of bytes
+    Returns array of 1.0 where the bit is set, 0.0 where it is clear and NaN where byte is NaN"""
+    if numpy is not None:
+        missing=numpy.isnan(byte)
+        bits=(numpy.where(missing, 0, byte).astype(numpy.int64)>>bit)&1
+        return numpy.where(missing, numpy.nan, bits)
+    return array.array('d', (math.nan if math.isnan(x) else float((int(x)>>bit)&1) for x in byte))
+
+def toDbm(milliwatts):
+    """toDbm:
+    Converts an array of powers in mW to dBm; zero power gives -inf"""
+    if numpy is not None:
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return 10*numpy.log10(milliwatts)
+    return array.array('d', (10*math.log10(x) if x>0 else (-math.inf if x==0 else math.nan)
+                             for x in milliwatts))
+
+class RegisterSamples:
+    """class RegisterSamples:
+    Register bytes of one module sampled over time
+    timestamps (array) : Seconds since the epoch of each sample, ascending
+    registers (dict) : {(page, register): array of the byte at each timestamp, NaN if not sampled}"""
+    def __init__(self, timestamps, registers=None):
+        self.timestamps=toArray(timestamps)
+        self.registers=registers if registers is not None else {}
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @classmethod
+    def fromDumps(cls, timestamps, dumps, page=0x00, base=0x00):
+        """fromDumps:
+        Builds RegisterSamples from page dumps, such as rows of peek_range results
+        Inputs:
+        timestamps (list(float)) : Seconds since the epoch of each dump
+        dumps (list(list(int))) : One row of register bytes per timestamp; failed reads may be None or False
+        page (int) : The page dumped (default 0x00)
+        base (int) : The register of the first byte of each row (default 0x00)
+        Returns RegisterSamples"""
+        width=max((len(row) for row in dumps), default=0)
+        registers={}
+        for col in range(width):
+            registers[(page, base+col)]=toArray(
+                [row[col] if col<len(row) and isinstance(row[col], int) and not isinstance(row[col], bool)
+                 else math.nan for row in dumps])
+        return cls(timestamps, registers)
+
+    @classmethod
+    def fromStore(cls, store):
+        """fromStore:
+        Builds RegisterSamples from the PEEK columns of a SampleStore, on the union of their timestamps
+        Inputs:
+        store (SampleStore or str) : The store or its directory
+        Returns RegisterSamples"""
+        if isinstance(store, str):
+            store=SampleStore(store, readonly=True)
+        columns={}
+        for name in store.names():
+            try:
+                op=compileLine(name, 0)
+            except ValueError:
+                continue
+            if op.kind=="PEEK":
+                columns[op.args]=store.read(name)
+        if numpy is not None:
+            columns={key:(numpy.frombuffer(ts, dtype=numpy.float64), numpy.frombuffer(vs, dtype=numpy.float64))
+                     for key, (ts, vs) in columns.items()}
+            if len(columns)==0:
+                return cls([])
+            timestamps=numpy.unique(numpy.concatenate([ts for ts, vs in columns.values()]))
+            registers={}
+            for key, (ts, vs) in columns.items():
+                values=numpy.full(len(timestamps), numpy.nan)
+                values[numpy.searchsorted(timestamps, ts)]=vs
+                registers[key]=values
+            return cls(timestamps, registers)
+        timestamps=sorted(set().union(*(ts for ts, vs in columns.values())))
+        position={t:idx for idx, t in enumerate(timestamps)}
+        registers={}
+        for key, (ts, vs) in columns.items():
+            values=array.array('d', [math.nan])*len(timestamps)
+            for t, v in zip(ts, vs):
+                values[position[t]]=v
+            registers[key]=values
+        return cls(timestamps, registers)
+
+    def register(self, page, register):
+        """register:
+        Returns the array of samples of one register, all NaN if it was not sampled"""
+        values=self.registers.get((page, register))
+        if values is None:
+            values=toArray([math.nan]*len(self.timestamps))
+        return values
+
+    def decode(self, layout="SFF8636", biasMultiplier=1, flags=True):
+        """decode:
+        Decodes every DDM field of layout
+        Inputs:
+        layout (str) : SFF8636 (QSFP) or CMIS (QSFP-DD, OSFP) (default SFF8636)
+        biasMultiplier (int) : CMIS Tx bias multiplier, 1, 2 or 4, from page 01h byte 160 (default 1)
+        flags (boolean) : Also decode the flags (default True)
+        Returns dict of {field name: array}, with "time" holding the timestamps; fields none of whose
+        registers were sampled are left out"""
+        decoded={"time":self.timestamps}
+        for name, page, register, signed, scale in monitorFields(layout, biasMultiplier):
+            if (page, register) in self.registers or (page, register+1) in self.registers:
+                decoded[name]=decodeWord(self.register(page, register), self.register(page, register+1),
+                                         signed, scale)
+        if flags:
+            for name, page, register, bit in flagFields(layout):
+                if (page, register) in self.registers:
+                    decoded[name]=decodeBit(self.registers[(page, register)], bit)
+        return decoded
+
+def summarize(decoded):
+    """summarize:
+    Summarizes decoded fields
+    Returns dict of {field name: (samples, min, mean, max)} over the non-NaN values;
+    for flags, max is 1.0 if the flag was ever set"""
+    summary={}
+    for name, values in decoded.items():
+        if name=="time":
+            continue
+        if numpy is not None:
+            valid=values[~numpy.isnan(values)]
+            if len(valid)==0:
+                summary[name]=(0, math.nan, math.nan, math.nan)
+            else:
+                summary[name]=(len(valid), float(valid.min()), float(valid.mean()), float(valid.max()))
+            continue
+        valid=[x for x in values if not math.isnan(x)]
+        if len(valid)==0:
+            summary[name]=(0, math.nan, math.nan, math.nan)
+        else:
+            summary[name]=(len(valid), min(valid), sum(valid)/len(valid), max(valid))
+    return summary
+
+if __name__=='__main__':
+    import argparse
+    import csv
+    parser=argparse.ArgumentParser(description='Decode DDM fields from sample stores written by TBMonitor')
+    parser.add_argument('stores', nargs='+', help='Sample store directories, one per module')
+    parser.add_argument('--layout', '-l', default='SFF8636', help='Register layout, SFF8636 (QSFP) or CMIS (QSFP-DD, OSFP)')
+    parser.add_argument('--biasmultiplier', type=int, default=1, help='CMIS Tx bias multiplier (1, 2 or 4)')
+    parser.add_argument('--noflags', action='store_true', help='Only decode the monitor values')
+    parser.add_argument('--outfile', '-o', help='Write every decoded sample to this CSV file, with a store column')
+    args=parser.parse_args()
+    layout=args.layout.upper()
+    writer=None
+    fp=None
+    try:
+        if args.outfile is not None:
+            fp=open(args.outfile, 'w', newline='')
+            writer=csv.writer(fp)
+        for path in args.stores:
+            start=time.monotonic()
+            try:
+                samples=RegisterSamples.fromStore(path)
+                decoded=samples.decode(layout, args.biasmultiplier, not args.noflags)
+            except Exception as e:
+                print(f'Could not decode {path} : {e}')
+                continue
+            print(f"{path}: {len(samples)} samples decoded in {time.monotonic()-start:.3f} s"
+                  f"{'' if numpy is not None else ' (without NumPy)'}")
+            for name, (count, low, mean, high) in summarize(decoded).items():
+                print(f"    {name:28} {count:8d}  min {low:10.4f}  mean {mean:10.4f}  max {high:10.4f}")
+            if writer is not None:
+                names=list(decoded)
+                writer.writerow(["store"]+names)
+                for idx in range(len(samples)):
+                    row=[decoded[name][idx] for name in names]
+                    row[0]=datetime.datetime.fromtimestamp(row[0]).isoformat(timespec='milliseconds')
+                    writer.writerow([path]+row)
+    finally:
+        if fp is not None:
+            fp.close()
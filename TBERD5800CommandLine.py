@@ -31,7 +31,7 @@ while not tb1.isConnected:
         print(f"Did not connect to TB5800 Correctly: Exception {e}")
 writelog("Entering Remote mode.")
 tb1.setRemoteOn()
-time.sleep(1)
+tb1.waitReady()
 #Bring up app selection screen automatically after connecting to remote   
 #Will automatically reconnect if necessary
 try:
@@ -25,7 +25,9 @@ commonapps=[{"name":"100 Gig E Layer 2 Traffic Terminate", "appId":"TermEth100GL
             {"name":"25 Gig E Layer 2 Traffic Terminate", "appId":"TermEth25GL2Traffic"}]
 
 from TBControllerCommon import *
-import traceback
+from TBControllerAsync import *
+
+TB5800_BASE_PORT=8000 #Port answering MOD:FUNC:PORT? with the module port
 class TBERD5800Controls(Controller_base):
     """class TBERD5800HLControls: A high-level control class for the T-BERD 5800
     A highly modification of tberd5800scriptSample.RemoteControl5800"""
@@ -39,7 +41,8 @@ class TBERD5800Controls(Controller_base):
         # Check IP format
         
         self.commonapps=commonapps
-        self.currentport = 8000
+        self.currentport = TB5800_BASE_PORT
+        self.baseport = TB5800_BASE_PORT
         self.side = "BOTH"
         self.slic = "BASE"
         self.isConnected=False
@@ -51,7 +54,7 @@ class TBERD5800Controls(Controller_base):
         self.validports=[1, 2]
         m = re.match('(\d+)\.(\d+)\.(\d+)\.(\d+)', targetip.strip())
         if not m:
-            writelog('Wrong IP format, please check and then continue')
+            transportLog.error('Wrong IP format, please check and then continue')
             raise ValueError(f"IP address of {targetip} is invalid")
         
         try:
@@ -60,7 +63,7 @@ class TBERD5800Controls(Controller_base):
             #Line added: Set socket timeout (Was infinite before)
             self.soc.settimeout(timeout)
         except Exception as msg:
-            writelog(f'Failed to create socket. Error: {msg}')
+            transportLog.error('Failed to create socket. Error: %s', msg)
             return
 
         
@@ -69,19 +72,30 @@ class TBERD5800Controls(Controller_base):
         self.laserStatus=False
         self.ipValid=True
     
-    def connect(self, verbose=False):
+    def poolKey(self):
+        """poolKey:
+        Returns the connectionPool key for this T-BERD 5800 module (ip, baseport, side, slic)"""
+        return (self.ip, self.baseport, self.side, self.slic)
+
+    @dispatched
+    def connect(self, verbose=False, usePool=True):
         """
         connect:
         Modified version of connect from tberd5800scriptSample with (verbose)
         and normal (quiet) modes.
         
         Connects T-BERD 5800 to remote mode and sets connected status in object
+        Inputs:
+        verbose (boolean) : Verbose mode when True (default False)
+        usePool (boolean) : Reuse a connection from connectionPool if one is available (default True)
         Returns True on successful connection, False othersise"""
         shh=not verbose
+        if usePool and self.connectFromPool():
+            return True
         try:
             moduleParams = self.side + "," + self.slic + ",\"BERT\""
-            #Open current port and send *REM command
-            self.socketOpen(str(self.currentport))
+            #Open base port and send *REM command
+            self.socketOpen(str(self.baseport))
             if self.debug:
                 self.socketSend("*REM VISIBLE ON", shh)
             else:
@@ -90,13 +104,13 @@ class TBERD5800Controls(Controller_base):
             self.socketSend("MOD:FUNC:SEL? " + moduleParams, shh)
             resp = self.socketRead()
             if resp.strip() != "ON":
-                writelog("The module is not enabled")
+                transportLog.error("The module is not enabled")
                 return False
             # Get the module port number
             self.socketSend("MOD:FUNC:PORT? " + moduleParams, shh)
             modulePort = self.socketRead()
             if modulePort.strip() == "-1":
-                writelog("Unable to obtain the module port number")
+                transportLog.error("Unable to obtain the module port number")
                 return False
             self.socketClose()
             #2 - Get RC port number
@@ -106,25 +120,25 @@ class TBERD5800Controls(Controller_base):
             self.socketSend(":SYST:FUNC:READY? " + moduleParams, shh)
             resp = self.socketRead()
             if resp != "1":
-                writelog("The module is not ready ")
+                transportLog.error("The module is not ready ")
                 return False
             # Query for the RC port number
             self.socketSend(":SYST:FUNC:PORT? " + moduleParams, shh)
             rcPort = self.socketRead()
             if rcPort.strip() == "-1":
-                writelog("Unable to obtain the RC port number")
+                transportLog.error("Unable to obtain the RC port number")
                 return False
             self.socketClose()
             # Step 3: Connect to the RC port
             self.socketOpen(str(rcPort))
-            writelog("Connection opened to RC port " + str(self.currentport))
+            transportLog.info("Connection opened to RC port %s", self.currentport)
             self.isConnected=True
             return True
         except Exception as msg:
-            info = traceback.format_exc()
-            writelog(info + 'Error code: ' + str(msg[0]) + ' , Error message : ' + msg[1])
+            transportLog.error('Error message : %s', msg, exc_info=True)
             return False
     
+    @dispatched
     def exit(self, timeout=30):
         """exit:
         Gracefully exits remote mode and re-enables GUI if not in visible/debug mode 
@@ -135,6 +149,73 @@ class TBERD5800Controls(Controller_base):
             self.sendscpi("*GUI")# Must return to gui, returns to default app 
         self.socketClose()
     
+class AsyncTBERD5800Controls(AsyncController_base):
+    """class AsyncTBERD5800Controls: An asyncio control class for the T-BERD 5800,
+    a subclass of TBControllerAsync.AsyncController_base
+    All instrument methods are coroutines; many objects can share one event loop"""
+    def __init__(self, targetip, debug=False, timeout=30):
+        """Initialization function:
+        Inputs:
+        targetip (str): The target IP address as a string i.e. \"192.168.200.2\"
+        debug (Boolean) : Debug mode (Default false)
+        timeout (float): The timeout of each socket operation in seconds (default 30)
+        """
+        super().__init__(targetip, debug, timeout)
+        self.commonapps=commonapps
+        self.currentport = TB5800_BASE_PORT
+        self.baseport = TB5800_BASE_PORT
+        self.side = "BOTH"
+        self.slic = "BASE"
+        self.validports=[1, 2]
+
+    async def connect(self, verbose=False):
+        """
+        connect:
+        Connects T-BERD 5800 to remote mode and sets connected status in object
+        Returns True on successful connection, False othersise"""
+        shh=not verbose
+        try:
+            moduleParams = self.side + "," + self.slic + ",\"BERT\""
+            #Open current port and send *REM command
+            if not await self.socketOpen(self.baseport):
+                return False
+            await self.socketSend("*REM VISIBLE ON" if self.debug else "*REM", shh)
+            # Verify the module is on
+            await self.socketSend("MOD:FUNC:SEL? " + moduleParams, shh)
+            if await self.socketRead() != "ON":
+                transportLog.error("The module is not enabled")
+                return False
+            # Get the module port number
+            await self.socketSend("MOD:FUNC:PORT? " + moduleParams, shh)
+            modulePort = await self.socketRead()
+            if modulePort == "-1":
+                transportLog.error("Unable to obtain the module port number")
+                return False
+            #2 - Get RC port number
+            if not await self.socketOpen(modulePort):
+                return False
+            await self.socketSend("*REM", shh)
+            # Verify the module is fully booted up and ready for RC connections
+            await self.socketSend(":SYST:FUNC:READY? " + moduleParams, shh)
+            if await self.socketRead() != "1":
+                transportLog.error("The module is not ready ")
+                return False
+            # Query for the RC port number
+            await self.socketSend(":SYST:FUNC:PORT? " + moduleParams, shh)
+            rcPort = await self.socketRead()
+            if rcPort == "-1":
+                transportLog.error("Unable to obtain the RC port number")
+                return False
+            # Step 3: Connect to the RC port
+            if not await self.socketOpen(rcPort):
+                return False
+            transportLog.info("Connection opened to RC port %s", self.currentport)
+            self.isConnected=True
+            return True
+        except Exception as msg:
+            transportLog.error('Connect failed: %s', msg)
+            return False
+
 """
 Any question about the script, please contact Brad Sicotte at 
 email: bsicotte@teracomm.com
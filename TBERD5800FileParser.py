@@ -33,8 +33,10 @@ helpcommandlist="""
 """
 #from TBERDCommandTypes import parseInputFile
 from TBERD5800Controls import *
-import time
+from TBCommandPlan import *
+from TBResultSink import *
 import argparse
+import sys
 
 DEBUG=False
 defaultApp="TermEth100GL2Traffic 1"
@@ -44,12 +46,19 @@ parser=argparse.ArgumentParser()
 parser.add_argument('--app', '-a', help='TB5800 Application Name', default=defaultApp)
 parser.add_argument('--ipaddr', '-i', help='The IP address of the TB5800', default=defaultIP)
 parser.add_argument('--infile', '-f', help='The input file to read', default=defaultFileName)
-parser.add_argument('--outfile', '-o', help='The output file to write to; writes to terminal if none provided')
+parser.add_argument('--outfile', '-o', help='The output file to write results to as they complete; results are always printed to the terminal')
+parser.add_argument('--format', '-F', help='Output file format: text, jsonl, csv or bin (default from the --outfile extension, .tbr for bin)')
+parser.add_argument('--syncinterval', type=float, default=DEFAULTSYNCINTERVAL, help='Longest time in seconds between fsyncs of the output file')
 parser.add_argument('--listcommands', '-l', action='store_true', help='Bring up list of commands')
 parser.add_argument('--delay', '-D', help='Default delay between commands')
 parser.add_argument('--noapp', '-N', action='store_true', help='Load No Application')
+parser.add_argument('--stats', '-S', help='Record per-command timing and traffic and write it as JSON to this file')
+parser.add_argument('--logfile', help='Also write the log to this file, from a background thread')
+parser.add_argument('--loglevel', help='Lowest log level written (DEBUG, INFO, WARNING, ERROR)', default='INFO')
+parser.add_argument('--check', '-c', action='store_true', help='Only compile the input file and print the command plan')
+parser.add_argument('--noopt', action='store_true', help='Run every command on its own instead of batching adjacent PEEKs, queries and DELAYs')
+parser.add_argument('--poll', '-P', action='store_true', help='Poll PEEK/POKE for completion instead of a fixed delay')
 args=parser.parse_args()
-print(args)
 if args.listcommands:
     print(helpcommandlist)
 #elif args.ipaddr is None or args.infile is None:
@@ -74,16 +83,37 @@ else:
             print("Invalid delay value, setting default delay of 10")
             defaultdelay=10
 
-    #Parse the input file line by line and get command array
+    if args.stats is not None:
+        commandStats.enable()
+    if args.logfile is not None or args.loglevel.upper()!='INFO':
+        setupLogging(level=args.loglevel.upper(), logfile=args.logfile, queued=args.logfile is not None)
+    #Compile and check the whole input file before touching the instrument
+    try:
+        plan=CommandPlan.fromFile(inputfile)
+    except Exception as e:
+        print(f'Could not read {inputfile} : {e}')
+        sys.exit(1)
+    if not args.noopt:
+        plan.optimize()
+    if len(plan.errors)>0 or args.check:
+        print(plan)
+        sys.exit(1 if len(plan.errors)>0 else 0)
+    #Results are written as each command finishes, so open the output file first
+    sinks=[TextResultSink(sys.stdout, syncInterval=None)]
+    if args.outfile is not None:
+        try:
+            sinks.append(openResultSink(args.outfile, args.format, args.syncinterval))
+        except Exception as e:
+            print(f'Could not open {args.outfile} : {e}')
+            sys.exit(1)
     try:
-        fp=open(inputfile, "r")
-        commandarray=fp.readlines()
         #Set up TBERD5800
         tb1=TBERD5800Controls(targetip=ipaddr, timeout=defaultdelay, debug=DEBUG)
         try:
             tb1.connect()
             writelog("Connecting to App")
             tb1.setRemoteOn()
+            tb1.waitReady()
         except Exception as e:
             print(f"TB5800 Did not connect : Exception {e}")
         #Connect to Application
@@ -100,54 +130,25 @@ else:
                 except Exception as e:
                     print(f"Connect to app {appToConnect} failed : {e}")
                 
-        time.sleep(1)
         writelog("Sending commands")
-        #Send and execute commands one by one
-        cmdresults=[]
-        idx=0
-        for cmd in commandarray:
-            idx+=1
-            print(f'Current Application: {tb1.getActiveApp()}')
-            print(f'({idx}/{len(commandarray)}) {cmd.strip()}')
-            try:
-                cmdresults.append(tb1.runCommand(cmd))
-            except Exception as e:
-                print(f"Run command {cmd} failed : {e}")
-                cmdresults.append(False)
+        #Run the compiled commands
+        print("Results:")
+        plan.run(tb1, poll=args.poll, sinks=sinks, keepResults=False)
         print("Exiting TB5800 Remote Mode.")
         try:
             tb1.exit() 
         except Exception as e:
             print(f"Exit App Exception : {e}")
-        print("Final Results:")
-        if args.outfile is not None:
+        if args.stats is not None:
             try:
-                fp=open(args.outfile, 'w')
+                commandStats.dumpJson(args.stats)
             except Exception as e:
-                fp=None
-        else:
-            fp=None
-        #Print results
-        for idx in range(len(commandarray)):
-            #Iterate through commands in commandarray by index
-            if isinstance(cmdresults[idx], bool):
-                if fp is not None:
-                    fp.write(f"({idx+1}) {commandarray[idx]} returned {cmdresults[idx]}\n")
-                print(f"({idx+1}) {commandarray[idx]} returned {cmdresults[idx]}")
-            else:
-                try:
-                    #Try to convert result to hex and print if successful
-                    hxr=hex(cmdresults[idx])
-                    if fp is not None:
-                        fp.write(f"({idx+1}) {commandarray[idx]} returned {hxr}\n")
-                    print(f"({idx+1}) {commandarray[idx]} returned {hxr}")
-                except Exception as e:
-                    #Otherwise print as string
-                    if fp is not None:
-                        fp.write(f"({idx+1}) {commandarray[idx]} returned {cmdresults[idx]}\n")
-                    print(f"({idx+1}) {commandarray[idx]} returned {cmdresults[idx]}")
+                print(f"Could not write stats to {args.stats} : {e}")
     except Exception as e:
         print(f'Exception : {e}')
+    finally:
+        for sink in sinks:
+            sink.close()
 
     """
     Any question about the script, please contact Brad Sicotte at 
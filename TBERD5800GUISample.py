@@ -24,6 +24,7 @@ DEFAULT_PAD_Y=3
 DEFAULT_FONT_SETTINGS=(defaultfont, 10)
 defaultIpAddr='192.168.1.19'
 defaultApp="TermEth100GL2Traffic 1"
+CONNECTDEADLINE=60 #Longest time in seconds to keep retrying the connection
 tb1=TBERD5800Controls(defaultIpAddr)
 TEXT_BOX_START_IDX="1.0"
 threadManager=concurrent.futures.ThreadPoolExecutor()
@@ -91,20 +92,24 @@ def write_text_box(str):
     textbox1.config(state=tkinter.DISABLED)
 
 def connect_to_tb():
-    try:
-        tb1.settimeout(60)
-        tb1.connect()
-        time.sleep(0.5)
-        tb1.setRemoteOn()
-        time.sleep(0.5)
-        tb1.connectToApp(defaultApp)
-    except Exception as e:
-        time.sleep(10)
-        tb1.connect()
-        time.sleep(0.5)
-        tb1.setRemoteOn()
-        time.sleep(0.5)
-        tb1.connectToApp(defaultApp)
+    #TBERD5800Controls.connect fails at once while the module is still booting, so retry it
+    #with a short, growing wait until CONNECTDEADLINE seconds have passed
+    tb1.settimeout(60)
+    end=time.monotonic()+CONNECTDEADLINE
+    wait=POLLSTART
+    while True:
+        try:
+            if tb1.connect():
+                tb1.setRemoteOn()
+                tb1.waitReady()
+                if tb1.connectToApp(defaultApp):
+                    return True
+        except Exception as e:
+            writelog(f"Connect failed : {e}")
+        if time.monotonic()+wait>=end:
+            return False
+        time.sleep(wait)
+        wait=min(wait*2, POLLMAX)
 
 def init_tb5800():
     currthreads=get_live_threads()
@@ -116,13 +121,13 @@ def init_tb5800():
     idx=0
     while timerthread.running():
         #print(idx)
-        write_text_box(f'Connnecting: {idx}/max 60')
+        write_text_box(f'Connnecting: {idx}/max {CONNECTDEADLINE}')
         time.sleep(1)
         idx+=1
     #thread2.join() #Auto joins timerthread
     #time.sleep(1)
     timerthread.cancel()
-    write_text_box("App Connected")
+    write_text_box("App Connected" if timerthread.result() else f"Could not connect within {CONNECTDEADLINE} s")
 
 def exitApp():
     
@@ -0,0 +1,284 @@
+"""TBMonitor.py
+Samples SCPI queries and I2C registers at fixed rates and streams timestamped samples to result sinks.
+Every item is scheduled against the monotonic clock: sample k of an item is due at start + k*period,
+however long earlier samples took, so the sample rate does not drift.  Items due together are
+packed into one round trip (PEEKs into one peek_list, single-line queries into one
+sendscpi_batch).  A sample that cannot be taken before the item's next one is due is a missed
+deadline: it is skipped, counted and logged, and the item carries on with its next slot.
+
+Monitor file format, one item per line:
+    rate command
+rate is Hz (10, 10Hz) or a period (0.5s, 250ms); command is a PEEK or an SCPI query as in a
+command file.  Blank lines and lines starting with # are ignored.
+    # Module temperature and supply voltage at 10 Hz, lane 1 Rx power every 2 s
+    10Hz PEEK 0 0x16
+    10Hz PEEK 0 0x1a
+    2s   SCPI :SENSE:DATA? CUR:LANE1:RX:POW
+Usage:
+    python TBMonitor.py -i 192.168.1.35 -f monitor.txt --duration 60 -o samples.jsonl
+    python TBMonitor.py -i 192.168.1.35 -f monitor.txt -q --store soak1   (see TBSampleStore)
+"""
+from TBCommandPlan import *
+from TBResultSink import *
+from TBSampleStore import SampleStore, SampleStoreSink
+import argparse
+import sys
+import datetime
+import re
+import threading
+import time
+
+RATEUNITS={"hz":None, "s":1.0, "ms":0.001} #Multipliers of a period unit; None for a rate
+MONITORWAITMAX=1.0 #Longest single wait in seconds, so stop() is noticed promptly
+
+def parseRate(text):
+    """parseRate:
+    Converts a rate (10, 10Hz) or period (0.5s, 250ms) to a period in seconds
+    Inputs:
+    text (str) : The rate or period
+    Returns float
+    Throws ValueError if text is not a positive rate or period"""
+    match=re.fullmatch(r'([0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?)\s*(hz|s|ms)?', text.strip(), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"{text} is not a rate (10Hz) or period (0.5s, 250ms)")
+    value=float(match.group(1))
+    if value<=0:
+        raise ValueError(f"Rate {text} must be positive")
+    unit=(match.group(2) or "hz").lower()
+    if RATEUNITS[unit] is None:
+        return 1.0/value
+    return value*RATEUNITS[unit]
+
+class MonitorItem:
+    """class MonitorItem:
+    One monitored PEEK or SCPI query and its schedule
+    index (int) : The item's line number in the monitor file, from 1, used as the sink index
+    command (str) : The command line
+    op (CommandOp) : The compiled PEEK or SCPI operation
+    period (float) : Seconds between samples
+    due (float) : time.monotonic() time the next sample is due
+    samples (int) : Samples taken
+    missed (int) : Samples skipped because their deadline passed
+    maxLate (float) : Longest time in seconds a sample was taken after it was due"""
+    def __init__(self, index, command, op, period):
+        if op.kind!="PEEK" and not (op.kind=="SCPI" and '?' in op.args):
+            raise ValueError(f"Only PEEK and SCPI queries can be monitored, not {command.strip()}")
+        self.index=index
+        self.command=command.strip()
+        self.op=op
+        self.period=period
+        self.due=None
+        self.samples=0
+        self.missed=0
+        self.maxLate=0.0
+
+    def __str__(self):
+        """__str__:
+        Returns the item with its rate and counts"""
+        return (f"({self.index}) {self.command} every {self.period:g} s: {self.samples} samples, "
+                f"{self.missed} missed, max late {self.maxLate*1000:.1f} ms")
+
+class Monitor:
+    """class Monitor:
+    Samples a list of MonitorItems on a controller at their rates
+    items (list(MonitorItem)) : The monitored items
+    errors (list(tuple)) : (line index, line, message) for each line that did not compile"""
+    def __init__(self, lines):
+        """Initializes an object of type Monitor, compiling every line
+        Inputs:
+        lines (list(str)) : The monitor file lines (see the module docstring)"""
+        self.items=[]
+        self.errors=[]
+        self.stopEvent=threading.Event()
+        for idx, text in enumerate(lines):
+            text=text.rstrip('\n')
+            fields=text.split(maxsplit=1)
+            if len(fields)==0 or fields[0].startswith('#'):
+                continue
+            try:
+                if len(fields)<2:
+                    raise ValueError("Line must be a rate followed by a command")
+                period=parseRate(fields[0])
+                self.items.append(MonitorItem(idx+1, fields[1], compileLine(fields[1], idx), period))
+            except ValueError as e:
+                self.errors.append((idx, text, str(e)))
+
+    @classmethod
+    def fromFile(cls, path):
+        """fromFile:
+        Compiles the monitor file at path
+        Returns Monitor"""
+        with open(path, 'r') as fp:
+            return cls(fp.readlines())
+
+    def __str__(self):
+        """__str__:
+        Returns the items one per line, followed by any errors"""
+        out=[str(item) for item in self.items]
+        out+=[f"Line {idx+1} ({text.strip()}): {msg}" for idx, text, msg in self.errors]
+        return '\n'.join(out)
+
+    def stop(self):
+        """stop:
+        Makes run return after the samples in progress, from any thread"""
+        self.stopEvent.set()
+
+    def run(self, ctrl, duration=None, sinks=None, delay=DEFAULTDELAY, poll=True, verbose=False):
+        """run:
+        Samples every item at its rate until duration passes or stop() is called
+        Inputs:
+        ctrl (Controller_base) : The connected instrument, already in the application to monitor
+        duration (float) : Seconds to run (default None, until stop())
+        sinks (list(ResultSink)) : Sinks each sample is written to with its timestamp (default None)
+        delay (float) : PEEK delay in seconds, or the longest wait with poll (default DEFAULTDELAY)
+        poll (boolean) : Poll PEEKs for completion instead of always waiting delay (default True)
+        verbose (boolean) : Verbose mode (default False)
+        Returns the total number of missed deadlines"""
+        self.stopEvent.clear()
+        #Timestamps come from the monotonic clock, anchored once to the wall clock
+        start=time.monotonic()
+        wallStart=datetime.datetime.now()
+        end=start+duration if duration is not None else None
+        for item in self.items:
+            item.due=start
+            item.samples=item.missed=0
+            item.maxLate=0.0
+        while not self.stopEvent.is_set() and len(self.items)>0:
+            now=time.monotonic()
+            if end is not None and now>=end:
+                break
+            nextDue=min(item.due for item in self.items)
+            if nextDue>now:
+                wait=nextDue-now
+                if end is not None:
+                    wait=min(wait, end-now)
+                self.stopEvent.wait(min(wait, MONITORWAITMAX))
+                continue
+            due=[item for item in self.items if item.due<=now]
+            for item in due:
+                self.skipMissed(item, now)
+            self.sample(ctrl, due, sinks, wallStart-datetime.timedelta(seconds=start), delay, poll, verbose)
+            for item in due:
+                item.due+=item.period
+        missed=sum(item.missed for item in self.items)
+        if missed>0:
+            appLog.warning("Monitor missed %d deadlines", missed)
+        return missed
+
+    def skipMissed(self, item, now):
+        """skipMissed:
+        Moves item.due past every slot whose successor is already due at now, counting them as missed"""
+        late=now-item.due
+        if late>=item.period:
+            skipped=int(late//item.period)
+            #Warn on the first miss of each item; an overloaded schedule would otherwise flood the log
+            level=logging.WARNING if item.missed==0 else logging.DEBUG
+            item.missed+=skipped
+            item.due+=skipped*item.period
+            appLog.log(level, "(%d) %s missed %d deadlines", item.index, item.command, skipped)
+        item.maxLate=max(item.maxLate, now-item.due)
+
+    def sample(self, ctrl, items, sinks, epoch, delay, poll, verbose):
+        """sample:
+        Takes one sample of each item, packing PEEKs and single-line queries into one round trip each,
+        and writes the samples to the sinks
+        epoch (datetime) : The wall clock time at time.monotonic() zero, for timestamps"""
+        peeks=[item for item in items if item.op.kind=="PEEK"]
+        queries=[item for item in items if isBatchQuery(item.op)]
+        others=[item for item in items if item.op.kind!="PEEK" and not isBatchQuery(item.op)]
+        groups=[]
+        if len(peeks)>0:
+            groups.append((peeks, lambda: ctrl.peek_list([x.op.args for x in peeks], delay=delay,
+                                                        verbose=verbose, poll=poll)))
+        if len(queries)>0:
+            groups.append((queries, lambda: ctrl.sendscpi_batch([x.op.args for x in queries],
+                                                               verbose=verbose, parse=False)))
+        for item in others:
+            groups.append(([item], lambda item=item: [ctrl.sendscpi(item.op.args, verbose=verbose)]))
+        for group, func in groups:
+            taken=time.monotonic()
+            try:
+                values=func()
+            except Exception as e:
+                appLog.error("Monitor sample failed : %s", e)
+                values=None
+            latency=time.monotonic()-taken
+            if values is None:
+                values=[False]*len(group)
+            #A PEEK that failed within the group is None; record it as a failed command
+            values=[False if value is None else value for value in values]
+            timestamp=epoch+datetime.timedelta(seconds=taken)
+            for item, value in zip(group, values):
+                item.samples+=1
+                if sinks is not None:
+                    for sink in sinks:
+                        #A sink that cannot take one sample must not end a long run
+                        try:
+                            sink.write(item.index, item.command, value, timestamp, latency)
+                        except Exception as e:
+                            appLog.error("Monitor could not write (%d) %s : %s", item.index, item.command, e)
+
+if __name__=='__main__':
+    from TBMultiRunner import InstrumentRun
+    parser=argparse.ArgumentParser()
+    parser.add_argument('--infile', '-f', help='The monitor file', default='monitor.txt')
+    parser.add_argument('--ipaddr', '-i', help='IP address (ipaddr[:port]) of the instrument', default='192.168.1.35')
+    parser.add_argument('--type', '-t', default='ONA', help='Instrument type, ONA or TBERD')
+    parser.add_argument('--module', '-m', help='ONA module name')
+    parser.add_argument('--app', '-a', help='Application to connect to before monitoring, e.g. "TermEth100GL2Traffic 1"')
+    parser.add_argument('--duration', '-d', type=float, help='Seconds to monitor (default until Ctrl-C)')
+    parser.add_argument('--delay', '-D', type=float, default=10, help='Socket timeout of each operation in seconds')
+    parser.add_argument('--nopoll', action='store_true', help='Wait the fixed PEEK delay instead of polling for completion')
+    parser.add_argument('--outfile', '-o', help='Write samples to this file as they are taken')
+    parser.add_argument('--format', '-F', help='Output file format: text, jsonl, csv or bin (default from the --outfile extension, .tbr for bin)')
+    parser.add_argument('--syncinterval', type=float, default=DEFAULTSYNCINTERVAL, help='Longest time in seconds between fsyncs of the output file')
+    parser.add_argument('--store', help='Append samples to the sample store in this directory, created if needed')
+    parser.add_argument('--quiet', '-q', action='store_true', help='Do not print samples to the terminal')
+    parser.add_argument('--check', '-c', action='store_true', help='Only compile the monitor file and print the items')
+    args=parser.parse_args()
+
+    try:
+        monitor=Monitor.fromFile(args.infile)
+    except Exception as e:
+        print(f'Could not read {args.infile} : {e}')
+        sys.exit(1)
+    if len(monitor.errors)>0 or args.check:
+        print(monitor)
+        sys.exit(1 if len(monitor.errors)>0 else 0)
+    sinks=[] if args.quiet else [TextResultSink(sys.stdout, syncInterval=None)]
+    if args.outfile is not None:
+        try:
+            sinks.append(openResultSink(args.outfile, args.format, args.syncinterval))
+        except Exception as e:
+            print(f'Could not open {args.outfile} : {e}')
+            sys.exit(1)
+    if args.store is not None:
+        try:
+            sinks.append(SampleStoreSink(SampleStore(args.store), args.syncinterval))
+        except Exception as e:
+            print(f'Could not open sample store {args.store} : {e}')
+            sys.exit(1)
+    missed=0
+    try:
+        ctrl=InstrumentRun(args.ipaddr, args.type, args.module).newController(args.delay)
+        if not ctrl.connect():
+            print(f"{args.ipaddr} did not connect")
+            sys.exit(1)
+        ctrl.setRemoteOn()
+        ctrl.waitReady()
+        if args.app is not None and not ctrl.connectToApp(args.app):
+            print(f"Connect to app {args.app} failed")
+            sys.exit(1)
+        try:
+            missed=monitor.run(ctrl, args.duration, sinks, poll=not args.nopoll)
+        except KeyboardInterrupt:
+            pass
+        print(monitor)
+        try:
+            ctrl.exit()
+        except Exception as e:
+            print(f"Exit App Exception : {e}")
+    finally:
+        for sink in sinks:
+            sink.close()
+    sys.exit(1 if missed>0 else 0)
@@ -0,0 +1,260 @@
+"""TBMultiRunner.py
+Runs one command file on many ONA-1000 / T-BERD 5800 instruments in parallel and prints one
+merged result table, with a column per instrument and per-instrument timing.
+The file is compiled once (see TBCommandPlan) and checked before any instrument is contacted.
+Each instrument is connected and run in its own thread, so the whole run takes about as long
+as the slowest instrument.
+
+Instruments are given as IP addresses on the command line and/or in an inventory file with one
+instrument per line:
+    ipaddr[:port] [ONA|TBERD] [moduleName]
+Blank lines and lines starting with # are ignored.  The type defaults to --type, the port to the
+instrument's standard base port, and moduleName (ONA only) to the default module.
+
+Usage:
+    python TBMultiRunner.py -f testcmd.txt -i 192.168.1.35 192.168.1.36
+    python TBMultiRunner.py -f testcmd.txt --inventory boxes.txt -o results.csv --timeout 600
+"""
+from ONA1000Controls import ONA1000Controls
+from TBERD5800Controls import TBERD5800Controls
+from TBCommandPlan import *
+from TBResultSink import formatResult
+import concurrent.futures
+import socket
+import argparse
+import csv
+import threading
+import time
+import sys
+
+DEFAULTRUNTIMEOUT=3600 #Seconds each instrument may take to connect and run the whole file
+INSTRUMENTTYPES=("ONA", "TBERD")
+RUNNERPOLLMAX=1.0 #Longest wait in seconds before runAll checks for newly started runs
+
+class InstrumentRun:
+    """class InstrumentRun:
+    One instrument of a multi-instrument run, and its outcome
+    name (str) : The instrument as given (ipaddr[:port])
+    kind (str) : ONA or TBERD
+    status (str) : pending, ok, or what went wrong
+    times (dict) : Seconds spent in each phase: connect, app, run, total
+    started (float) : time.monotonic() time the run started, None until then
+    results (list) : One result per command file line, None until run"""
+    def __init__(self, name, kind="ONA", moduleName=None):
+        """Initializes an object of type InstrumentRun
+        Inputs:
+        name (str) : ipaddr or ipaddr:port
+        kind (str) : ONA or TBERD (default ONA)
+        moduleName (str) : ONA module name (default None, the ONA1000Controls default)"""
+        kind=kind.upper()
+        if kind not in INSTRUMENTTYPES:
+            raise ValueError(f"Instrument type {kind} is not one of {INSTRUMENTTYPES}")
+        self.name=name
+        self.kind=kind
+        self.moduleName=moduleName
+        hostport=name.rsplit(':', 1)
+        self.ip=hostport[0]
+        self.port=int(hostport[1]) if len(hostport)>1 else None
+        self.status="pending"
+        self.times={}
+        self.results=None
+        self.ctrl=None
+        self.started=None
+
+    def newController(self, timeout):
+        """newController:
+        Creates the controller for this instrument with the given socket timeout"""
+        if self.kind=="ONA":
+            if self.moduleName is not None:
+                ctrl=ONA1000Controls(self.ip, timeout=timeout, moduleName=self.moduleName)
+            else:
+                ctrl=ONA1000Controls(self.ip, timeout=timeout)
+        else:
+            ctrl=TBERD5800Controls(self.ip, timeout=timeout)
+        if self.port is not None:
+            ctrl.baseport=self.port
+        return ctrl
+
+    def run(self, plan, app=None, timeout=DEFAULTRUNTIMEOUT, socketTimeout=10, poll=False):
+        """run:
+        Connects to the instrument, starts app and runs plan, recording status, times and results.
+        No operation is started after timeout seconds; commands not run return False
+        Inputs:
+        plan (CommandPlan) : The compiled command file
+        app (str) : The application to connect to first (default None, stay in the current app)
+        timeout (float) : Seconds for the whole run (default DEFAULTRUNTIMEOUT)
+        socketTimeout (float) : Socket timeout of each operation in seconds (default 10)
+        poll (boolean) : Poll PEEK/POKE for completion (default False)
+        Returns self"""
+        threading.current_thread().name=self.name
+        start=time.monotonic()
+        self.started=start
+        deadline=start+timeout
+        try:
+            self.ctrl=self.newController(socketTimeout)
+            if not self.ctrl.connect():
+                if self.status=="pending":
+                    self.status="connect failed"
+                return self
+            self.ctrl.setRemoteOn()
+            self.ctrl.waitReady()
+            self.times["connect"]=time.monotonic()-start
+            if app is not None:
+                phase=time.monotonic()
+                if not self.ctrl.connectToApp(app):
+                    if self.status=="pending":
+                        self.status="app failed"
+                    return self
+                self.times["app"]=time.monotonic()-phase
+            phase=time.monotonic()
+            self.results=plan.run(self.ctrl, poll=poll, deadline=deadline)
+            self.times["run"]=time.monotonic()-phase
+            if self.status=="pending":
+                self.status="ok" if time.monotonic()<=deadline else "timeout"
+            try:
+                self.ctrl.exit()
+            except Exception as e:
+                appLog.warning("Exit App Exception : %s", e)
+        except Exception as e:
+            if self.status=="pending":
+                self.status=f"error: {e}"
+        finally:
+            self.times["total"]=time.monotonic()-start
+        return self
+
+    def abort(self):
+        """abort:
+        Shuts down and closes the instrument's socket from another thread, so a blocked operation
+        fails at once (on Linux close alone does not wake a blocked recv)"""
+        self.status="timeout"
+        if self.ctrl is not None and self.ctrl.soc is not None:
+            soc=self.ctrl.soc
+            try:
+                soc.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                #Not connected
+                pass
+            try:
+                soc.close()
+            except Exception as e:
+                pass
+
+def readInventory(path, kind="ONA"):
+    """readInventory:
+    Reads an inventory file (see the module docstring)
+    Inputs:
+    path (str) : The inventory file
+    kind (str) : The type of instruments whose line gives none (default ONA)
+    Returns list of InstrumentRun"""
+    runs=[]
+    with open(path, 'r') as fp:
+        for line in fp:
+            fields=line.split()
+            if len(fields)==0 or fields[0].startswith('#'):
+                continue
+            runs.append(InstrumentRun(fields[0], fields[1] if len(fields)>1 else kind,
+                                      fields[2] if len(fields)>2 else None))
+    return runs
+
+def runAll(runs, plan, app=None, timeout=DEFAULTRUNTIMEOUT, socketTimeout=10, poll=False, workers=None):
+    """runAll:
+    Runs plan on every instrument in parallel and waits for all of them
+    Instruments still busy timeout seconds (plus a grace period) after their own run started are
+    aborted, including runs that waited for a free worker.
+    Inputs:
+    runs (list(InstrumentRun)) : The instruments
+    plan (CommandPlan) : The compiled command file
+    app (str) : The application to connect to first (default None)
+    timeout (float) : Seconds for each instrument's whole run (default DEFAULTRUNTIMEOUT)
+    socketTimeout (float) : Socket timeout of each operation in seconds (default 10)
+    poll (boolean) : Poll PEEK/POKE for completion (default False)
+    workers (int) : Most instruments run at once (default None, all of them)
+    Returns runs"""
+    if len(runs)==0:
+        return runs
+    executor=concurrent.futures.ThreadPoolExecutor(max_workers=workers or len(runs))
+    try:
+        futures={executor.submit(x.run, plan, app, timeout, socketTimeout, poll): x for x in runs}
+        limit=timeout+socketTimeout
+        watched=set(futures)
+        while len(watched)>0:
+            now=time.monotonic()
+            for future in list(watched):
+                run=futures[future]
+                if not future.done() and run.started is not None and now>=run.started+limit:
+                    appLog.error("%s did not finish in %s s; aborting", run.name, timeout)
+                    run.abort()
+                    watched.discard(future)
+            watched={x for x in watched if not x.done()}
+            if len(watched)==0:
+                break
+            #Wake at the earliest deadline of a started run, or sooner while some wait for a worker
+            waits=[futures[x].started+limit-now for x in watched if futures[x].started is not None]
+            if len(waits)<len(watched):
+                waits.append(RUNNERPOLLMAX)
+            concurrent.futures.wait(watched, timeout=max(0, min(waits)),
+                                    return_when=concurrent.futures.FIRST_COMPLETED)
+    finally:
+        #Aborted runs end on their own once their socket fails; do not wait for them here
+        executor.shutdown(wait=False)
+    return runs
+
+def resultTable(runs, plan):
+    """resultTable:
+    Builds the merged result table
+    Returns list of rows: a header row, one row per command line, then status and timing rows"""
+    rows=[["line", "command"]+[x.name for x in runs]]
+    for idx, line in enumerate(plan.lines):
+        rows.append([str(idx+1), line.strip()]+
+                    [formatResult(x.results[idx]) if x.results is not None else '' for x in runs])
+    rows.append(['', "status"]+[x.status for x in runs])
+    for phase in ("connect", "app", "run", "total"):
+        rows.append(['', f"{phase} s"]+
+                    [f"{x.times[phase]:.3f}" if phase in x.times else '' for x in runs])
+    return rows
+
+def printTable(rows):
+    """printTable:
+    Prints rows as aligned columns"""
+    widths=[max(len(row[col]) for row in rows) for col in range(len(rows[0]))]
+    for row in rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser()
+    parser.add_argument('--infile', '-f', help='The command file to run', default='testcmd.txt')
+    parser.add_argument('--ipaddr', '-i', nargs='*', default=[], help='IP addresses (ipaddr[:port]) of the instruments')
+    parser.add_argument('--inventory', '-I', help='Inventory file of instruments, one per line')
+    parser.add_argument('--type', '-t', default='ONA', help='Instrument type for addresses without one, ONA or TBERD')
+    parser.add_argument('--app', '-a', help='Application to connect to before running, e.g. "TermEth100GL2Traffic 1"')
+    parser.add_argument('--timeout', '-T', type=float, default=DEFAULTRUNTIMEOUT, help='Seconds each instrument may take for the whole run')
+    parser.add_argument('--delay', '-D', type=float, default=10, help='Socket timeout of each operation in seconds')
+    parser.add_argument('--workers', '-w', type=int, help='Most instruments to run at once (default all)')
+    parser.add_argument('--poll', '-P', action='store_true', help='Poll PEEK/POKE for completion instead of a fixed delay')
+    parser.add_argument('--noopt', action='store_true', help='Do not batch adjacent PEEKs, queries and DELAYs')
+    parser.add_argument('--outfile', '-o', help='Write the merged result table to this CSV file')
+    args=parser.parse_args()
+    #Each instrument runs in a thread named after it, so name the thread in every log line
+    setupLogging(fmt="%(asctime)s %(threadName)s >%(message)s")
+
+    plan=CommandPlan.fromFile(args.infile)
+    if not args.noopt:
+        plan.optimize()
+    if len(plan.errors)>0:
+        print(plan)
+        sys.exit(1)
+    runs=[InstrumentRun(x, args.type) for x in args.ipaddr]
+    if args.inventory is not None:
+        runs+=readInventory(args.inventory, args.type)
+    if len(runs)==0:
+        print("No instruments given; use --ipaddr or --inventory")
+        sys.exit(1)
+    start=time.monotonic()
+    runAll(runs, plan, args.app, args.timeout, args.delay, args.poll, args.workers)
+    writelog(f"{len(runs)} instruments finished in {time.monotonic()-start:.3f} s")
+    rows=resultTable(runs, plan)
+    printTable(rows)
+    if args.outfile is not None:
+        with open(args.outfile, 'w', newline='') as fp:
+            csv.writer(fp).writerows(rows)
+    sys.exit(0 if all(x.status=="ok" for x in runs) else 1)
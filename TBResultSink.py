@@ -0,0 +1,370 @@
+"""TBResultSink.py
+Result sinks for command file runs.  Each result is written as soon as its command finishes,
+so a long run keeps constant memory and a crash loses at most the last few records.
+Files are flushed after every record and fsynced at most every syncInterval seconds.
+Formats:
+    text  : (n) CMD returned X, as the FileParser scripts have always printed
+    jsonl : one JSON object per line: {"index", "command", "result", "time"}
+    csv   : index,command,result,time with a header row
+    bin   : binary columns (see BinaryResultSink), read back with loadResults
+Example:
+    with openResultSink("results.jsonl") as sink:
+        plan.run(ona1, sinks=[sink])
+"""
+from TBControllerCommon import *
+from TBCommandPlan import compileLine
+import os
+import csv
+import json
+import math
+import array
+import struct
+import datetime
+import functools
+import sys
+import time
+
+RESULTFORMATS=("text", "jsonl", "csv", "bin")
+DEFAULTSYNCINTERVAL=5.0 #Seconds between fsyncs of a result file
+
+def formatResult(result):
+    """formatResult:
+    Formats a command result as the FileParser scripts print it:
+    booleans as True/False, integers in hex, anything else as a string"""
+    if isinstance(result, bool):
+        return str(result)
+    try:
+        return hex(result)
+    except Exception as e:
+        return str(result)
+
+def formatTime(timestamp=None):
+    """formatTime:
+    Returns timestamp (a datetime, default now) as an ISO 8601 string with milliseconds"""
+    if timestamp is None:
+        timestamp=datetime.datetime.now()
+    return timestamp.isoformat(timespec='milliseconds')
+
+def jsonResult(result):
+    """jsonResult:
+    Returns result as a JSON-compatible value; anything other than None, bool, int, float and str becomes its string"""
+    if result is None or isinstance(result, (bool, int, float, str)):
+        return result
+    return str(result)
+
+class ResultSink:
+    """class ResultSink:
+    Writes command results to a file object as they arrive
+    Subclasses implement writeRecord for their format"""
+    def __init__(self, fp, syncInterval=DEFAULTSYNCINTERVAL, closefp=False):
+        """Initializes an object of type ResultSink
+        Inputs:
+        fp (file) : The file object to write to
+        syncInterval (float) : Longest time in seconds between fsyncs, 0 to fsync every record,
+                               None to never fsync (default DEFAULTSYNCINTERVAL)
+        closefp (boolean) : Close fp when the sink is closed (default False)"""
+        self.fp=fp
+        self.syncInterval=syncInterval
+        self.closefp=closefp
+        self.lastSync=time.monotonic()
+        self.count=0
+        try:
+            self.fileno=fp.fileno()
+        except Exception as e:
+            self.fileno=None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def write(self, index, command, result, timestamp=None, latency=None):
+        """write:
+        Writes one result, flushes it, and fsyncs if syncInterval has passed
+        Inputs:
+        index (int) : The line number of the command, from 1
+        command (str) : The command line
+        result : The value the command returned
+        timestamp (datetime) : When the result was taken (default None, now)
+        latency (float) : Seconds the command took, if known (default None)"""
+        self.writeRecord(index, command.strip(), result, timestamp, latency)
+        self.count+=1
+        self.fp.flush()
+        if self.syncInterval is not None and time.monotonic()-self.lastSync>=self.syncInterval:
+            self.sync()
+
+    def writeRecord(self, index, command, result, timestamp=None, latency=None):
+        #Blank function, must be implemented for each format
+        pass
+
+    def sync(self):
+        """sync:
+        Flushes and fsyncs the file so records written so far survive a crash"""
+        self.fp.flush()
+        if self.fileno is not None and not self.fp.isatty():
+            try:
+                os.fsync(self.fileno)
+            except OSError as e:
+                #Pipes and consoles cannot be synced
+                self.fileno=None
+        self.lastSync=time.monotonic()
+
+    def close(self):
+        """close:
+        Syncs the file and closes it if the sink opened it"""
+        if self.fp is None:
+            return
+        self.sync()
+        if self.closefp:
+            self.fp.close()
+        self.fp=None
+
+class TextResultSink(ResultSink):
+    """class TextResultSink:
+    Writes (n) CMD returned X lines, preceded by the time when a timestamp is given"""
+    def writeRecord(self, index, command, result, timestamp=None, latency=None):
+        stamp=f"{formatTime(timestamp)} " if timestamp is not None else ''
+        self.fp.write(f"{stamp}({index}) {command} returned {formatResult(result)}\n")
+
+class JsonLinesResultSink(ResultSink):
+    """class JsonLinesResultSink:
+    Writes one JSON object per result: {"index", "command", "result", "time"}"""
+    def writeRecord(self, index, command, result, timestamp=None, latency=None):
+        record={"index":index, "command":command, "result":jsonResult(result),
+                "time":formatTime(timestamp)}
+        self.fp.write(json.dumps(record)+"\n")
+
+class CsvResultSink(ResultSink):
+    """class CsvResultSink:
+    Writes index,command,result,time rows after a header row; result is formatted as in text output"""
+    def __init__(self, fp, syncInterval=DEFAULTSYNCINTERVAL, closefp=False):
+        super().__init__(fp, syncInterval, closefp)
+        self.writer=csv.writer(fp)
+        self.writer.writerow(["index", "command", "result", "time"])
+
+    def writeRecord(self, index, command, result, timestamp=None, latency=None):
+        self.writer.writerow([index, command, formatResult(result), formatTime(timestamp)])
+
+#Operation codes of the binary format; 0xff for anything else
+OPCODES={"NOP":0, "PEEK":1, "POKE":2, "SCPI":3, "DELAY":4, "START":5, "MULTISTART":6, "CLOSEAPP":7,
+         "CURR":8, "GETACTIVE":9, "HELP":10, "EXIT":11}
+OPUNKNOWN=0xff
+#Result status codes of the binary format
+STATUSFAILED=0 #False or None
+STATUSVALUE=1  #A number, in the value column
+STATUSOK=2     #True
+STATUSTEXT=3   #A non-numeric response, in the text table
+BINARYMAGIC=b"TBRESULT"
+BINARYVERSION=1
+BINARYBLOCKSIZE=4096 #Records buffered before a block is written
+BLOCKHEADER=struct.Struct("<4sII") #b"TBRB", record count, length of the JSON metadata
+#(name, array typecode) of each column, in file order
+BINARYCOLUMNS=(("time", 'd'), ("value", 'd'), ("latency", 'f'), ("index", 'I'),
+               ("page", 'h'), ("register", 'h'), ("op", 'B'), ("status", 'B'))
+
+@functools.lru_cache(maxsize=1024)
+def commandFields(command):
+    """commandFields:
+    Returns tuple (op code, page, register) of a command line for the binary format;
+    page and register are -1 unless it is a PEEK or POKE"""
+    try:
+        op=compileLine(command, 0)
+    except ValueError:
+        return (OPUNKNOWN, -1, -1)
+    if op.kind in ("PEEK", "POKE"):
+        return (OPCODES[op.kind], op.args[0], op.args[1])
+    return (OPCODES.get(op.kind, OPUNKNOWN), -1, -1)
+
+class BinaryResultSink(ResultSink):
+    """class BinaryResultSink:
+    Writes results as blocks of little-endian columns, which loadResults reads back with one copy
+    per column per block.  Each record has:
+        time (float64) : Seconds since the epoch
+        value (float64) : The numeric result, NaN if there is none
+        latency (float32) : Seconds the command took, NaN if unknown
+        index (uint32) : The line number of the command
+        page, register (int16) : The PEEK/POKE page and register, -1 for other commands
+        op (uint8) : The command's OPCODES entry
+        status (uint8) : STATUSFAILED, STATUSVALUE, STATUSOK or STATUSTEXT
+    A block is a BLOCKHEADER, JSON metadata {"commands": {index: command}, "text": {record: response}}
+    holding the commands first seen in the block and the STATUSTEXT responses by record number
+    within the block, then each column of BINARYCOLUMNS in turn.
+    Records are buffered and written a block at a time, at least every syncInterval seconds."""
+    def __init__(self, fp, syncInterval=DEFAULTSYNCINTERVAL, closefp=False):
+        super().__init__(fp, syncInterval, closefp)
+        self.commands={}
+        self.newCommands={}
+        self.text={}
+        self.columns={name:array.array(code) for name, code in BINARYCOLUMNS}
+        fp.write(BINARYMAGIC+struct.pack("<I", BINARYVERSION))
+
+    def writeRecord(self, index, command, result, timestamp=None, latency=None):
+        if self.commands.get(index)!=command:
+            self.commands[index]=command
+            self.newCommands[index]=command
+        op, page, register=commandFields(command)
+        value=math.nan
+        if result is None or result is False:
+            status=STATUSFAILED
+        elif result is True:
+            status=STATUSOK
+        else:
+            if isinstance(result, str):
+                result=parseScpiValue(result)
+            if isinstance(result, (int, float)):
+                value=float(result)
+                status=STATUSVALUE
+            else:
+                status=STATUSTEXT
+                self.text[len(self.columns["time"])]=str(result)
+        if timestamp is None:
+            timestamp=datetime.datetime.now()
+        columns=self.columns
+        columns["time"].append(timestamp.timestamp())
+        columns["value"].append(value)
+        columns["latency"].append(math.nan if latency is None else latency)
+        columns["index"].append(index)
+        columns["page"].append(page)
+        columns["register"].append(register)
+        columns["op"].append(op)
+        columns["status"].append(status)
+        if len(columns["time"])>=BINARYBLOCKSIZE:
+            self.writeBlock()
+
+    def writeBlock(self):
+        """writeBlock:
+        Writes the buffered records as one block"""
+        count=len(self.columns["time"])
+        if count==0:
+            return
+        meta=json.dumps({"commands":self.newCommands, "text":self.text}).encode()
+        self.fp.write(BLOCKHEADER.pack(b"TBRB", count, len(meta)))
+        self.fp.write(meta)
+        for name, code in BINARYCOLUMNS:
+            column=self.columns[name]
+            if sys.byteorder=="big":
+                column.byteswap()
+            self.fp.write(column.tobytes())
+            self.columns[name]=array.array(code)
+        self.newCommands={}
+        self.text={}
+
+    def sync(self):
+        """sync:
+        Writes the buffered records, then flushes and fsyncs the file"""
+        if self.fp is not None:
+            self.writeBlock()
+        super().sync()
+
+class ResultColumns:
+    """class ResultColumns:
+    Results read back by loadResults
+    columns (dict) : {name: array} for each column of BINARYCOLUMNS; wrap with numpy.frombuffer
+                     for vector maths without copying
+    commands (dict) : {index: command line}
+    text (dict) : {record number: response} for the STATUSTEXT records"""
+    def __init__(self, columns, commands, text):
+        self.columns=columns
+        self.commands=commands
+        self.text=text
+
+    def __len__(self):
+        return len(self.columns["time"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def result(self, record):
+        """result:
+        Returns the result of one record as the command returned it (numbers as int where integral)"""
+        status=self.columns["status"][record]
+        if status==STATUSFAILED:
+            return False
+        if status==STATUSOK:
+            return True
+        if status==STATUSTEXT:
+            return self.text[record]
+        value=self.columns["value"][record]
+        return int(value) if value.is_integer() else value
+
+def loadResults(path):
+    """loadResults:
+    Reads a file written by BinaryResultSink
+    Inputs:
+    path (str) : The file
+    Returns ResultColumns
+    Throws ValueError if path is not a binary result file"""
+    with open(path, 'rb') as fp:
+        data=memoryview(fp.read())
+    start=len(BINARYMAGIC)+4
+    if bytes(data[:len(BINARYMAGIC)])!=BINARYMAGIC:
+        raise ValueError(f"{path} is not a binary result file")
+    version=struct.unpack_from("<I", data, len(BINARYMAGIC))[0]
+    if version!=BINARYVERSION:
+        raise ValueError(f"{path} is binary result format version {version}, not {BINARYVERSION}")
+    columns={name:array.array(code) for name, code in BINARYCOLUMNS}
+    commands={}
+    text={}
+    pos=start
+    while pos+BLOCKHEADER.size<=len(data):
+        magic, count, metaLength=BLOCKHEADER.unpack_from(data, pos)
+        if magic!=b"TBRB":
+            raise ValueError(f"{path} has a bad block at byte {pos}")
+        pos+=BLOCKHEADER.size
+        blockSize=metaLength+count*sum(array.array(code).itemsize for name, code in BINARYCOLUMNS)
+        if pos+blockSize>len(data):
+            #A block cut short by a crash; keep what came before it
+            appLog.warning("%s ends in an incomplete block", path)
+            break
+        meta=json.loads(bytes(data[pos:pos+metaLength]))
+        pos+=metaLength
+        first=len(columns["time"])
+        for name, code in BINARYCOLUMNS:
+            column=columns[name]
+            end=pos+count*column.itemsize
+            if sys.byteorder=="big":
+                block=array.array(code, data[pos:end])
+                block.byteswap()
+                column.extend(block)
+            else:
+                column.frombytes(data[pos:end])
+            pos=end
+        commands.update({int(idx):command for idx, command in meta["commands"].items()})
+        text.update({first+int(idx):response for idx, response in meta["text"].items()})
+    return ResultColumns(columns, commands, text)
+
+SINKCLASSES={"text":TextResultSink, "jsonl":JsonLinesResultSink, "csv":CsvResultSink, "bin":BinaryResultSink}
+
+def resultFormat(path, fmt=None):
+    """resultFormat:
+    Returns fmt if given, otherwise the format matching the extension of path (.jsonl, .json, .csv,
+    .tbr), defaulting to text"""
+    if fmt is not None:
+        if fmt.lower() not in SINKCLASSES:
+            raise ValueError(f"Result format {fmt} is not one of {RESULTFORMATS}")
+        return fmt.lower()
+    ext=os.path.splitext(path or '')[1].lower()
+    if ext in (".jsonl", ".json"):
+        return "jsonl"
+    if ext==".csv":
+        return "csv"
+    if ext==".tbr":
+        return "bin"
+    return "text"
+
+def openResultSink(path, fmt=None, syncInterval=DEFAULTSYNCINTERVAL):
+    """openResultSink:
+    Opens path for writing and returns a sink for fmt (see resultFormat)
+    Inputs:
+    path (str) : The file to write
+    fmt (str) : text, jsonl, csv or bin (default None, from the extension of path)
+    syncInterval (float) : Longest time in seconds between fsyncs (default DEFAULTSYNCINTERVAL)
+    Returns ResultSink"""
+    fmt=resultFormat(path, fmt)
+    if fmt=="bin":
+        fp=open(path, 'wb')
+    else:
+        fp=open(path, 'w', newline='' if fmt=="csv" else None)
+    return SINKCLASSES[fmt](fp, syncInterval=syncInterval, closefp=True)
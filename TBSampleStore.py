@@ -0,0 +1,361 @@
+"""TBSampleStore.py
+An append-only store of timestamped samples for long soak runs, with one column per monitored
+register or SCPI value (the column name is the command, e.g. "PEEK 0 0x16").
+Each column is kept on disk as fixed-size chunk files, memory-mapped one at a time for appending,
+so memory stays bounded however long the run, and a store is opened again without reading it:
+only the last chunk of each column is looked at to find where appending stopped.
+
+Layout of a store directory:
+    index.json          : {"chunkSize": n, "columns": {name: fileId}}
+    <fileId>.<chunk>    : chunkSize float64 timestamps followed by chunkSize float64 values,
+                          in native byte order; unused records have timestamp 0
+Timestamps are seconds since the epoch and must not decrease within a column.  Values are stored
+as float64: numbers as they are, numeric SCPI responses parsed, anything else (including a failed
+command's False) as NaN.
+Example:
+    with SampleStore("soak1") as store:
+        monitor.run(ona1, sinks=[SampleStoreSink(store)])
+    timestamps, values=SampleStore("soak1", readonly=True).read("PEEK 0 0x16")
+"""
+from TBControllerCommon import *
+import os
+import json
+import math
+import mmap
+import contextlib
+import bisect
+import array
+import datetime
+import logging
+import sys
+import time
+
+DEFAULTCHUNKSIZE=65536 #Records per chunk file (1 MiB: 8 byte timestamp and 8 byte value each)
+STOREINDEX="index.json"
+
+def storeValue(value):
+    """storeValue:
+    Converts a command result to the float64 stored for it (see the module docstring)"""
+    if isinstance(value, bool):
+        return 1.0 if value else math.nan
+    if isinstance(value, str):
+        value=parseScpiValue(value)
+    if isinstance(value, (int, float)):
+        return float(value)
+    return math.nan
+
+def fillCount(timestamps):
+    """fillCount:
+    Returns the number of used records in a chunk: the index of the first zero timestamp"""
+    low, high=0, len(timestamps)
+    while low<high:
+        mid=(low+high)//2
+        if timestamps[mid]==0:
+            high=mid
+        else:
+            low=mid+1
+    return low
+
+class StoreColumn:
+    """class StoreColumn:
+    The chunk files of one column of a SampleStore
+    name (str) : The column name
+    fileId (str) : The prefix of the column's chunk files
+    chunks (int) : The number of chunk files
+    count (int) : The number of records in the column
+    lastTime (float) : The newest timestamp, 0 if the column is empty"""
+    def __init__(self, directory, name, fileId, chunkSize):
+        self.directory=directory
+        self.name=name
+        self.fileId=fileId
+        self.chunkSize=chunkSize
+        self.chunks=0
+        self.count=0
+        self.lastTime=0.0
+        self.fill=0 #Records used in the last chunk
+        self.fp=None
+        self.map=None
+        self.view=None
+        while os.path.exists(self.chunkPath(self.chunks)):
+            self.chunks+=1
+        if self.chunks>0:
+            with self.mapChunk(self.chunks-1) as (timestamps, values):
+                self.fill=fillCount(timestamps)
+                if self.fill>0:
+                    self.lastTime=timestamps[self.fill-1]
+            self.count=(self.chunks-1)*chunkSize+self.fill
+
+    def chunkPath(self, chunk):
+        return os.path.join(self.directory, f"{self.fileId}.{chunk:06d}")
+
+    @contextlib.contextmanager
+    def mapChunk(self, chunk):
+        """mapChunk:
+        Maps chunk read-only for the with block
+        Yields (timestamps, values) memoryviews of float64, valid only inside the with block"""
+        with open(self.chunkPath(chunk), 'rb') as fp:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as chunkmap:
+                view=memoryview(chunkmap).cast('d')
+                timestamps, values=view[:self.chunkSize], view[self.chunkSize:]
+                try:
+                    yield timestamps, values
+                finally:
+                    #The map cannot be closed while any view of it is alive
+                    timestamps.release()
+                    values.release()
+                    view.release()
+
+    def openForAppend(self):
+        """openForAppend:
+        Maps the last chunk for writing, creating a new zero-filled chunk if the last one is full"""
+        if self.chunks==0 or self.fill>=self.chunkSize:
+            with open(self.chunkPath(self.chunks), 'wb') as fp:
+                fp.truncate(self.chunkSize*16)
+            self.chunks+=1
+            self.fill=0
+        self.fp=open(self.chunkPath(self.chunks-1), 'r+b')
+        self.map=mmap.mmap(self.fp.fileno(), 0)
+        self.view=memoryview(self.map).cast('d')
+
+    def append(self, timestamp, value):
+        """append:
+        Appends one record
+        Inputs:
+        timestamp (float) : Seconds since the epoch, not before the column's last timestamp
+        value (float) : The value
+        Throws ValueError if timestamp is not positive or goes backwards"""
+        if timestamp<=0 or timestamp<self.lastTime:
+            raise ValueError(f"Timestamp {timestamp} of column {self.name} is before {self.lastTime}")
+        if self.view is not None and self.fill>=self.chunkSize:
+            self.closeChunk()
+        if self.view is None:
+            self.openForAppend()
+        self.view[self.chunkSize+self.fill]=value
+        #The timestamp marks the record as used, so write it last
+        self.view[self.fill]=timestamp
+        self.fill+=1
+        self.count+=1
+        self.lastTime=timestamp
+
+    def sync(self):
+        """sync:
+        Writes the mapped chunk to disk"""
+        if self.map is not None:
+            self.map.flush()
+
+    def closeChunk(self):
+        """closeChunk:
+        Syncs and unmaps the chunk being appended to"""
+        if self.map is None:
+            return
+        self.view.release()
+        self.map.flush()
+        self.map.close()
+        self.fp.close()
+        self.fp=self.map=self.view=None
+
+    def read(self, start=None, end=None):
+        """read:
+        Copies the records with start <= timestamp <= end into arrays
+        Inputs:
+        start (float) : The earliest timestamp (default None, from the first record)
+        end (float) : The latest timestamp (default None, to the last record)
+        Returns tuple (array('d') timestamps, array('d') values)"""
+        timestamps=array.array('d')
+        values=array.array('d')
+        self.sync()
+        for chunk in range(self.chunks):
+            with self.mapChunk(chunk) as (chunktimes, chunkvalues):
+                fill=fillCount(chunktimes) if chunk==self.chunks-1 else self.chunkSize
+                if fill==0:
+                    continue
+                if start is not None and chunktimes[fill-1]<start:
+                    continue
+                if end is not None and chunktimes[0]>end:
+                    break
+                first=0 if start is None else bisect.bisect_left(chunktimes, start, 0, fill)
+                last=fill if end is None else bisect.bisect_right(chunktimes, end, 0, fill)
+                timestamps.frombytes(chunktimes[first:last].tobytes())
+                values.frombytes(chunkvalues[first:last].tobytes())
+        return timestamps, values
+
+class SampleStore:
+    """class SampleStore:
+    A directory of columns of timestamped samples (see the module docstring)
+    path (str) : The store directory
+    chunkSize (int) : Records per chunk file
+    readonly (boolean) : True if the store was opened for reading only"""
+    def __init__(self, path, chunkSize=DEFAULTCHUNKSIZE, readonly=False):
+        """Initializes an object of type SampleStore, creating the store if it does not exist
+        Inputs:
+        path (str) : The store directory
+        chunkSize (int) : Records per chunk file of a new store; an existing store keeps its own
+                          (default DEFAULTCHUNKSIZE)
+        readonly (boolean) : Open an existing store for reading only (default False)
+        Throws FileNotFoundError if readonly and there is no store at path"""
+        self.path=path
+        self.readonly=readonly
+        self.columns={}
+        indexPath=os.path.join(path, STOREINDEX)
+        if os.path.exists(indexPath):
+            with open(indexPath, 'r') as fp:
+                index=json.load(fp)
+            self.chunkSize=index["chunkSize"]
+            for name, fileId in index["columns"].items():
+                self.columns[name]=StoreColumn(path, name, fileId, self.chunkSize)
+        elif readonly:
+            raise FileNotFoundError(f"No sample store at {path}")
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.chunkSize=chunkSize
+            self.writeIndex()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def writeIndex(self):
+        """writeIndex:
+        Replaces index.json, atomically, with the current column list"""
+        index={"chunkSize":self.chunkSize,
+               "columns":{name:column.fileId for name, column in self.columns.items()}}
+        indexPath=os.path.join(self.path, STOREINDEX)
+        with open(indexPath+".tmp", 'w') as fp:
+            json.dump(index, fp, indent=1)
+        os.replace(indexPath+".tmp", indexPath)
+
+    def names(self):
+        """names:
+        Returns list of the column names"""
+        return list(self.columns)
+
+    def count(self, name):
+        """count:
+        Returns the number of records in column name, 0 if there is no such column"""
+        return self.columns[name].count if name in self.columns else 0
+
+    def append(self, name, timestamp, value):
+        """append:
+        Appends one sample to column name, creating the column if needed
+        Inputs:
+        name (str) : The column name
+        timestamp (float or datetime) : When the sample was taken
+        value : The sample, converted with storeValue"""
+        if self.readonly:
+            raise PermissionError(f"Sample store {self.path} is read only")
+        column=self.columns.get(name)
+        if column is None:
+            column=StoreColumn(self.path, name, f"c{len(self.columns):04d}", self.chunkSize)
+            self.columns[name]=column
+            self.writeIndex()
+        if isinstance(timestamp, datetime.datetime):
+            timestamp=timestamp.timestamp()
+        column.append(timestamp, storeValue(value))
+
+    def read(self, name, start=None, end=None):
+        """read:
+        Reads the samples of column name with start <= timestamp <= end (see StoreColumn.read)
+        Returns tuple (array('d') timestamps, array('d') values)"""
+        if name not in self.columns:
+            raise KeyError(f"No column {name} in sample store {self.path}")
+        if isinstance(start, datetime.datetime):
+            start=start.timestamp()
+        if isinstance(end, datetime.datetime):
+            end=end.timestamp()
+        return self.columns[name].read(start, end)
+
+    def sync(self):
+        """sync:
+        Writes every column's mapped chunk to disk"""
+        for column in self.columns.values():
+            column.sync()
+
+    def close(self):
+        """close:
+        Syncs and unmaps every column"""
+        for column in self.columns.values():
+            column.closeChunk()
+
+class SampleStoreSink:
+    """class SampleStoreSink:
+    A result sink (see TBResultSink) that appends each result to a SampleStore,
+    in the column named after its command
+    A result timestamped before the last one in its column (e.g. after the wall clock was stepped
+    back between runs) is skipped and counted in skipped rather than stopping the run"""
+    def __init__(self, store, syncInterval=None):
+        """Initializes an object of type SampleStoreSink
+        Inputs:
+        store (SampleStore) : The store to append to
+        syncInterval (float) : Longest time in seconds between syncs of the store
+                               (default None, leave it to the operating system)"""
+        self.store=store
+        self.syncInterval=syncInterval
+        self.lastSync=time.monotonic()
+        self.count=0
+        self.skipped=0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def write(self, index, command, result, timestamp=None, latency=None):
+        """write:
+        Appends one result, timestamped now if timestamp is None; latency is not stored"""
+        if timestamp is None:
+            timestamp=datetime.datetime.now()
+        try:
+            self.store.append(command.strip(), timestamp, result)
+        except ValueError as e:
+            #Warn on the first skip only; a stepped clock would otherwise flood the log
+            level=logging.WARNING if self.skipped==0 else logging.DEBUG
+            self.skipped+=1
+            appLog.log(level, "Sample store skipped a sample : %s", e)
+            return
+        self.count+=1
+        if self.syncInterval is not None and time.monotonic()-self.lastSync>=self.syncInterval:
+            self.sync()
+
+    def sync(self):
+        self.store.sync()
+        self.lastSync=time.monotonic()
+
+    def close(self):
+        """close:
+        Closes the store"""
+        self.store.close()
+
+if __name__=='__main__':
+    import argparse
+    import csv
+    parser=argparse.ArgumentParser(description='List the columns of a sample store, or export one to CSV')
+    parser.add_argument('store', help='The sample store directory')
+    parser.add_argument('--column', '-c', help='The column to export')
+    parser.add_argument('--outfile', '-o', help='CSV file to export to (default the terminal)')
+    args=parser.parse_args()
+    try:
+        store=SampleStore(args.store, readonly=True)
+    except Exception as e:
+        print(f'Could not open sample store {args.store} : {e}')
+        sys.exit(1)
+    if args.column is None:
+        for name in store.names():
+            column=store.columns[name]
+            print(f"{name}: {column.count} samples in {column.chunks} chunks, last "
+                  f"{datetime.datetime.fromtimestamp(column.lastTime) if column.count>0 else None}")
+    else:
+        timestamps, values=store.read(args.column)
+        fp=open(args.outfile, 'w', newline='') if args.outfile is not None else sys.stdout
+        try:
+            writer=csv.writer(fp)
+            writer.writerow(["time", args.column])
+            for timestamp, value in zip(timestamps, values):
+                writer.writerow([datetime.datetime.fromtimestamp(timestamp).isoformat(timespec='milliseconds'), value])
+        finally:
+            if fp is not sys.stdout:
+                fp.close()
@@ -0,0 +1,465 @@
+"""TBSimulator.py
+A local TCP stand-in for the ONA-1000 and T-BERD 5800 remote control interfaces,
+for benchmarking and regression testing without tying up real hardware.
+
+Speaks the subset of the protocol used by ONA1000Controls/TBERD5800Controls:
+*REM, *GUI, *RST, :PRTM:LIST?, MOD:FUNC:SEL?/PORT?, :SYST:FUNC:READY?/PORT?,
+:SYST:APPL:LAUN/LAUN?/CAPP?/SEL, :SESS:CREATE/START/END, :INIT, :EXIT, :SYST:ERR?,
+:OUTPUT:OPTIC, :SENS:DATA? STRING:PHYSICAL:QSFP:VEND and the I2C PEEK/POKE register file.
+Each command can be given a latency and jitter, and I2C transactions take i2cTime seconds,
+during which PEEK:REGDATA still returns the previous value, as on the real instruments.
+A trigger clears the SUCCESS flag until the transaction completes; with staleSuccess it is left
+at 1 from the previous transaction instead, so only waiting out the delay gives the new value.
+regdataFormat sets how PEEK:REGDATA is answered, e.g. "#H{:X}" for the hexadecimal form.
+
+Usage from python:
+    sim=InstrumentSimulator("ONA", latency=0.002)
+    sim.start()
+    ona1=ONA1000Controls("127.0.0.1")
+    ona1.baseport=sim.baseport
+    ona1.connect()
+    ...
+    sim.stop()
+Usage from the command line:
+    python TBSimulator.py --type TBERD --port 8000 --latency 0.005 --jitter 0.002
+"""
+from TBControllerCommon import *
+import socketserver
+import random
+import argparse
+
+SIM_MODULE_NAME='TM400G-1' #Module listed by the simulated ONA-1000 :PRTM:LIST?
+SIM_VENDOR='FINISAR CORP.'
+SIM_APPS=["TermEth100GL2Traffic", "TermEth200GL2Traffic", "TermEth400GL2Traffic",
+          "TermEth10GL2Traffic", "TermEth25GL2Traffic", "TermEth100GL2TrafficKP4FEC",
+          "TermEth100GL2TrafficRsFEC"]
+SIM_PORTS=["1", "2"]
+NO_ERROR='0, "No error"'
+
+def putWord(page, register, value):
+    """putWord:
+    Stores a 16 bit big-endian value at register, register+1 of page (bytearray)"""
+    value=int(value) & 0xffff
+    page[register]=value >> 8
+    page[register+1]=value & 0xff
+
+def putText(page, register, text, length=16):
+    """putText:
+    Stores text space-padded to length bytes starting at register of page (bytearray)"""
+    page[register:register+length]=text.ljust(length)[:length].encode('ascii')
+
+def defaultRegisters(serial="SIM00001"):
+    """defaultRegisters:
+    Builds the I2C memory of a simulated QSFP28 module (SFF-8636 layout)
+    Inputs: serial (str) : The vendor serial number
+    Returns dict of {page: bytearray(256)}"""
+    page0=bytearray(256)
+    page0[0]=0x11 #Identifier: QSFP28
+    page0[1]=0x07 #Revision compliance
+    page0[0x80]=0x11
+    putText(page0, 148, SIM_VENDOR)
+    putText(page0, 168, "FTLC1154RDPL")
+    putText(page0, 196, serial)
+    page3=bytearray(256)
+    #Temperature alarm/warning thresholds (1/256 C)
+    putWord(page3, 128, 75*256)
+    putWord(page3, 130, -5*256)
+    putWord(page3, 132, 70*256)
+    putWord(page3, 134, 0)
+    #Vcc thresholds (100 uV)
+    putWord(page3, 144, 36300)
+    putWord(page3, 146, 29700)
+    putWord(page3, 148, 34650)
+    putWord(page3, 150, 31350)
+    #Rx power thresholds (0.1 uW)
+    putWord(page3, 176, 34000)
+    putWord(page3, 178, 500)
+    putWord(page3, 180, 27000)
+    putWord(page3, 182, 1000)
+    #Tx bias thresholds (2 uA)
+    putWord(page3, 184, 37500)
+    putWord(page3, 186, 2500)
+    putWord(page3, 188, 35000)
+    putWord(page3, 190, 5000)
+    #Tx power thresholds (0.1 uW)
+    putWord(page3, 192, 34000)
+    putWord(page3, 194, 500)
+    putWord(page3, 196, 27000)
+    putWord(page3, 198, 1000)
+    return {0x00:page0, 0x03:page3}
+
+class SimulatedModule:
+    """class SimulatedModule:
+    The pluggable module on one port of a simulated instrument: its I2C memory,
+    monitor values and the state of the I2C transaction in progress"""
+    def __init__(self, serial, rng, i2cTime, staleSuccess=False):
+        """Initializes an object of type SimulatedModule
+        Inputs:
+        serial (str) : The vendor serial number
+        rng (random.Random) : Random source for monitor noise
+        i2cTime (float) : Seconds each I2C PEEK/POKE transaction takes
+        staleSuccess (boolean) : Leave SUCCESS set by the previous transaction on a trigger (default False)"""
+        self.pages=defaultRegisters(serial)
+        self.rng=rng
+        self.i2cTime=i2cTime
+        self.staleSuccess=staleSuccess
+        self.laserOn=False
+        self.i2c={"PEEK":{"PAGESEL":0, "REGADDR":0, "REGDATA":0, "SUCCESS":1, "done":0.0, "pending":False},
+                  "POKE":{"PAGESEL":0, "REGADDR":0, "REGDATA":0, "SUCCESS":1, "done":0.0, "pending":False}}
+        self.updateMonitors()
+    def page(self, page):
+        """page:
+        Returns the bytearray of page, creating an empty page if necessary"""
+        if page not in self.pages:
+            self.pages[page]=bytearray(256)
+        return self.pages[page]
+    def updateMonitors(self):
+        """updateMonitors:
+        Refreshes the page 0 monitor registers with new noisy readings"""
+        rng=self.rng
+        page0=self.pages[0x00]
+        putWord(page0, 22, (35.0+rng.gauss(0, 0.5))*256)
+        putWord(page0, 26, 33000+rng.gauss(0, 50))
+        for lane in range(4):
+            #Rx power, Tx bias and Tx power read 0 while the laser is off
+            putWord(page0, 34+2*lane, 8000+rng.gauss(0, 200) if self.laserOn else 0)
+            putWord(page0, 42+2*lane, 20000+rng.gauss(0, 100) if self.laserOn else 0)
+            putWord(page0, 50+2*lane, 10000+rng.gauss(0, 200) if self.laserOn else 0)
+    def trigger(self, kind):
+        """trigger:
+        Starts an I2C transaction of kind "PEEK" or "POKE" """
+        state=self.i2c[kind]
+        if not self.staleSuccess:
+            state["SUCCESS"]=0
+        state["pending"]=True
+        state["done"]=time.monotonic()+self.i2cTime
+    def poll(self, kind):
+        """poll:
+        Completes the transaction of kind if its time has passed
+        Returns the i2c state dict of kind"""
+        state=self.i2c[kind]
+        if state["pending"] and time.monotonic()>=state["done"]:
+            state["pending"]=False
+            state["SUCCESS"]=1
+            page=state["PAGESEL"]
+            register=state["REGADDR"] & 0xff
+            if register<0x80:
+                #Lower memory is the same on every page
+                page=0x00
+            if kind=="PEEK":
+                if page==0x00 and register<0x80:
+                    self.updateMonitors()
+                state["REGDATA"]=self.page(page)[register]
+            else:
+                self.page(page)[register]=state["REGDATA"] & 0xff
+        return state
+
+class SimulatedInstrument:
+    """class SimulatedInstrument:
+    Instrument-wide state shared by every connection: running apps and modules"""
+    def __init__(self, i2cTime, seed=None, staleSuccess=False):
+        """Initializes an object of type SimulatedInstrument
+        Inputs:
+        i2cTime (float) : Seconds each I2C transaction takes
+        seed (int) : Random seed for monitor noise (default None)
+        staleSuccess (boolean) : See SimulatedModule (default False)"""
+        self.lock=threading.RLock()
+        self.rng=random.Random(seed)
+        self.apps=[]
+        self.lastLaunched=""
+        self.launchCount=0
+        self.modules={port: SimulatedModule(f"SIM0000{port}", self.rng, i2cTime, staleSuccess) for port in SIM_PORTS}
+    def appPort(self, appId):
+        """appPort:
+        Returns the instrument port of a running appId (last character of the appId)"""
+        return appId[-1]
+
+class SimConnection:
+    """class SimConnection:
+    Per-connection SCPI command interpreter (error queue and selected app)"""
+    def __init__(self, sim, role):
+        """Initializes an object of type SimConnection
+        Inputs:
+        sim (InstrumentSimulator) : The simulator this connection belongs to
+        role (str) : "BASE", "MODULE" or "RC" """
+        self.sim=sim
+        self.inst=sim.instrument
+        self.role=role
+        self.errors=collections.deque()
+        self.selected=None
+    def error(self, code, msg):
+        """error:
+        Pushes an error onto this connection's error queue"""
+        self.errors.append(f'{code}, "{msg}"')
+    def module(self):
+        """module:
+        Returns the SimulatedModule of the selected app's port, or None if no app is selected"""
+        if self.selected is None or self.selected not in self.inst.apps:
+            return None
+        return self.inst.modules.get(self.inst.appPort(self.selected))
+    def execute(self, cmd):
+        """execute:
+        Runs one SCPI command
+        Returns the response string for queries, None for other commands"""
+        header, sep, arg=cmd.partition(' ')
+        header=header.upper()
+        arg=arg.strip()
+        sim=self.sim
+        if header in ("*REM", "*GUI", "*RST", ":SESS:CREATE", ":SESS:START", ":SESS:END", ":INIT"):
+            return None
+        if header=="*IDN?":
+            return f"VIAVI,{sim.kind},SIM,1.0"
+        if header==":SYST:ERR?":
+            if self.errors:
+                return self.errors.popleft()
+            return NO_ERROR
+        if header==":PRTM:LIST?":
+            return f"{sim.moduleName}: {sim.rcport}"
+        if header=="MOD:FUNC:SEL?":
+            return "ON"
+        if header=="MOD:FUNC:PORT?":
+            return str(sim.moduleport)
+        if header==":SYST:FUNC:READY?":
+            return "1"
+        if header==":SYST:FUNC:PORT?":
+            return str(sim.rcport)
+        with self.inst.lock:
+            return self.executeApp(header, arg)
+    def executeApp(self, header, arg):
+        """executeApp:
+        Runs the app, laser and I2C commands of the RC port
+        Returns the response string for queries, None for other commands"""
+        inst=self.inst
+        if header==":SYST:APPL:CAPP?":
+            return ",".join(inst.apps)
+        if header==":SYST:APPL:LAUN?":
+            return inst.lastLaunched
+        if header==":SYST:APPL:LAUN":
+            args=arg.split()
+            if len(args)==0 or args[0] not in SIM_APPS:
+                self.error(-224, "Illegal parameter value")
+                return None
+            port=args[1] if len(args)>1 else SIM_PORTS[0]
+            if port not in SIM_PORTS or port in [inst.appPort(x) for x in inst.apps]:
+                self.error(-221, "Settings conflict")
+                return None
+            inst.launchCount+=1
+            appId=f"{args[0]}_{inst.launchCount}{port}"
+            inst.apps.append(appId)
+            inst.lastLaunched=appId
+            return None
+        if header==":SYST:APPL:SEL":
+            if arg not in inst.apps:
+                self.error(-224, "Illegal parameter value")
+                return None
+            self.selected=arg
+            return None
+        if header==":EXIT":
+            if self.selected in inst.apps:
+                inst.apps.remove(self.selected)
+            self.selected=None
+            return None
+        module=self.module()
+        if header.startswith(":OUTPUT:OPTIC"):
+            if module is None:
+                self.error(-221, "Settings conflict")
+                return "OFF" if header.endswith("?") else None
+            if header.endswith("?"):
+                return "ON" if module.laserOn else "OFF"
+            module.laserOn=arg.upper()=="ON"
+            return None
+        if header.startswith(":SENSE:EXPERT:I2C:"):
+            fields=header.split(':')
+            if module is None or len(fields)<6 or fields[4] not in ("PEEK", "POKE"):
+                self.error(-113, "Undefined header")
+                return None
+            state=module.poll(fields[4])
+            if fields[5]=="TRIGGER":
+                module.trigger(fields[4])
+            elif fields[5] in ("PAGESEL", "REGADDR", "REGDATA"):
+                try:
+                    state[fields[5]]=getInt(arg)
+                except ValueError:
+                    self.error(-224, "Illegal parameter value")
+            else:
+                self.error(-113, "Undefined header")
+            return None
+        if header in (":SENS:DATA?", ":SENSE:DATA?"):
+            fields=arg.upper().split(':')
+            if arg.upper()=="STRING:PHYSICAL:QSFP:VEND":
+                return f'"{SIM_VENDOR}"'
+            if module is not None and len(fields)==6 and fields[4] in ("PEEK", "POKE"):
+                state=module.poll(fields[4])
+                if fields[5]=="REGDATA" and fields[4]=="PEEK":
+                    return self.sim.regdataFormat.format(state["REGDATA"])
+                if fields[5] in ("REGDATA", "SUCCESS"):
+                    return str(state[fields[5]])
+            self.error(-113, "Undefined header")
+            return ""
+        self.error(-113, "Undefined header")
+        if header.endswith("?"):
+            return ""
+        return None
+
+class SimHandler(socketserver.StreamRequestHandler):
+    """class SimHandler:
+    Reads newline-terminated SCPI lines from one client and writes the responses.
+    Commands joined with ';' on one line are answered on one line joined with ';'"""
+    def setup(self):
+        super().setup()
+        #Answer each command as soon as it is processed, as the instruments do
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    def handle(self):
+        sim=self.server.sim
+        conn=SimConnection(sim, self.server.role)
+        for raw in self.rfile:
+            line=raw.decode("utf-8", "replace").strip()
+            if line=="":
+                continue
+            resps=[]
+            for cmd in splitScpiResponse(line):
+                cmd=cmd.strip()
+                if cmd=="":
+                    continue
+                sim.delay(cmd)
+                sim.count(cmd)
+                resp=conn.execute(cmd)
+                if resp is not None:
+                    resps.append(resp)
+            if len(resps)>0:
+                try:
+                    self.wfile.write((';'.join(resps)+"\n").encode("utf-8"))
+                except OSError:
+                    return
+
+class SimServer(socketserver.ThreadingTCPServer):
+    """class SimServer:
+    One listening port of the simulator"""
+    allow_reuse_address=True
+    daemon_threads=True
+    request_queue_size=128
+
+class InstrumentSimulator:
+    """class InstrumentSimulator:
+    A local simulated ONA-1000 or T-BERD 5800
+    ONA: base port answers :PRTM:LIST? with the RC port
+    TBERD: base port answers MOD:FUNC:PORT? with the module port,
+           which answers :SYST:FUNC:PORT? with the RC port"""
+    def __init__(self, kind="ONA", host="127.0.0.1", baseport=0, latency=0.0, jitter=0.0,
+                 commandLatency=None, i2cTime=0.05, moduleName=SIM_MODULE_NAME, seed=None, staleSuccess=False,
+                 regdataFormat="{:d}"):
+        """Initializes an object of type InstrumentSimulator
+        Inputs:
+        kind (str) : "ONA" or "TBERD" (default "ONA")
+        host (str) : The address to listen on (default "127.0.0.1")
+        baseport (int) : The base port; 0 picks a free port (default 0)
+        latency (float) : Seconds each command takes to process (default 0)
+        jitter (float) : Extra random seconds, uniform from 0 to jitter, per command (default 0)
+        commandLatency (dict) : {command prefix: (latency, jitter)} overrides, longest prefix wins,
+                                e.g. {":SYST:APPL:LAUN ": (2.0, 0.5)}
+        i2cTime (float) : Seconds each I2C PEEK/POKE transaction takes (default 0.05)
+        moduleName (str) : The module name listed by :PRTM:LIST? (default SIM_MODULE_NAME)
+        seed (int) : Random seed for jitter and monitor noise (default None)
+        staleSuccess (boolean) : A trigger leaves the previous SUCCESS flag set instead of clearing it
+                                 (default False)
+        regdataFormat (str) : Format of PEEK:REGDATA answers (default "{:d}", decimal)"""
+        kind=kind.upper()
+        if kind not in ("ONA", "TBERD"):
+            raise ValueError(f"Simulator type {kind} must be ONA or TBERD")
+        self.kind=kind
+        self.host=host
+        self.requestedport=baseport
+        self.latency=latency
+        self.jitter=jitter
+        self.moduleName=moduleName
+        self.regdataFormat=regdataFormat
+        self.rng=random.Random(seed)
+        self.setCommandLatency(commandLatency or {})
+        self.instrument=SimulatedInstrument(i2cTime, seed, staleSuccess)
+        self.stats=collections.Counter()
+        self.statslock=threading.Lock()
+        self.servers=[]
+        self.baseport=None
+        self.moduleport=None
+        self.rcport=None
+    def setCommandLatency(self, commandLatency):
+        """setCommandLatency:
+        Replaces the per-command latency overrides
+        Inputs: commandLatency (dict) : {command prefix: (latency, jitter)}"""
+        self.commandLatency=sorted(((prefix.upper(), lat) for prefix, lat in commandLatency.items()),
+                                   key=lambda x: len(x[0]), reverse=True)
+    def delay(self, cmd):
+        """delay:
+        Sleeps for the latency configured for cmd"""
+        latency, jitter=self.latency, self.jitter
+        ucmd=cmd.upper()
+        for prefix, lat in self.commandLatency:
+            if ucmd.startswith(prefix):
+                latency, jitter=lat
+                break
+        if jitter>0:
+            latency+=self.rng.uniform(0, jitter)
+        if latency>0:
+            time.sleep(latency)
+    def count(self, cmd):
+        """count:
+        Counts a received command by its header"""
+        with self.statslock:
+            self.stats[cmd.split(' ', 1)[0].upper()]+=1
+    def serve(self, port, role):
+        """serve:
+        Starts one listening server in a background thread
+        Returns the port it listens on"""
+        server=SimServer((self.host, port), SimHandler)
+        server.sim=self
+        server.role=role
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.servers.append(server)
+        return server.server_address[1]
+    def start(self):
+        """start:
+        Starts listening; sets baseport, moduleport and rcport
+        Returns the base port"""
+        self.rcport=self.serve(0, "RC")
+        if self.kind=="TBERD":
+            self.moduleport=self.serve(0, "MODULE")
+        self.baseport=self.serve(self.requestedport, "BASE")
+        writelog(f"{self.kind} simulator listening on {self.host}:{self.baseport} (RC port {self.rcport})")
+        return self.baseport
+    def stop(self):
+        """stop:
+        Stops all listening servers"""
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers=[]
+    def __enter__(self):
+        self.start()
+        return self
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+        return False
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser()
+    parser.add_argument('--type', '-t', help='Instrument type, ONA or TBERD', default='ONA')
+    parser.add_argument('--host', help='Address to listen on', default='127.0.0.1')
+    parser.add_argument('--port', '-p', type=int, help='Base port (5025 for ONA, 8000 for TBERD)')
+    parser.add_argument('--latency', '-L', type=float, default=0.0, help='Seconds per command')
+    parser.add_argument('--jitter', '-J', type=float, default=0.0, help='Extra random seconds per command')
+    parser.add_argument('--i2ctime', type=float, default=0.05, help='Seconds per I2C transaction')
+    parser.add_argument('--launchtime', type=float, default=0.0, help='Seconds per application launch')
+    parser.add_argument('--stalesuccess', action='store_true', help='Leave the I2C SUCCESS flag set from the previous transaction on a trigger')
+    args=parser.parse_args()
+    port=args.port
+    if port is None:
+        port=8000 if args.type.upper()=="TBERD" else 5025
+    sim=InstrumentSimulator(args.type, args.host, port, args.latency, args.jitter,
+                            {":SYST:APPL:LAUN ": (args.launchtime, 0.0)}, args.i2ctime,
+                            staleSuccess=args.stalesuccess)
+    sim.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        sim.stop()
@@ -0,0 +1,53 @@
+"""test_TBDdm.py
+Checks the DDM flag decoding of TBDdm against known register bytes for both layouts.
+Usage:
+    python -m pytest test_TBDdm.py
+"""
+from TBDdm import *
+import math
+
+def decodeRow(layout, page, base, row):
+    """decodeRow:
+    Decodes the flags of one dump row of page starting at register base
+    Returns dict of {flag name: 1.0 or 0.0} for the flags in the row"""
+    samples=RegisterSamples.fromDumps([1.0], [row], page=page, base=base)
+    decoded=samples.decode(layout)
+    return {name: decoded[name][0] for name, fpage, register, bit in flagFields(layout) if name in decoded}
+
+def test_sff8636Flags():
+    row=[0]*15
+    row[0x03]=0b00100001 #Rx LOS lane 1, Tx LOS lane 2
+    row[0x04]=0b00000100 #Tx fault lane 3
+    row[0x06]=0b10000000 #Temperature high alarm
+    row[0x07]=0b00010000 #Vcc low warning
+    row[0x09]=0b00000010 #Rx power lane 2 high warning
+    row[0x0c]=0b00000001 #Tx bias lane 4 low warning
+    row[0x0d]=0b01000000 #Tx power lane 1 low alarm
+    flags=decodeRow("SFF8636", 0x00, 0x00, row)
+    expected={"rxLos1", "txLos2", "txFault3", "temperatureHighAlarm", "vccLowWarning",
+              "rxPower2HighWarning", "txBias4LowWarning", "txPower1LowAlarm"}
+    assert {name for name, value in flags.items() if value==1.0}==expected
+    assert all(value==0.0 for name, value in flags.items() if name not in expected)
+
+def test_cmisFlags():
+    row=[0]*32
+    row[134-0x80]=0xff #Data Path State Changed, not a decoded flag
+    row[135-0x80]=0b00000001 #Tx fault lane 1
+    row[136-0x80]=0b00000010 #Tx LOS lane 2
+    row[139-0x80]=0b00000100 #Tx power lane 3 high alarm
+    row[146-0x80]=0b00001000 #Tx bias lane 4 low warning
+    row[147-0x80]=0b00010000 #Rx LOS lane 5
+    row[148-0x80]=0xff #Rx LOL, not a decoded flag
+    row[150-0x80]=0b10000000 #Rx power lane 8 low alarm
+    flags=decodeRow("CMIS", 0x11, 0x80, row)
+    expected={"txFault1", "txLos2", "txPower3HighAlarm", "txBias4LowWarning", "rxLos5",
+              "rxPower8LowAlarm"}
+    assert {name for name, value in flags.items() if value==1.0}==expected
+    assert all(value==0.0 for name, value in flags.items() if name not in expected)
+    #Lower page flags were not sampled
+    assert "temperatureHighAlarm" not in flags
+
+def test_missingReadIsNaN():
+    samples=RegisterSamples.fromDumps([1.0, 2.0], [[0, 0, 0, 0x01], [0, 0, 0, None]])
+    rxLos=samples.decode("SFF8636")["rxLos1"]
+    assert rxLos[0]==1.0 and math.isnan(rxLos[1])
@@ -0,0 +1,58 @@
+"""test_TBDispatcher.py
+Checks that threads sharing one controller through its dispatcher do not see each other's
+commands, responses or errors, against TBSimulator.
+Usage:
+    python -m pytest test_TBDispatcher.py
+"""
+from ONA1000Controls import *
+from TBSimulator import InstrumentSimulator
+import pytest
+
+APPNAME="TermEth100GL2Traffic 1"
+
+@pytest.fixture
+def ona():
+    """ona:
+    Yields an ONA1000Controls connected to TermEth100GL2Traffic on a simulator, with its dispatcher running"""
+    with InstrumentSimulator("ONA", latency=0.002, seed=1) as sim:
+        ctrl=ONA1000Controls("127.0.0.1")
+        ctrl.baseport=sim.baseport
+        assert ctrl.connect(usePool=False)
+        assert ctrl.connectToApp(APPNAME)
+        ctrl.startDispatcher()
+        yield ctrl
+        ctrl.stopDispatcher()
+        ctrl.socketClose()
+
+def test_deferErrorsIsolatedFromOtherThreads(ona):
+    started=threading.Event()
+    results={}
+    def deferring():
+        with ona.deferErrors() as errs:
+            ona.sendscpi(":SYST:APPL:SEL bogusA")
+            started.set()
+            #Give the other thread time to send while the block is open
+            time.sleep(0.3)
+            ona.sendscpi(":OUTPUT:OPTIC ON")
+        results["errors"]=errs.errors
+    def other():
+        started.wait(5)
+        results["command"]=ona.sendscpi(":SYST:APPL:SEL bogusB")
+        results["query"]=ona.sendscpi(":OUTPUT:OPTIC?")
+    threads=[threading.Thread(target=deferring), threading.Thread(target=other)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    #The block only collects its own errors...
+    assert [cmd for cmd, code, msg in results["errors"]]==[":SYST:APPL:SEL bogusA"]
+    #...and the other thread gets its own error check and query response
+    assert "-224" in results["command"]
+    assert results["query"]=="ON"
+
+def test_submitWhileStopping(ona):
+    #Calls queued while the dispatcher stops either run or fail; none is left waiting
+    futures=[ona.submit(ona.sendscpi, ":OUTPUT:OPTIC?") for idx in range(20)]
+    ona.stopDispatcher()
+    for future in futures:
+        assert future.result(5) in ("ON", "OFF")
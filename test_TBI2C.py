@@ -0,0 +1,63 @@
+"""test_TBI2C.py
+Checks PEEK/POKE completion polling against TBSimulator.
+Usage:
+    python -m pytest test_TBI2C.py
+"""
+from ONA1000Controls import *
+from TBSimulator import InstrumentSimulator
+import pytest
+
+APPNAME="TermEth100GL2Traffic 1"
+
+@pytest.fixture(params=[False, True], ids=["clearedSuccess", "staleSuccess"])
+def ona(request):
+    """ona:
+    Yields an ONA1000Controls connected to TermEth100GL2Traffic on a simulator whose I2C
+    transactions take 0.4 s, with and without a SUCCESS flag left over from the last transaction"""
+    with InstrumentSimulator("ONA", i2cTime=0.4, seed=1, staleSuccess=request.param) as sim:
+        ctrl=connectToSim(sim)
+        yield ctrl
+        ctrl.socketClose()
+
+def connectToSim(sim):
+    """connectToSim:
+    Returns an ONA1000Controls connected to TermEth100GL2Traffic on sim"""
+    ctrl=ONA1000Controls("127.0.0.1")
+    ctrl.baseport=sim.baseport
+    assert ctrl.connect(usePool=False)
+    assert ctrl.connectToApp(APPNAME)
+    return ctrl
+
+def test_peekPollReadsNewValue(ona):
+    ona.poke(0x90, 0x5a, page=3, delay=1.0, poll=True)
+    ona.poke(0x91, 0xa5, page=3, delay=1.0, poll=True)
+    #Each PEEK must wait for its own transaction, not return the previous register's value
+    assert ona.peek(0x90, page=3, delay=1.0, poll=True)==0x5a
+    assert ona.peek(0x91, page=3, delay=1.0, poll=True)==0xa5
+    assert ona.peek_list([(3, 0x90), (3, 0x91)], delay=1.0, poll=True)==[0x5a, 0xa5]
+
+@pytest.mark.parametrize("poll", [False, True])
+def test_peekListFailedRead(poll):
+    with InstrumentSimulator("ONA", i2cTime=0.4, seed=1) as sim:
+        ctrl=connectToSim(sim)
+        ctrl.enableRegisterCache()
+        #The transactions cannot complete within delay, so no value may be returned or cached
+        assert ctrl.peek_list([(0, 0x80), (0, 0x81)], delay=0.1, poll=poll)==[None, None]
+        assert ctrl.dump_page(0x00, delay=0.0, poll=poll) is None
+        assert len(ctrl.regcache.values)==0
+        ctrl.socketClose()
+
+@pytest.mark.parametrize("regdataFormat", ["#H{:X}", "0x{:x}", "{:.1f}"])
+def test_peekListParsesRegdata(regdataFormat):
+    with InstrumentSimulator("ONA", i2cTime=0.0, seed=1, regdataFormat=regdataFormat) as sim:
+        ctrl=connectToSim(sim)
+        ctrl.enableRegisterCache()
+        ctrl.poke(0x90, 0x5a, page=3, delay=0.2, poll=True)
+        assert ctrl.peek(0x90, page=3, delay=0.2, poll=True)==0x5a
+        values=ctrl.peek_list([(3, 0x90), (0, 0x80), (0, 0x81)], delay=0.2, poll=True)
+        assert values[0]==0x5a and all(type(value) is int for value in values)
+        #Cached values are ints too
+        assert ctrl.peek_list([(0, 0x80), (0, 0x81)], delay=0.2, poll=True)==values[1:]
+        page=ctrl.dump_page(0x00, delay=0.0, poll=False)
+        assert isinstance(page, bytes) and len(page)==256
+        ctrl.socketClose()
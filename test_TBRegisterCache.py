@@ -0,0 +1,91 @@
+"""test_TBRegisterCache.py
+Checks that the register cache of Controller_base serves repeated peeks and drops values that a
+poke, a page change, an app relaunch or an expired TTL has made stale, against TBSimulator.
+The simulated module's memory is changed behind the controller's back, so a peek that returns the
+new value must have read the module rather than the cache.
+Usage:
+    python -m pytest test_TBRegisterCache.py
+"""
+from ONA1000Controls import *
+from TBSimulator import InstrumentSimulator
+import pytest
+
+APPNAME="TermEth100GL2Traffic 1"
+I2C={"delay":0.05, "poll":False} #The simulated I2C transactions complete at once
+VENDOR=148 #First byte of the vendor name, "F" on the simulated module
+
+@pytest.fixture
+def sim():
+    """sim:
+    Yields a simulator whose I2C transactions complete at once"""
+    with InstrumentSimulator("ONA", i2cTime=0.0, seed=1) as sim:
+        yield sim
+
+@pytest.fixture
+def ona(sim):
+    """ona:
+    Yields an ONA1000Controls connected to TermEth100GL2Traffic on sim, with the register cache on"""
+    ctrl=ONA1000Controls("127.0.0.1")
+    ctrl.baseport=sim.baseport
+    assert ctrl.connect(usePool=False)
+    assert ctrl.connectToApp(APPNAME)
+    ctrl.enableRegisterCache()
+    yield ctrl
+    ctrl.socketClose()
+
+def setRegister(sim, page, register, value):
+    """setRegister:
+    Changes a register of the module on port 1 of sim without going through the controller"""
+    sim.instrument.modules["1"].page(page)[register]=value
+
+def test_repeatedPeekIsCached(sim, ona):
+    assert ona.peek(0x80, page=0, **I2C)==0x11
+    setRegister(sim, 0x00, 0x80, 0x22)
+    #A static register is read once
+    assert ona.peek(0x80, page=0, **I2C)==0x11
+    assert ona.peek_list([(0, 0x80)], **I2C)==[0x11]
+    assert ona.regcache.hits==2
+
+def test_volatileRegisterNotCached(sim, ona):
+    #The status byte is volatile by default
+    ona.peek(0x02, page=0, **I2C)
+    setRegister(sim, 0x00, 0x02, 0x5a)
+    assert ona.peek(0x02, page=0, **I2C)==0x5a
+
+def test_pokeInvalidatesRegister(sim, ona):
+    assert ona.peek_list([(0, 0x80), (0, VENDOR)], **I2C)==[0x11, ord('F')]
+    setRegister(sim, 0x00, VENDOR, 0x33)
+    ona.poke(0x80, 0x44, page=0, **I2C)
+    #The poked register is read again; the other one is still served from the cache
+    assert ona.peek(0x80, page=0, **I2C)==0x44
+    assert ona.peek(VENDOR, page=0, **I2C)==ord('F')
+
+def test_pageSelectInvalidatesPort(sim, ona):
+    assert ona.peek_list([(0, 0x80), (0, VENDOR)], **I2C)==[0x11, ord('F')]
+    setRegister(sim, 0x00, 0x80, 0x22)
+    setRegister(sim, 0x00, VENDOR, 0x33)
+    #Upper memory maps a different page after a write to the page select register
+    ona.poke(PAGESELECTREGISTER, 0x03, page=0, **I2C)
+    assert len(ona.regcache.values)==0
+    assert ona.peek_list([(0, 0x80), (0, VENDOR)], **I2C)==[0x22, 0x33]
+
+def test_appRelaunchInvalidates(sim, ona):
+    assert ona.peek(0x80, page=0, **I2C)==0x11
+    setRegister(sim, 0x00, 0x80, 0x22)
+    appId=ona.curr.getAppId()
+    assert ona.closeApplication(appId)
+    assert len(ona.regcache.values)==0
+    assert ona.connectToApp(APPNAME)
+    assert ona.peek(0x80, page=0, **I2C)==0x22
+    #Launching an app also drops what was cached before it
+    setRegister(sim, 0x00, 0x80, 0x33)
+    ona.launchApplication("TermEth100GL2Traffic", ["2"])
+    assert len(ona.regcache.values)==0
+
+def test_ttlExpires(sim, ona):
+    ona.enableRegisterCache(rules=[(0x00, 0x80, 0xff, 0.5)])
+    assert ona.peek(0x80, page=0, **I2C)==0x11
+    setRegister(sim, 0x00, 0x80, 0x22)
+    assert ona.peek(0x80, page=0, **I2C)==0x11
+    time.sleep(0.6)
+    assert ona.peek(0x80, page=0, **I2C)==0x22
@@ -0,0 +1,100 @@
+"""test_TBResultSink.py
+Checks that results written by each TBResultSink format read back as they were written.
+Usage:
+    python -m pytest test_TBResultSink.py
+"""
+from TBResultSink import *
+import TBResultSink
+import pytest
+
+START=datetime.datetime(2024, 5, 17, 9, 30, 0, 125000)
+#(index, command, result, latency)
+ROWS=[(1, "PEEK 0 0x80", 0x11, 0.25),
+      (2, "POKE 3 0x90 0x5a", True, 0.5),
+      (3, "SCPI :SENS:DATA? STRING:PHYSICAL:QSFP:VEND", '"FINISAR CORP."', 0.01),
+      (4, "SCPI :SENSE:DATA? CUR:LANE1:RX:POW", "-2.5", None),
+      (5, "PEEK 0x81", None, 1.0),
+      (6, "DELAY 0.5", True, 0.5),
+      (1, "PEEK 0 0x80", 0x12, 0.25)]
+#The results loadResults gives back for ROWS: numbers as numbers, failed commands as False
+BINARYRESULTS=[0x11, True, '"FINISAR CORP."', -2.5, False, True, 0x12]
+
+def writeRows(path, fmt, rows=ROWS):
+    """writeRows:
+    Writes rows to path with the sink for fmt, one second apart from START
+    Returns list of the timestamps written"""
+    stamps=[START+datetime.timedelta(seconds=idx) for idx in range(len(rows))]
+    with openResultSink(str(path), fmt=fmt, syncInterval=None) as sink:
+        for (index, command, result, latency), stamp in zip(rows, stamps):
+            sink.write(index, command, result, timestamp=stamp, latency=latency)
+    return stamps
+
+def test_textRoundTrip(tmp_path):
+    path=tmp_path/"results.txt"
+    stamps=writeRows(path, "text")
+    lines=path.read_text().splitlines()
+    assert lines==[f"{formatTime(stamp)} ({index}) {command} returned {formatResult(result)}"
+                   for (index, command, result, latency), stamp in zip(ROWS, stamps)]
+    assert lines[0].endswith("(1) PEEK 0 0x80 returned 0x11")
+
+def test_jsonlRoundTrip(tmp_path):
+    path=tmp_path/"results.jsonl"
+    stamps=writeRows(path, None)
+    records=[json.loads(line) for line in path.read_text().splitlines()]
+    assert records==[{"index":index, "command":command, "result":result, "time":formatTime(stamp)}
+                     for (index, command, result, latency), stamp in zip(ROWS, stamps)]
+
+def test_csvRoundTrip(tmp_path):
+    path=tmp_path/"results.csv"
+    stamps=writeRows(path, None)
+    with open(path, newline='') as fp:
+        rows=list(csv.reader(fp))
+    assert rows[0]==["index", "command", "result", "time"]
+    assert rows[1:]==[[str(index), command, formatResult(result), formatTime(stamp)]
+                      for (index, command, result, latency), stamp in zip(ROWS, stamps)]
+
+def checkBinary(results, rows, stamps):
+    """checkBinary:
+    Checks the ResultColumns read back against the rows and timestamps written"""
+    assert len(results)==len(rows)
+    for record, ((index, command, result, latency), stamp) in enumerate(zip(rows, stamps)):
+        assert results.commands[index]==command
+        assert results["index"][record]==index
+        assert results["time"][record]==stamp.timestamp()
+        if latency is None:
+            assert math.isnan(results["latency"][record])
+        else:
+            assert results["latency"][record]==pytest.approx(latency)
+        op, page, register=commandFields(command)
+        assert (results["op"][record], results["page"][record], results["register"][record])==(op, page, register)
+    assert [results.result(record) for record in range(len(results))]==BINARYRESULTS[:len(rows)]
+
+def test_binaryRoundTrip(tmp_path):
+    path=tmp_path/"results.tbr"
+    stamps=writeRows(path, None)
+    results=loadResults(str(path))
+    checkBinary(results, ROWS, stamps)
+    assert (results["page"][1], results["register"][1])==(3, 0x90)
+    assert results["status"][2]==STATUSTEXT
+
+def test_binaryBlocks(tmp_path, monkeypatch):
+    #Several blocks, the text record and new commands falling in a later block
+    monkeypatch.setattr(TBResultSink, "BINARYBLOCKSIZE", 2)
+    path=tmp_path/"results.tbr"
+    stamps=writeRows(path, "bin")
+    checkBinary(loadResults(str(path)), ROWS, stamps)
+
+def test_binaryTruncated(tmp_path, monkeypatch):
+    #A block cut short by a crash is dropped; the blocks before it still load
+    monkeypatch.setattr(TBResultSink, "BINARYBLOCKSIZE", 4)
+    path=tmp_path/"results.tbr"
+    stamps=writeRows(path, "bin")
+    data=path.read_bytes()
+    path.write_bytes(data[:-3])
+    checkBinary(loadResults(str(path)), ROWS[:4], stamps[:4])
+
+def test_binaryNotResultFile(tmp_path):
+    path=tmp_path/"results.jsonl"
+    writeRows(path, "jsonl")
+    with pytest.raises(ValueError):
+        loadResults(str(path))
@@ -0,0 +1,72 @@
+"""test_TBScpiParse.py
+Checks the SCPI response parsers of TBControllerCommon and ONA1000Controls against known replies,
+including malformed ones, which must give None (or the stripped reply) rather than raise.
+Usage:
+    python -m pytest test_TBScpiParse.py
+"""
+from ONA1000Controls import *
+import pytest
+
+@pytest.mark.parametrize("resp, expected", [
+    ("90", 90), (" 42 ", 42), ("+7", 7), ("-3", -3),
+    ("#H5A", 0x5a), ("#Q17", 0o17), ("#B101", 0b101), ("0x1F", 0x1f), ("0X1f", 0x1f),
+    ("90.0", 90), ("1e2", 100)])
+def test_parseScpiInt(resp, expected):
+    value=parseScpiInt(resp)
+    assert value==expected and type(value) is int
+
+@pytest.mark.parametrize("resp", [None, "", "abc", "1.5", "#H", "#HZZ", "#B102", "#Q19", "0x"])
+def test_parseScpiIntMalformed(resp):
+    assert parseScpiInt(resp) is None
+
+def test_parseScpiFloatAndBool():
+    assert parseScpiFloat("-1.25E+01")==-12.5
+    assert parseScpiFloat("#H10")==16.0
+    assert parseScpiFloat("n/a") is None
+    assert [parseScpiBool(x) for x in ("1", "OFF", "true", " On ", "maybe")]==[True, False, True, True, None]
+
+@pytest.mark.parametrize("resp, expected", [
+    ('"TM400G-1"', "TM400G-1"), ('"say ""hi"""', 'say "hi"'), ('""', ""), ('""""', '"'),
+    (" plain ", "plain"), ('"open', '"open'), ('"a" "b"', '"a" "b"'), (None, None)])
+def test_parseScpiString(resp, expected):
+    assert parseScpiString(resp)==expected
+
+@pytest.mark.parametrize("resp, expected", [
+    ('0, "No error"', (0, "No error")),
+    ('-113,"Undefined header"', (-113, "Undefined header")),
+    ('5, "quote ""x"""', (5, 'quote "x"')),
+    ("-350", (-350, "")),
+    #The return of sendscpi for a non-query command: the echo, then :SYST:ERR? and its reply
+    (':OUTPUT:OPTIC ON :SYST:ERR? -224,"Illegal parameter value"', (-224, "Illegal parameter value")),
+    ("garbage", (None, "garbage")), ("", (None, "")), (None, (None, ""))])
+def test_parseScpiError(resp, expected):
+    assert parseScpiError(resp)==expected
+
+def test_scpiSucceeded():
+    assert scpiSucceeded('0, "No error"')
+    assert not scpiSucceeded('-224,"Illegal parameter value"')
+    assert not scpiSucceeded(None)
+
+def test_parseScpiList():
+    #Separators inside quoted strings are kept, and empty items dropped
+    assert parseScpiList('1, 2.5, "a,b", x,,')==[1, 2.5, '"a,b"', "x"]
+    assert parseScpiList("a;b", parse=None, sep=';')==["a", "b"]
+    assert parseScpiList("#H10,#H20", parse=parseScpiInt)==[16, 32]
+    assert parseScpiList(None)==[]
+    #An unterminated quote swallows the rest of the reply instead of raising
+    assert parseScpiList('"open, x')==['"open, x']
+
+def test_parseScpiMap():
+    assert parseScpiMap('a: 1, b: "x:y, z"\nc:3, junk')=={"a": "1", "b": '"x:y, z"', "c": "3"}
+    assert parseScpiMap("a: 1, b: 2", parse=parseScpiInt)=={"a": 1, "b": 2}
+    assert parseScpiMap(None)=={}
+
+def test_parseModuleList():
+    resp="TM400G-1: 8002, TM400G-2: 8003\nOTHER: 8004\n"
+    assert parseModuleList(resp)=={"TM400G-1": "8002", "TM400G-2": "8003", "OTHER": "8004"}
+    assert parseModuleList("")=={}
+    assert parseModuleList(None)=={}
+
+def test_scpiParsersByName():
+    assert SCPIPARSERS["int"]("#B11")==3
+    assert SCPIPARSERS["list"]("1,2")==[1, 2]